@@ -0,0 +1,318 @@
+# Allocation accounting
+#
+# An AllocationTracker follows the memory the game allocates with
+# tracemalloc, frame by frame and per scene (game_state). At the end of
+# every frame it records how far allocations rose above what was live when
+# the frame started (the frame's peak, the temporary objects it made) and
+# how much of that was still live at the end (net, what the frame kept),
+# plus how many garbage collections ran and how far the game's own
+# counters moved (the game counts the fonts it loads and the text it
+# renders, which tracemalloc can't see). Every SAMPLE_INTERVAL frames it
+# takes a snapshot and compares it with the last one, which gives the call
+# sites whose memory grew the most in between.
+#
+# tracemalloc only sees memory Python allocates (objects, lists, ...), not
+# what pygame allocates for surfaces and fonts. It slows the game down
+# while tracing, so the tracker is off until started (F11 in the game, or
+# CLONETRIS_ALLOCS=1 from launch).
+#
+# The budget check plays games (and sits on the menus) with the game
+# loaded under the dummy video driver and fails when the steady state
+# allocations of a scene go over BUDGETS:
+#
+#   python allocs.py check [--frames N] [--warmup N] [--seed N]
+
+import fnmatch
+import gc
+import os
+import sys
+import tracemalloc
+
+# Frames of traceback kept for each allocation (1 is just the call site)
+TRACE_DEPTH = 1
+
+# Frames between call site snapshots, and how many sites reports show
+SAMPLE_INTERVAL = 600
+TOP_SITES = 10
+
+# Files left out of the call sites (tracemalloc's and the tracker's)
+EXCLUDED_FILES = (tracemalloc.__file__, __file__)
+
+SCENE_NAMES = {0: "splash", 1: "menu", 2: "game", 3: "score", 4: "spectate", 5: "replay", 6: "wall", 7: "demo"}
+
+# The budget check's limits for each scene it plays: the mean peak and the
+# mean net bytes per frame in steady state, and the most of each counter
+# per frame
+BUDGETS = {1: (1024, 16), 2: (4096, 16), 3: (1024, 16)}
+COUNTER_BUDGETS = {"fonts": 0, "texts": 0.05}
+CHECK_FRAMES = 3000
+CHECK_WARMUP = 600
+
+class SceneStats:
+    def __init__(self):
+        self.frames = 0
+        self.peak_total = 0
+        self.peak_max = 0
+        self.net_total = 0
+        self.collections = 0
+        self.counts = {}
+
+    def add(self, peak, net, collections, counts):
+        self.frames += 1
+        self.peak_total += peak
+        self.peak_max = max(self.peak_max, peak)
+        self.net_total += net
+        self.collections += collections
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+
+    def mean_peak(self):
+        return self.peak_total / max(1, self.frames)
+
+    def mean_net(self):
+        return self.net_total / max(1, self.frames)
+
+    def mean_count(self, name):
+        return self.counts.get(name, 0) / max(1, self.frames)
+
+# counters (optional) returns a dict of running totals to follow, such as
+# {"fonts": fonts loaded, "texts": text rendered}
+class AllocationTracker:
+    def __init__(self, counters=None, trace_depth=TRACE_DEPTH, sample_interval=SAMPLE_INTERVAL):
+        self.counters = counters
+        self.trace_depth = trace_depth
+        self.sample_interval = sample_interval
+        self.active = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.scenes = {}
+        self.frames = 0
+        self.last_peak = 0
+        self.last_net = 0
+        self.frame_start = 0
+        self.collections = 0
+        self.counts = {}
+        self.overhead = (0, 0)
+        self.snapshot = None
+        self.top_sites = []
+
+    # Starts tracing (tracemalloc) from the next frame
+    def start(self):
+        if self.active:
+            return
+        self.reset_stats()
+        # (matching a file name compiles a pattern the first time, which
+        # would show up as growth)
+        for file_path in EXCLUDED_FILES:
+            fnmatch.fnmatch(file_path, file_path)
+        tracemalloc.start(self.trace_depth)
+        self.active = True
+        self.snapshot = self._take_snapshot()
+        self._measure_overhead()
+        self.begin_frame()
+
+    # Stops tracing. Returns the report.
+    def stop(self):
+        if not self.active:
+            return None
+        self._sample()
+        report = self.report()
+        tracemalloc.stop()
+        self.active = False
+        self.snapshot = None
+        return report
+
+    # Starts or stops tracing, returns the report when it stops
+    def toggle(self):
+        if self.active:
+            return self.stop()
+        self.start()
+        return None
+
+    # Marks the start of a frame (end_frame() does this for the next one,
+    # call it to leave out work done in between)
+    def begin_frame(self):
+        self.collections = _count_collections()
+        if self.counters:
+            self.counts = self.counters()
+        tracemalloc.reset_peak()
+        self.frame_start = tracemalloc.get_traced_memory()[0]
+
+    # Records the frame that just ended under a scene and starts the next
+    def end_frame(self, scene):
+        self._record(scene)
+        # (with _record()'s locals gone, so they don't count towards the
+        # next frame)
+        self.begin_frame()
+
+    def _record(self, scene):
+        current, peak = tracemalloc.get_traced_memory()
+        self.last_peak = max(0, peak - self.frame_start - self.overhead[0])
+        self.last_net = current - self.frame_start - self.overhead[1]
+        collections = _count_collections() - self.collections
+        counts = {}
+        if self.counters:
+            counts = {name: total - self.counts.get(name, 0) for name, total in self.counters().items()}
+        stats = self.scenes.get(scene)
+        if stats is None:
+            stats = self.scenes[scene] = SceneStats()
+        stats.add(self.last_peak, self.last_net, collections, counts)
+        self.frames += 1
+        if self.frames % self.sample_interval == 0:
+            self._sample()
+
+    # The peak and net of an empty frame (the tracker's own bookkeeping,
+    # such as the number begin_frame() keeps), taken off every frame
+    def _measure_overhead(self):
+        self.begin_frame()
+        for attempt in range(2):
+            # (the first time round sets up the bookkeeping)
+            for i in range(8):
+                self.end_frame(None)
+            stats = self.scenes.pop(None)
+        self.overhead = (stats.peak_total // stats.frames, stats.net_total // stats.frames)
+        self.frames = 0
+
+    # Compares a new snapshot with the last one, keeping the call sites
+    # that grew the most
+    def _sample(self):
+        snapshot = self._take_snapshot()
+        differences = snapshot.compare_to(self.snapshot, "lineno")
+        self.top_sites = [difference for difference in differences if difference.size_diff > 0][:TOP_SITES]
+        self.snapshot = snapshot
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, file_path)
+                                                          for file_path in EXCLUDED_FILES])
+
+    # One line summary of the last frame, in bytes
+    def summary(self):
+        return "alloc peak %d  net %+d  traced %dKB  frames %d" % (
+            self.last_peak, self.last_net, tracemalloc.get_traced_memory()[0] // 1024 if self.active else 0, self.frames)
+
+    # Call sites that grew the most since the sample before, one line each
+    def site_lines(self, count=TOP_SITES):
+        lines = []
+        for difference in self.top_sites[:count]:
+            frame = difference.traceback[0]
+            lines.append("%+8dB %+6d blocks  %s:%d" % (difference.size_diff, difference.count_diff,
+                                                       os.path.basename(frame.filename), frame.lineno))
+        return lines
+
+    # Per scene means (bytes a frame) and the top call sites
+    def report(self):
+        names = sorted(set(name for stats in self.scenes.values() for name in stats.counts))
+        lines = ["scene      frames   mean peak   max peak   mean net   collections"
+                 + "".join("%12s" % (name + "/frame") for name in names)]
+        for scene, stats in sorted(self.scenes.items()):
+            lines.append("%-8s %8d %11.0f %10d %10.1f %13d" % (
+                SCENE_NAMES.get(scene, scene), stats.frames, stats.mean_peak(), stats.peak_max,
+                stats.mean_net(), stats.collections) + "".join("%12.3f" % stats.mean_count(name) for name in names))
+        if self.top_sites:
+            lines.append("grew the most in the last %d frames:" % (self.frames % self.sample_interval or self.sample_interval))
+            lines.extend(self.site_lines())
+        return "\n".join(lines)
+
+def _count_collections():
+    return sum(generation["collections"] for generation in gc.get_stats())
+
+############### BUDGET CHECK ###############
+
+# Plays `frames` frames of each scene in BUDGETS after `warmup` frames
+# unmeasured, with the game drawing (dummy video driver) but not pacing
+# itself. A bot game that tops out ends headless (no five second wait)
+# and never beats the high score, so nothing is saved. Returns the
+# tracker and a line for each budget gone over.
+def check_budgets(frames=CHECK_FRAMES, warmup=CHECK_WARMUP, seed=0):
+    from clonetris import bot
+    from clonetris import game as game_loader
+    tetris = game_loader.load()
+    frame_pacer = tetris.frame_pacer
+    tracker = AllocationTracker(tetris.get_allocation_counters)
+
+    class NoPacer:
+        def tick(self):
+            pass
+
+    game_end = tetris.game_end
+
+    def headless_game_end():
+        tetris.headless = True
+        try:
+            game_end()
+        finally:
+            tetris.headless = False
+
+    high_score = tetris.high_score
+    seed_setting = os.environ.get("CLONETRIS_SEED")
+    tetris.frame_pacer = NoPacer()
+    tetris.game_end = headless_game_end
+    tetris.high_score = sys.maxsize
+    tetris.headless = False
+    # (idle mode would draw the menus once and then wait for input)
+    idle_enabled = tetris.idle_enabled
+    tetris.idle_enabled = False
+    tracker.start()
+    try:
+        for scene in sorted(BUDGETS):
+            tetris.game_state = scene
+            player = None
+            for frame in range(warmup + frames):
+                codes = ()
+                if scene == 2:
+                    if player is None or tetris.game_state != 2:
+                        os.environ["CLONETRIS_SEED"] = str(seed)
+                        tetris.start_game(18)
+                        player = bot.Bot(tetris.game)
+                    codes = player.inputs()
+                tracker.begin_frame()
+                for code in codes:
+                    tetris.apply_game_input(code)
+                tetris.update()
+                if frame >= warmup:
+                    tracker.end_frame(scene)
+                # (the menus stay put without input)
+                if scene != 2:
+                    tetris.game_state = scene
+    finally:
+        tracker.stop()
+        tetris.frame_pacer = frame_pacer
+        tetris.game_end = game_end
+        tetris.high_score = high_score
+        tetris.headless = True
+        tetris.idle_enabled = idle_enabled
+        tetris.game_state = 0
+        if seed_setting is None:
+            os.environ.pop("CLONETRIS_SEED", None)
+        else:
+            os.environ["CLONETRIS_SEED"] = seed_setting
+
+    over = []
+    for scene, (peak_budget, net_budget) in BUDGETS.items():
+        stats = tracker.scenes.get(scene)
+        if stats.mean_peak() > peak_budget:
+            over.append("%s: mean peak %.0f bytes a frame (budget %d)" % (SCENE_NAMES[scene], stats.mean_peak(), peak_budget))
+        if stats.mean_net() > net_budget:
+            over.append("%s: mean net %.1f bytes a frame (budget %d)" % (SCENE_NAMES[scene], stats.mean_net(), net_budget))
+        for name, budget in COUNTER_BUDGETS.items():
+            if stats.mean_count(name) > budget:
+                over.append("%s: %.3f %s a frame (budget %g)" % (SCENE_NAMES[scene], stats.mean_count(name), name, budget))
+    return tracker, over
+
+def main(args):
+    options = {"--frames": CHECK_FRAMES, "--warmup": CHECK_WARMUP, "--seed": 0}
+    rest = args[1:]
+    if args[:1] != ["check"] or len(rest) % 2 or any(name not in options for name in rest[::2]):
+        print("usage: python allocs.py check [--frames N] [--warmup N] [--seed N]")
+        return 1
+    for name, value in zip(rest[::2], rest[1::2]):
+        options[name] = int(value)
+    tracker, over = check_budgets(options["--frames"], options["--warmup"], options["--seed"])
+    print(tracker.report())
+    for line in over:
+        print("over budget: " + line)
+    return 1 if over else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
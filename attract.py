@@ -0,0 +1,82 @@
+# Attract mode demos
+#
+# Once the splash screen has sat idle for a while the game plays demo games
+# (recorded replays, see replay.py) until someone presses a key or button.
+# The demos are replay files in one zip archive. Each is streamed straight
+# out of the archive with ReplayStream when its turn comes, so only the
+# demo playing is open and memory use doesn't grow with the number or
+# length of the demos. Playing one costs the same as a live game (the
+# inputs are read a chunk at a time as the game reaches them).
+#
+# Build an archive from recorded games (see CLONETRIS_RECORD_DIR) with:
+#
+#   python attract.py <archive> <replay file or directory>...
+
+import os
+import struct
+import sys
+import zipfile
+from clonetris import replay
+
+DEMO_EXTENSION = ".ctr"
+
+class DemoArchive:
+    def __init__(self, file_path):
+        self.archive = zipfile.ZipFile(file_path)
+        self.names = sorted(name for name in self.archive.namelist() if name.endswith(DEMO_EXTENSION))
+        self.next_demo = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    # Opens the next demo (they play in turn) as a ReplayStream, skipping
+    # any that can't be read. Returns None if none can.
+    def open_next(self):
+        for attempt in range(len(self.names)):
+            name = self.names[self.next_demo]
+            self.next_demo = (self.next_demo + 1) % len(self.names)
+            file = self.archive.open(name)
+            try:
+                return replay.ReplayStream(file)
+            except (ValueError, IndexError, struct.error, zipfile.BadZipFile) as error:
+                file.close()
+                print("Skipping demo %s: %s" % (name, error))
+        return None
+
+    def close(self):
+        self.archive.close()
+
+# Yields every replay file under the given files and directories
+def find_replays(paths):
+    for file_path in paths:
+        if os.path.isdir(file_path):
+            for directory, subdirectories, files in os.walk(file_path):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.endswith(DEMO_EXTENSION):
+                        yield os.path.join(directory, name)
+        else:
+            yield file_path
+
+# Writes the replays into a new archive. The files are stored uncompressed:
+# replays are already compact, and a stream can then jump to its footer
+# without decompressing everything before it.
+def build_archive(archive_path, paths):
+    count = 0
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as archive:
+        for file_path in find_replays(paths):
+            with open(file_path, "rb") as file:
+                replay.ReplayStream(file) # checks that it's a replay
+            archive.write(file_path, "%03d_%s" % (count, os.path.basename(file_path)))
+            count += 1
+    return count
+
+def main(args):
+    if len(args) < 2:
+        print("usage: python attract.py <archive> <replay file or directory>...")
+        return 1
+    print("Added %d demos to %s" % (build_archive(args[0], args[1:]), args[0]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,27 @@
+# clonetris as a package
+#
+# Importing clonetris (or any module in it but game.py and render.py) has
+# no side effects: no pygame, window, assets or saved files, just the rules
+# (rules.Game), which import in a few milliseconds. Tools, bots and worker
+# processes use these, and the game itself (tetris.py) plays on a
+# rules.Game too.
+#
+#   rules.py     the game rules as a class, playable without the game
+#   bot.py       a placement bot that plays a rules.Game
+#   simulate.py  headless games, benchmarks and replay checks on the rules
+#   game.py      runs the game, or loads it as a module (pygame, assets)
+#   render.py    renders replays to images and raw video with the game
+#
+# and the modules the rules, the bots and the game share: pieces.py,
+# randomizer.py, garbage.py, sprint.py, replay.py, snapshot.py, binfmt.py,
+# features.py, finesse.py and pacer.py.
+#
+# pip install -e . makes it importable from anywhere (pip install -e .[game]
+# brings in pygame too); the game needs the checkout for tetris.py and its
+# assets.
+#
+# Command line (see __main__.py):
+#
+#   python -m clonetris play|replay|simulate|benchmark|render|video ...
+
+from clonetris.rules import Game
@@ -0,0 +1,173 @@
+# clonetris command line
+#
+#   python -m clonetris play [--seed N] [--type A|B|SPRINT] [--height N] [--randomizer NAME]
+#                            [--record DIR] [--practice]
+#   python -m clonetris replay <file> [--headless]
+#   python -m clonetris simulate [--games N] [--seed N] [--level N] [--type A|B|SPRINT] [--height N]
+#                                [--frames N] [--randomizer NAME] [--workers N]
+#   python -m clonetris benchmark [--frames N] [--seed N]
+#   python -m clonetris render <replay> <image> [--frame N]
+#   python -m clonetris video <replay> <output> [--from N] [--to N] [--workers N] [--format raw|png|...]
+#
+# play and replay open the game's window (play's options set the matching
+# CLONETRIS_* settings for this run). render draws one frame of a replay and
+# video a range of its frames (raw bgr0 video into a file or - for stdout,
+# or images into a directory, see render.py), with the game under the dummy
+# video driver. simulate (bot games), benchmark
+# and replay --headless (plays a replay on the rules and checks it against
+# its keyframes) only import the rules.
+
+import os
+import sys
+from time import perf_counter
+
+USAGE = """usage: python -m clonetris play [--seed N] [--type A|B|SPRINT] [--height N] [--randomizer NAME]
+                                [--record DIR] [--practice]
+       python -m clonetris replay <file> [--headless]
+       python -m clonetris simulate [--games N] [--seed N] [--level N] [--type A|B|SPRINT] [--height N]
+                                    [--frames N] [--randomizer NAME] [--workers N]
+       python -m clonetris benchmark [--frames N] [--seed N]
+       python -m clonetris render <replay> <image> [--frame N]
+       python -m clonetris video <replay> <output> [--from N] [--to N] [--workers N] [--format raw|png|...]"""
+
+# Settings play's options set
+PLAY_SETTINGS = {
+    "--seed": "CLONETRIS_SEED",
+    "--type": "CLONETRIS_GAME_TYPE",
+    "--height": "CLONETRIS_GARBAGE_HEIGHT",
+    "--randomizer": "CLONETRIS_RANDOMIZER",
+    "--record": "CLONETRIS_RECORD_DIR",
+    "--practice": "CLONETRIS_PRACTICE",
+}
+
+# Splits "--name value" options (and --name flags, given as flags) out of
+# args into a copy of defaults, values converted to the type of the default.
+# Returns (options, other args), or None for an unknown option or bad value.
+def parse_options(args, defaults, flags=()):
+    options = dict(defaults)
+    rest = []
+    i = 0
+    while i < len(args):
+        name = args[i]
+        if name in flags:
+            options[name] = True
+            i += 1
+        elif name in defaults and i + 1 < len(args):
+            default = defaults[name]
+            try:
+                options[name] = type(default)(args[i + 1]) if default is not None else args[i + 1]
+            except ValueError:
+                return None
+            i += 2
+        elif name.startswith("--"):
+            return None
+        else:
+            rest.append(name)
+            i += 1
+    return options, rest
+
+def play_command(args):
+    parsed = parse_options(args, {name: None for name in PLAY_SETTINGS if name != "--practice"}, ["--practice"])
+    if parsed is None or parsed[1]:
+        return None
+    from clonetris import game
+    for name, value in parsed[0].items():
+        if value is not None:
+            os.environ[PLAY_SETTINGS[name]] = os.path.abspath(value) if name == "--record" else str(value)
+    game.play()
+    return 0
+
+def replay_command(args):
+    parsed = parse_options(args, {}, ["--headless"])
+    if parsed is None or len(parsed[1]) != 1:
+        return None
+    options, (file_path,) = parsed
+    if not options.get("--headless"):
+        from clonetris import game
+        os.environ["CLONETRIS_REPLAY"] = os.path.abspath(file_path)
+        game.play()
+        return 0
+
+    from clonetris import simulate
+    result, checked, mismatches = simulate.check_replay(file_path)
+    print("%d frames, %d pieces: %d lines, %d points, level %d%s"
+          % (result.game_frame, result.piece_count, result.lines, result.score, result.level,
+             " (game over)" if result.game_over else ""))
+    print("%d keyframes checked, %d didn't match%s"
+          % (checked, len(mismatches), " (frames %s)" % ", ".join(map(str, mismatches[:10])) if mismatches else ""))
+    return 1 if mismatches else 0
+
+def simulate_command(args):
+    from clonetris import simulate
+    parsed = parse_options(args, {"--games": 8, "--seed": 0, "--level": simulate.DEFAULT_LEVEL, "--type": "A",
+                                  "--height": 0, "--frames": simulate.DEFAULT_MAX_FRAMES, "--randomizer": "nes",
+                                  "--workers": 1})
+    if parsed is None or parsed[1]:
+        return None
+    options = parsed[0]
+    seeds = simulate.game_seeds(options["--seed"], options["--games"])
+    results = simulate.simulate(seeds, options["--workers"], start_level=options["--level"],
+                                game_type=options["--type"].upper(), garbage_height=options["--height"],
+                                max_frames=options["--frames"], randomizer_name=options["--randomizer"])
+    total_lines = 0
+    total_frames = 0
+    for seed, frames, pieces, lines, score, level, time in results:
+        total_lines += lines
+        total_frames += frames
+        print("seed %5d: %4d lines, %7d points, level %2d, %5d pieces in %6d frames%s"
+              % (seed, lines, score, level, pieces, frames, ", sprint %d frames" % time if time is not None else ""))
+    print("%d games, %d lines, %d frames" % (len(seeds), total_lines, total_frames))
+    return 0
+
+def benchmark_command(args):
+    parsed = parse_options(args, {"--frames": 200000, "--seed": 0})
+    if parsed is None or parsed[1]:
+        return None
+    from clonetris import simulate
+    simulate.benchmark(parsed[0]["--frames"], parsed[0]["--seed"])
+    return 0
+
+def render_command(args):
+    parsed = parse_options(args, {"--frame": 0})
+    if parsed is None or len(parsed[1]) != 2:
+        return None
+    from clonetris import render
+    replay_path, image_path = (os.path.abspath(file_path) for file_path in parsed[1])
+    frame = render.render_frame(replay_path, parsed[0]["--frame"], image_path)
+    print("Saved frame %d to %s" % (frame, image_path))
+    return 0
+
+def video_command(args):
+    parsed = parse_options(args, {"--from": 0, "--to": -1, "--workers": os.cpu_count() or 1, "--format": "raw"})
+    if parsed is None or len(parsed[1]) != 2:
+        return None
+    options, (replay_path, output) = parsed
+    from clonetris import render
+    image_format = None if options["--format"] == "raw" else options["--format"]
+    to_stdout = output == "-"
+    start = perf_counter()
+    frames = render.render_video(os.path.abspath(replay_path), sys.stdout.buffer if to_stdout else os.path.abspath(output),
+                                 options["--from"], None if options["--to"] < 0 else options["--to"],
+                                 options["--workers"], image_format)
+    if image_format:
+        details = ""
+    else:
+        details = " (raw %s %dx%d)" % (render.RAW_PIXEL_FORMAT, render.FRAME_SIZE[0], render.FRAME_SIZE[1])
+    # (to stderr when the video goes to stdout)
+    print("Rendered %d frames in %.1fs with %d workers%s" % (frames, perf_counter() - start, options["--workers"], details),
+          file=sys.stderr if to_stdout else sys.stdout)
+    return 0
+
+COMMANDS = {"play": play_command, "replay": replay_command, "simulate": simulate_command,
+            "benchmark": benchmark_command, "render": render_command, "video": video_command}
+
+def main(args):
+    if args and args[0] in COMMANDS:
+        result = COMMANDS[args[0]](args[1:])
+        if result is not None:
+            return result
+    print(USAGE)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,50 @@
+# Small helpers for the compact binary formats used by the game
+# (spectator streams, replays, event logs)
+
+# Appends an unsigned LEB128 varint to a bytearray
+def write_varint(buffer, value):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+# Reads an unsigned varint starting at pos and returns (value, new_pos)
+# Raises IndexError if the data ends in the middle of the varint
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+# Maps signed integers onto unsigned ones so small negative values
+# stay small (0, -1, 1, -2, 2 ... -> 0, 1, 2, 3, 4 ...)
+def zigzag(value):
+    return (value << 1) if value >= 0 else ((-value << 1) - 1)
+
+def unzigzag(value):
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1)
+
+# Packs a 10x20 [column][row] matrix into 100 bytes (two cells per byte)
+def pack_board(matrix):
+    packed = bytearray(100)
+    i = 0
+    for y in range(20):
+        for x in range(0, 10, 2):
+            packed[i] = matrix[x][y] | (matrix[x + 1][y] << 4)
+            i += 1
+    return packed
+
+# Unpacks 100 bytes produced by pack_board into an existing [column][row] matrix
+def unpack_board(data, matrix, offset=0):
+    i = offset
+    for y in range(20):
+        for x in range(0, 10, 2):
+            byte = data[i]
+            matrix[x][y] = byte & 0x0F
+            matrix[x + 1][y] = byte >> 4
+            i += 1
@@ -0,0 +1,81 @@
+# A placement bot for simulations and benchmarks
+#
+# For every piece the bot looks at each place it can be dropped
+# (features.placements()), keeps the ones the piece can actually get to in
+# time (finesse.solve()), and plays the one whose board has the lowest cost:
+# the stack features weighted by WEIGHTS, less LINE_BONUS per line cleared.
+# It only reads a rules.Game's block_matrix, current_piece, level, das,
+# fall_timer, piece_count and start_delay, so it plays the game itself
+# (tetris.py's game) the same way.
+
+from clonetris import features, finesse
+from clonetris.rules import get_level_speed
+
+# Cost of each stack feature, in features.FEATURE_NAMES order
+WEIGHTS = (0.5, 0, 3.5, 0.5, 0.3, 0, 0.1, 0, 0)
+LINE_BONUS = 2.0
+
+# Cost of a placement that leaves the next piece nowhere to go
+TOP_OUT_COST = 1000.0
+
+# Best placement for a piece as (rotation, x, path), or None if it can't
+# be placed anywhere (see finesse.py for paths)
+def choose_placement(block_matrix, piece, speed, das, fall_timer, weights=WEIGHTS):
+    columns = features.matrix_to_columns(block_matrix)
+    heights = [features.column_stats(mask)[0] for mask in columns]
+    solution = finesse.solve(heights, piece, speed, das, fall_timer)
+    best = None
+    for rotation, x, new_columns, lines in features.placements(columns, piece):
+        path = solution.get(finesse.placement_key(piece, x, rotation))
+        if path is None:
+            continue
+        cost = sum(w * v for w, v in zip(weights, features.board_features(new_columns))) - LINE_BONUS * lines
+        if best is None or cost < best[0]:
+            best = (cost, rotation, x, path)
+    return best[1:] if best else None
+
+# Best placement for a piece looking one piece ahead, from column masks
+# (features.py): each placement costs as much as the best board the next
+# piece can make from it, less LINE_BONUS per line the two clear. Returns
+# (rotation, x, path) like choose_placement().
+def choose_placement_ahead(columns, piece, next_piece, speed, das, fall_timer, weights=WEIGHTS):
+    heights = [features.column_stats(mask)[0] for mask in columns]
+    solution = finesse.solve(heights, piece, speed, das, fall_timer)
+    best = None
+    for rotation, x, new_columns, lines in features.placements(columns, piece):
+        path = solution.get(finesse.placement_key(piece, x, rotation))
+        if path is None:
+            continue
+        next_placements = features.placements(new_columns, next_piece)
+        if next_placements:
+            costs = features.score_boards([placement[2] for placement in next_placements], weights)
+            cost = min(cost - LINE_BONUS * placement[3] for cost, placement in zip(costs, next_placements))
+        else:
+            # (the next piece tops out)
+            cost = TOP_OUT_COST
+        cost -= LINE_BONUS * lines
+        if best is None or cost < best[0]:
+            best = (cost, rotation, x, path)
+    return best[1:] if best else None
+
+class Bot:
+    def __init__(self, game, weights=WEIGHTS):
+        self.game = game
+        self.weights = weights
+        self.piece_count = None
+        self.codes = [] # (frame, input code) for the current piece
+        self.frame = 0
+
+    # Input codes for the game's next frame (picks a placement on the
+    # piece's first frame once the start delay is over)
+    def inputs(self):
+        game = self.game
+        if game.piece_count != self.piece_count and game.start_delay <= 0:
+            self.piece_count = game.piece_count
+            placement = choose_placement(game.block_matrix, game.current_piece, get_level_speed(game.level),
+                                         game.das, game.fall_timer, self.weights)
+            self.codes = finesse.path_to_input_codes(placement[2]) if placement else []
+            self.frame = 0
+        codes = [code for frame, code in self.codes if frame == self.frame]
+        self.frame += 1
+        return codes
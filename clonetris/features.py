@@ -0,0 +1,260 @@
+# Stack features of a board, for bots and post-game analytics
+#
+# The board is kept as 10 column bitmasks (bit y set = square at row y
+# filled, row 0 being the top), which makes every feature a handful of
+# integer operations:
+#
+#   heights          height of each column's highest square (0 = empty)
+#   holes            empty squares with a filled square somewhere above them
+#   covered          filled squares sitting above the lowest hole of their column
+#   bumpiness        sum of the height differences between neighbouring columns
+#   wells            how far each column is below both of its neighbours
+#                    (the walls count as full height)
+#   row_transitions  filled/empty changes along every row, walls counted as filled
+#   right_well_rows  rows directly above the bottom of column 9 that are full
+#                    except for column 9 (4 or more = tetris ready)
+#
+# BoardFeatures follows one game and is updated as pieces lock and lines
+# clear, only redoing the columns that changed. board_features() and
+# score_boards() evaluate any number of boards given as tuples of column
+# masks, sharing the per-column work between boards (candidate placements
+# from the same position only differ in a few columns).
+
+from clonetris.pieces import piece_cells, piece_bottoms
+
+ROWS = 20
+COLUMNS = 10
+FULL_COLUMN = (1 << ROWS) - 1
+
+FEATURE_NAMES = ("aggregate_height", "max_height", "holes", "covered", "bumpiness",
+                 "well_depth", "row_transitions", "right_well_rows", "tetris_ready")
+
+# (height, holes, covered) for column masks seen before (emptied once it
+# holds COLUMN_CACHE_SIZE masks)
+COLUMN_CACHE_SIZE = 1 << 16
+column_cache = {}
+
+def column_stats(mask):
+    stats = column_cache.get(mask)
+    if stats is None:
+        if len(column_cache) >= COLUMN_CACHE_SIZE:
+            column_cache.clear()
+        if mask == 0:
+            stats = (0, 0, 0)
+        else:
+            top = (mask & -mask).bit_length() - 1
+            height = ROWS - top
+            holes_mask = ~mask & FULL_COLUMN & ~((1 << top) - 1)
+            if holes_mask:
+                lowest_hole = holes_mask.bit_length() - 1
+                covered = (mask & ((1 << lowest_hole) - 1)).bit_count()
+            else:
+                covered = 0
+            stats = (height, holes_mask.bit_count(), covered)
+        column_cache[mask] = stats
+    return stats
+
+# Converts a 10x20 [column][row] matrix into column masks
+def matrix_to_columns(matrix):
+    columns = []
+    for column in matrix:
+        mask = 0
+        for y in range(ROWS):
+            if column[y] != 0:
+                mask |= 1 << y
+        columns.append(mask)
+    return columns
+
+# Removes rows (row numbers from the top) from a column mask and moves the
+# squares above them down
+def remove_rows(mask, rows):
+    for y in sorted(rows):
+        mask = ((mask & ((1 << y) - 1)) << 1) | (mask & ~((2 << y) - 1))
+    return mask
+
+# Mask of the rows that are full in every column
+def full_rows(columns):
+    rows = FULL_COLUMN
+    for mask in columns:
+        rows &= mask
+    return rows
+
+############# FEATURES ###############
+
+# Features that depend on more than one column
+def _wells(heights):
+    wells = []
+    for x in range(COLUMNS):
+        left = heights[x - 1] if x > 0 else ROWS
+        right = heights[x + 1] if x < COLUMNS - 1 else ROWS
+        wells.append(max(0, min(left, right) - heights[x]))
+    return wells
+
+def _bumpiness(heights):
+    return sum(abs(heights[x] - heights[x + 1]) for x in range(COLUMNS - 1))
+
+def _row_transitions(columns):
+    # Every row where two neighbouring columns (or a column and the wall)
+    # differ is one transition
+    transitions = (columns[0] ^ FULL_COLUMN).bit_count() + (columns[-1] ^ FULL_COLUMN).bit_count()
+    for x in range(COLUMNS - 1):
+        transitions += (columns[x] ^ columns[x + 1]).bit_count()
+    return transitions
+
+def _right_well_rows(columns):
+    well = columns[-1]
+    top = (well & -well).bit_length() - 1 if well else ROWS
+    ready = FULL_COLUMN
+    for mask in columns[:-1]:
+        ready &= mask
+
+    count = 0
+    y = top - 1
+    while y >= 0 and ready >> y & 1:
+        count += 1
+        y -= 1
+    return count
+
+# Features of one board (column masks) in FEATURE_NAMES order
+def board_features(columns):
+    stats = [column_stats(mask) for mask in columns]
+    heights = [s[0] for s in stats]
+    right_well_rows = _right_well_rows(columns)
+    return (sum(heights), max(heights), sum(s[1] for s in stats), sum(s[2] for s in stats),
+            _bumpiness(heights), sum(_wells(heights)), _row_transitions(columns),
+            right_well_rows, int(right_well_rows >= 4))
+
+# Weighted sum of the features (weights in FEATURE_NAMES order) for every board
+def score_boards(boards, weights):
+    weights = tuple(weights)
+    scores = []
+    for columns in boards:
+        scores.append(sum(w * v for w, v in zip(weights, board_features(columns))))
+    return scores
+
+############# PLACEMENTS ###############
+
+# Lowest center row a piece square at row offset dy can fall to in a column
+def _landing(mask, dy):
+    start = max(dy, 0)
+    below = mask >> start << start
+    stop = (below & -below).bit_length() - 1 if below else ROWS
+    return stop - 1 - dy
+
+# Row the center of a piece at (x, rotation) ends up on when dropped
+# straight down from row 0, or -1 if it doesn't fit there
+def landing_row(columns, piece, rotation, x):
+    cells = piece_cells[piece][rotation]
+    for dx, dy in cells:
+        if not 0 <= x + dx < COLUMNS:
+            return -1
+
+    # The piece falls from row 0 until one of its squares is stopped
+    return min(_landing(columns[x + dx], dy) for dx, dy in cells)
+
+# Column masks after dropping a piece at (x, rotation) straight down from row 0,
+# with full rows cleared. Returns (columns, lines cleared), or None if the
+# piece doesn't fit there.
+def drop_piece(columns, piece, rotation, x):
+    y = landing_row(columns, piece, rotation, x)
+    if y < 0:
+        return None
+
+    new_columns = list(columns)
+    for dx, dy in piece_cells[piece][rotation]:
+        if y + dy >= 0:
+            new_columns[x + dx] |= 1 << (y + dy)
+
+    cleared = full_rows(new_columns)
+    if cleared:
+        rows = [row for row in range(ROWS) if cleared >> row & 1]
+        new_columns = [remove_rows(mask, rows) for mask in new_columns]
+        return tuple(new_columns), len(rows)
+    return tuple(new_columns), 0
+
+# All hard drop placements of a piece: a list of (rotation, x, columns, lines)
+def placements(columns, piece):
+    results = []
+    seen = set()
+    for rotation in range(4):
+        for x in range(-2, COLUMNS + 2):
+            result = drop_piece(columns, piece, rotation, x)
+            if result and result[0] not in seen:
+                seen.add(result[0])
+                results.append((rotation, x, result[0], result[1]))
+    return results
+
+############# INCREMENTAL ###############
+
+# Features of one game's board, updated as pieces lock and lines clear
+# (version counts the updates, so anything worked out from the board can
+# tell when it's out of date)
+class BoardFeatures:
+    def __init__(self, matrix=None):
+        self.version = 0
+        if matrix is None:
+            self.reset()
+        else:
+            self.load(matrix)
+
+    def reset(self):
+        self.columns = [0] * COLUMNS
+        self.column_stats = [(0, 0, 0)] * COLUMNS
+        self._update()
+
+    # Rebuilds everything from a 10x20 [column][row] matrix
+    def load(self, matrix):
+        self.columns = matrix_to_columns(matrix)
+        self.column_stats = [column_stats(mask) for mask in self.columns]
+        self._update()
+
+    # Called when a piece locks, with the (x, y) squares it filled
+    def add_cells(self, cells):
+        changed = set()
+        for x, y in cells:
+            if 0 <= y < ROWS:
+                self.columns[x] |= 1 << y
+                changed.add(x)
+        for x in changed:
+            self.column_stats[x] = column_stats(self.columns[x])
+        self._update()
+
+    # Called when rows are cleared
+    def clear_rows(self, rows):
+        if not rows:
+            return
+        self.columns = [remove_rows(mask, rows) for mask in self.columns]
+        self.column_stats = [column_stats(mask) for mask in self.columns]
+        self._update()
+
+    def _update(self):
+        self.version += 1
+        stats = self.column_stats
+        self.heights = [s[0] for s in stats]
+        self.column_holes = [s[1] for s in stats]
+        self.holes = sum(self.column_holes)
+        self.covered = sum(s[2] for s in stats)
+        self.bumpiness = _bumpiness(self.heights)
+        self.wells = _wells(self.heights)
+        self.row_transitions = _row_transitions(self.columns)
+        self.right_well_rows = _right_well_rows(self.columns)
+        self.tetris_ready = self.right_well_rows >= 4
+
+    # Row the center of a piece at (x, y) ends up on when dropped straight
+    # down from there (the piece has to fit where it is). Only the piece's
+    # lowest square in each column counts, and that square stops on top of
+    # its column unless it's already below the top (under an overhang).
+    def drop_row(self, piece, rotation, x, y):
+        row = ROWS
+        for dx, dy in piece_bottoms[piece][rotation]:
+            stop = ROWS - self.heights[x + dx]
+            if y + dy >= stop:
+                below = self.columns[x + dx] >> (y + dy) << (y + dy)
+                stop = (below & -below).bit_length() - 1 if below else ROWS
+            row = min(row, stop - 1 - dy)
+        return row
+
+    # Features in FEATURE_NAMES order
+    def values(self):
+        return (sum(self.heights), max(self.heights), self.holes, self.covered, self.bumpiness,
+                sum(self.wells), self.row_transitions, self.right_well_rows, int(self.tetris_ready))
@@ -0,0 +1,235 @@
+# Fastest input sequences for placing a piece
+#
+# Finds, for every column and rotation a piece can be dropped into, the
+# input sequence that gets it there in the fewest frames under this game's
+# rules:
+#
+#   - holding left/right: the first press moves the piece at once and sets
+#     das to -10, after that auto_shift() moves it every time das reaches 6.
+#     A press during the piece's first frame doesn't move it or reset das
+#     (the entry delay check in apply_game_input()), so das carries over
+#     from the previous piece.
+#   - a move into a wall or the stack sets das to 6 (wall charge)
+#   - rotations have no kicks, they either fit or do nothing
+#   - a button has to be released for a frame before it can be pressed again
+#   - gravity drops the piece every `speed` frames (get_level_speed(level))
+#   - a piece that can't drop locks where it was drawn this frame, before
+#     auto_shift() moved it
+#
+# The board only matters through its surface (the column heights), since a
+# piece dropped from the top can't get under an overhang without a tuck.
+# Solving a surface finds every placement at once with a breadth-first
+# search over frames, and the results are memoized by (surface, piece,
+# speed, das, fall timer), so repeated queries for the same position are a
+# dict lookup. The level only matters through its speed, so levels with the
+# same speed share solutions.
+#
+# A path is a list with one (direction, rotation) per frame: direction is
+# the direction held that frame (-1 left, 0 none, 1 right) and rotation the
+# rotate button held (0 none, ROTATE_LEFT, ROTATE_RIGHT).
+
+from clonetris.pieces import piece_cells
+from clonetris import replay
+
+ROTATE_LEFT = 1
+ROTATE_RIGHT = 2
+
+SPAWN_X = 5
+SPAWN_ROTATION = 3
+
+# Solved surfaces (emptied once it holds CACHE_SIZE of them)
+CACHE_SIZE = 4096
+solution_cache = {}
+
+# Every input a player can give in one frame
+ACTIONS = [(direction, rotation) for direction in (0, -1, 1) for rotation in (0, ROTATE_LEFT, ROTATE_RIGHT)]
+
+############# PLACEMENTS ###############
+
+# Identifies a placement independently of the rotation number (some pieces
+# have rotations with the same shape), as the piece's squares relative to
+# the top of the board
+def placement_key(piece, x, rotation):
+    return frozenset((x + dx, dy) for dx, dy in piece_cells[piece][rotation])
+
+# Lowest row the piece's center can be at for every rotation and x (x
+# offset by 3 so that every x a square of the piece can be on the board
+# from is a valid index), -1 where it doesn't fit at all. The board counts as
+# filled solid below the surface, so a position fits if it's above that row.
+def _make_limits(heights, piece):
+    tops = [20 - height for height in heights]
+    limits = []
+    for rotation in range(4):
+        cells = piece_cells[piece][rotation]
+        row = []
+        for x in range(-3, 13):
+            if all(0 <= x + dx < 10 for dx, dy in cells):
+                row.append(min(tops[x + dx] - 1 - dy for dx, dy in cells))
+            else:
+                row.append(-1)
+        limits.append(row)
+    return limits
+
+def _fits(limits, x, y, rotation):
+    return -3 <= x < 13 and y <= limits[rotation][x + 3]
+
+############# SEARCH ###############
+
+# Finds the fastest path to every reachable placement. Returns a dict of
+# placement_key() -> path.
+def solve(heights, piece, speed, das=0, fall_timer=None):
+    if fall_timer is None:
+        fall_timer = speed
+    key = (tuple(heights), piece, speed, das, fall_timer)
+    solution = solution_cache.get(key)
+    if solution is None:
+        if len(solution_cache) >= CACHE_SIZE:
+            solution_cache.clear()
+        solution = _search(heights, piece, speed, das, fall_timer)
+        solution_cache[key] = solution
+    return solution
+
+def _search(heights, piece, speed, das, fall_timer):
+    limits = _make_limits(heights, piece)
+    if not _fits(limits, SPAWN_X, 0, SPAWN_ROTATION):
+        return {}
+
+    # Placements the piece fits into (the search stops once all are found)
+    keys = [[placement_key(piece, x, rotation) for x in range(-3, 13)] for rotation in range(4)]
+    possible = set()
+    for rotation in range(4):
+        for x in range(-3, 13):
+            if limits[rotation][x + 3] >= 0:
+                possible.add(keys[rotation][x + 3])
+
+    # state: (x, y, rotation, das, fall timer, held direction, held rotate button)
+    # nodes: (state, parent node index, action)
+    nodes = [((SPAWN_X, 0, SPAWN_ROTATION, das, fall_timer, 0, 0), -1, None)]
+    layer = [0]
+    seen = set()
+    results = {}
+    results[placement_key(piece, SPAWN_X, SPAWN_ROTATION)] = []
+
+    while layer and len(results) < len(possible):
+        next_layer = []
+        for index in layer:
+            state = nodes[index][0]
+            for action in ACTIONS:
+                # Keeping a rotate button held never helps (letting go of it
+                # allows pressing it again next frame)
+                if action[1] != 0 and action[1] == state[6]:
+                    continue
+                new_state = _step(state, action, speed, limits)
+                if new_state is None:
+                    continue # locked this frame
+
+                x, y, rotation, new_das, timer, held, button = new_state
+                # An earlier (so higher) arrival at the same state can do
+                # everything a later one can, and das doesn't matter while no
+                # direction is held since the next press resets it
+                seen_key = (x, rotation, new_das if held else 0, held, button)
+                if seen_key in seen or (button and seen_key[:4] + (0,) in seen):
+                    continue
+                seen.add(seen_key)
+
+                nodes.append((new_state, index, action))
+                next_layer.append(len(nodes) - 1)
+
+                placement = keys[rotation][x + 3]
+                if placement not in results:
+                    results[placement] = _path(nodes, len(nodes) - 1)
+        layer = next_layer
+    return results
+
+# Simulates one frame the way update() runs it: input events, then
+# auto_shift(), then piece_fall(). Returns the new state, or None if the
+# piece locked.
+def _step(state, action, speed, limits):
+    x, y, rotation, das, timer, held, button = state
+    direction, rotate = action
+
+    # Input events
+    if direction != held:
+        if direction != 0 and (y != 0 or timer != speed):
+            das = -10
+            if _fits(limits, x + direction, y, rotation):
+                x += direction
+            else:
+                das = 6
+        held = direction
+    if rotate != button:
+        if rotate == ROTATE_LEFT:
+            new_rotation = (rotation + 1) % 4
+            if _fits(limits, x, y, new_rotation):
+                rotation = new_rotation
+        elif rotate == ROTATE_RIGHT:
+            new_rotation = (rotation - 1) % 4
+            if _fits(limits, x, y, new_rotation):
+                rotation = new_rotation
+        button = rotate
+
+    # auto_shift()
+    if held:
+        das += 1
+        if das >= 6:
+            das = 0
+            if _fits(limits, x + held, y, rotation):
+                x += held
+            else:
+                das = 6
+
+    # piece_fall()
+    if timer > 1:
+        timer -= 1
+    else:
+        timer = speed
+        if _fits(limits, x, y + 1, rotation):
+            y += 1
+        else:
+            return None
+    return (x, y, rotation, das, timer, held, button)
+
+# Follows the parent links back to the start and ends the path with a frame
+# of letting go (so auto_shift() doesn't move the piece any further)
+def _path(nodes, index):
+    path = []
+    while nodes[index][1] != -1:
+        path.append(nodes[index][2])
+        index = nodes[index][1]
+    path.reverse()
+    if path and path[-1][0] != 0:
+        path.append((0, 0))
+    return path
+
+############# QUERIES ###############
+
+# Fastest path that ends with the piece dropping straight down at
+# (x, rotation), or None if it can't get there
+def find_path(heights, piece, x, rotation, speed, das=0, fall_timer=None):
+    return solve(heights, piece, speed, das, fall_timer).get(placement_key(piece, x, rotation))
+
+# Turns a path into (frame, input code) pairs for apply_game_input() (see
+# replay.py), frames counted from the piece's spawn
+def path_to_input_codes(path):
+    codes = []
+    held = 0
+    button = 0
+    for frame in range(len(path)):
+        direction, rotate = path[frame]
+        if direction != held:
+            if held == -1:
+                codes.append((frame, replay.KEY_RELEASE_LEFT))
+            elif held == 1:
+                codes.append((frame, replay.KEY_RELEASE_RIGHT))
+            if direction == -1:
+                codes.append((frame, replay.KEY_LEFT))
+            elif direction == 1:
+                codes.append((frame, replay.KEY_RIGHT))
+            held = direction
+        if rotate != button:
+            if rotate == ROTATE_LEFT:
+                codes.append((frame, replay.KEY_ROTATE_LEFT))
+            elif rotate == ROTATE_RIGHT:
+                codes.append((frame, replay.KEY_ROTATE_RIGHT))
+            button = rotate
+    return codes
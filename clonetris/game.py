@@ -0,0 +1,54 @@
+# Running and loading the game itself (tetris.py)
+#
+# This is the only part of clonetris that brings in the game's window and
+# assets (render.py draws through it), and only when one of these functions
+# is called. The game loads its assets relative to its own directory, so
+# these change into it first (callers should make any paths they were given
+# absolute before).
+
+import os
+import runpy
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GAME_PATH = os.path.join(ROOT, "tetris.py")
+
+# Settings that make the game record, stream, load, profile, upload or publish games
+SIDE_EFFECT_SETTINGS = ("CLONETRIS_RECORD_DIR", "CLONETRIS_EVENT_DIR", "CLONETRIS_BROADCAST", "CLONETRIS_WATCH",
+                        "CLONETRIS_WALL", "CLONETRIS_REPLAY", "CLONETRIS_PRACTICE", "CLONETRIS_PROFILE",
+                        "CLONETRIS_LEADERBOARD", "CLONETRIS_ALLOCS", "CLONETRIS_HINTS", "CLONETRIS_LIVE_STATE")
+
+game = None
+
+# Plays the game in a window, as python tetris.py does
+def play():
+    os.chdir(ROOT)
+    runpy.run_path(GAME_PATH, run_name="__main__")
+
+# Imports the game as a module (once) without a window or sound and
+# without the settings above, set up but not running. It's headless (no
+# drawing or delays) until told otherwise, and always silent.
+#
+# This changes the caller's process for good: the settings above are
+# removed from os.environ (the game reads some of them again whenever a
+# game starts, so they can't be put back) and the working directory stays
+# the game's (it loads music and saves relative to it).
+def load():
+    global game
+
+    if game is None:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        # (pygame's banner would end up in anything written to stdout)
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        for name in SIDE_EFFECT_SETTINGS:
+            os.environ.pop(name, None)
+        os.chdir(ROOT)
+        if ROOT not in sys.path:
+            sys.path.insert(0, ROOT)
+        import tetris
+        game = tetris
+        game.headless = True
+        game.music_enabled = False
+        game.sfx_enabled = False
+    return game
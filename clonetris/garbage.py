@@ -0,0 +1,103 @@
+# Starting garbage for B-Type games
+#
+# A B-Type game starts with rows of random garbage at the bottom of the
+# board (how many depends on the chosen height, like the NES) and ends once
+# B_TYPE_LINES lines have been cleared.
+#
+# Garbage rows are 10-bit masks (bit x set = column x filled), drawn from
+# random bytes and rejected if they're full or empty, so every square is
+# filled half the time and every row can still be cleared. Boards are
+# generated in bulk straight into an array("H") of row masks, which lets
+# benchmarks and bots set up millions of starting positions without ever
+# touching a block matrix.
+
+import math
+import random
+from array import array
+
+B_TYPE_LINES = 25
+
+# Rows of garbage for each height setting
+GARBAGE_HEIGHTS = [0, 3, 5, 8, 10, 12]
+
+FULL_ROW = (1 << 10) - 1
+ROWS = 20
+
+# Fraction of squares filled in valid garbage, and how many standard
+# deviations from it a batch may be (a generator that leaves out a column
+# or favours some rows is much further off on any batch of a few hundred
+# rows)
+EXPECTED_DENSITY = 0.5
+DENSITY_SIGMAS = 5
+
+############# GENERATION ###############
+
+# Generates `count` boards of garbage for a height setting with one seed.
+# Returns a flat array("H") of row masks, top row of each board first
+# (board i is rows [i * rows, (i + 1) * rows) for rows = GARBAGE_HEIGHTS[height]).
+def generate_boards(seed, count, height):
+    needed = count * GARBAGE_HEIGHTS[height]
+    rng = random.Random(seed)
+    rows = array("H")
+    while len(rows) < needed:
+        # About 1 in 512 draws is rejected, so a few spare draws are
+        # enough to almost never need a second pass
+        draws = array("H", rng.randbytes(2 * (needed - len(rows) + 16)))
+        rows.extend([mask for mask in [value & FULL_ROW for value in draws] if 0 < mask < FULL_ROW])
+    del rows[needed:]
+    return rows
+
+# The garbage for one game (a list of row masks, top row first)
+def generate_board(seed, height):
+    return list(generate_boards(seed, 1, height))
+
+# Returns the index of the first board with a full or empty row, or -1 if
+# every board is valid. Raises ValueError if the density of the whole batch
+# is off by more than DENSITY_SIGMAS standard deviations.
+def validate_boards(rows, height):
+    size = GARBAGE_HEIGHTS[height]
+    if size == 0:
+        return -1
+    if len(rows) % size:
+        raise ValueError("%d rows is not a whole number of %d row boards" % (len(rows), size))
+    for i in range(len(rows)):
+        if not 0 < rows[i] < FULL_ROW:
+            return i // size
+    if rows:
+        tolerance = DENSITY_SIGMAS * math.sqrt(EXPECTED_DENSITY * (1 - EXPECTED_DENSITY) / (10 * len(rows)))
+        if abs(density(rows) - EXPECTED_DENSITY) > tolerance:
+            raise ValueError("garbage density is %.4f (expected %.2f +- %.4f)"
+                             % (density(rows), EXPECTED_DENSITY, tolerance))
+    return -1
+
+# Fraction of garbage squares that are filled (close to 0.5 for valid boards)
+def density(rows):
+    if not rows:
+        return 0.0
+    return sum(bin(mask).count("1") for mask in rows) / (10 * len(rows))
+
+############# BOARDS ###############
+
+# Column masks (bit y set = row y filled, the format features.py uses) for
+# garbage sitting at the bottom of an otherwise empty board
+def rows_to_columns(rows):
+    # Spreads each row's 10 bits 20 apart so that one integer holds all ten
+    # columns, then cuts it back into columns
+    packed = 0
+    top = ROWS - len(rows)
+    for i in range(len(rows)):
+        packed |= spread_table[rows[i]] << (top + i)
+    return [(packed >> (ROWS * x)) & ((1 << ROWS) - 1) for x in range(10)]
+
+spread_table = [sum(1 << (ROWS * x) for x in range(10) if mask >> x & 1) for mask in range(1 << 10)]
+
+# Writes garbage into the bottom rows of a 10x20 [column][row] matrix
+def fill_matrix(matrix, rows):
+    top = ROWS - len(rows)
+    for i in range(len(rows)):
+        mask = rows[i]
+        y = top + i
+        for x in range(10):
+            if mask >> x & 1:
+                # Any block texture will do, varied so rows don't look striped
+                matrix[x][y] = (x * 3 + y) % 7 + 1
@@ -0,0 +1,101 @@
+# Frame pacing at the NES frame rate
+#
+# pygame's Clock.tick() sleeps in whole milliseconds, so at 60 fps frames
+# take 16 or 17 ms. FramePacer sleeps until shortly before the end of the
+# frame and then spins on perf_counter() for the rest, which keeps every
+# frame within a fraction of a millisecond of the target period. The spin
+# window is the CPU versus precision tradeoff: a longer one burns more CPU
+# but survives coarser OS sleeps, 0 never spins at all.
+#
+# Every frame interval goes into a histogram so that the pacing can be
+# checked in long sessions (summary() and the overlay in the game).
+
+import math
+from time import perf_counter, sleep
+
+# The NES runs at 60.0988 frames per second (rules.LEVEL_SPEEDS is in these frames)
+NES_FRAME_RATE = 60.0988
+
+# Default time spent spinning at the end of each frame (seconds)
+DEFAULT_SPIN = 0.002
+
+# Histogram buckets are BUCKET_WIDTH seconds wide, anything longer than the
+# last bucket goes into it
+BUCKET_WIDTH = 0.0001
+BUCKET_COUNT = 1000
+
+class FramePacer:
+    def __init__(self, frame_rate=NES_FRAME_RATE, spin=DEFAULT_SPIN):
+        self.period = 1 / frame_rate
+        self.spin = spin
+        self.deadline = None
+        self.last_frame = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.histogram = [0] * BUCKET_COUNT
+        self.frames = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean (Welford)
+        self.longest = 0.0
+        self.late_frames = 0
+
+    # Waits until the end of the current frame
+    def tick(self):
+        now = perf_counter()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period
+
+        # More than a frame behind (a stall or a blocking delay): start
+        # counting from now instead of rushing through frames to catch up
+        if now > self.deadline:
+            self.deadline = now
+            self.late_frames += 1
+        else:
+            remaining = self.deadline - now - self.spin
+            if remaining > 0:
+                sleep(remaining)
+            while perf_counter() < self.deadline:
+                pass
+
+        now = perf_counter()
+        if self.last_frame is not None:
+            self._record(now - self.last_frame)
+        self.last_frame = now
+
+    # Starts counting frames again from the next tick (after the game sat
+    # idle instead of ticking, which would otherwise count as a late frame)
+    def restart(self):
+        self.deadline = None
+        self.last_frame = None
+
+    def _record(self, interval):
+        self.histogram[min(int(interval / BUCKET_WIDTH), BUCKET_COUNT - 1)] += 1
+        self.frames += 1
+        delta = interval - self.mean
+        self.mean += delta / self.frames
+        self.m2 += delta * (interval - self.mean)
+        if interval > self.longest:
+            self.longest = interval
+
+    # Frame interval (seconds) below which the given fraction of frames fall
+    def percentile(self, fraction):
+        target = fraction * self.frames
+        count = 0
+        for bucket in range(BUCKET_COUNT):
+            count += self.histogram[bucket]
+            if count >= target:
+                return (bucket + 1) * BUCKET_WIDTH
+        return BUCKET_COUNT * BUCKET_WIDTH
+
+    def jitter(self):
+        return math.sqrt(self.m2 / self.frames) if self.frames else 0.0
+
+    # One line summary, times in milliseconds
+    def summary(self):
+        if self.frames == 0:
+            return "no frames yet"
+        return "%.3f fps  mean %.3f  sd %.3f  p99 %.1f  max %.2f  late %d" % (
+            1 / self.mean, self.mean * 1000, self.jitter() * 1000, self.percentile(0.99) * 1000,
+            self.longest * 1000, self.late_frames)
@@ -0,0 +1,199 @@
+# Tetromino shape tables shared by the game and by the tools that
+# rebuild boards outside of it (spectator streams, replays, etc.)
+
+# I Piece
+i_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,0 ,0, 0],
+                [0, 1 ,1 ,1 ,1, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 1, 0, 0],
+                [0, 0 ,0 ,1 ,0, 0],
+                [0, 0 ,0 ,1 ,0, 0],
+                [0, 0, 0, 1, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,0 ,0, 0],
+                [0, 1 ,1 ,1 ,1, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 1, 0, 0],
+                [0, 0 ,0 ,1 ,0, 0],
+                [0, 0 ,0 ,1 ,0, 0],
+                [0, 0, 0, 1, 0, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# J Piece
+j_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 2, 2, 2, 0],
+                [0, 0, 2, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 2, 2, 0, 0],
+                [0, 0, 0, 2, 0, 0],
+                [0, 0, 0, 2, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 2, 0],
+                [0, 0, 2, 2, 2, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 2, 0, 0],
+                [0, 0, 0, 2, 0, 0],
+                [0, 0, 0, 2, 2, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# L Piece
+l_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,0 ,0, 0],
+                [0, 0 ,3 ,3 ,3, 0],
+                [0, 0, 0, 0, 3, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,3 ,0, 0],
+                [0, 0 ,0 ,3 ,0, 0],
+                [0, 0, 3, 3, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,3 ,0 ,0, 0],
+                [0, 0 ,3 ,3 ,3, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,3 ,3, 0],
+                [0, 0 ,0 ,3 ,0, 0],
+                [0, 0, 0, 3, 0, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# O Piece
+o_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0 ,4 ,4, 0],
+                [0, 0, 0 ,4 ,4, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0 ,0 ,4 ,4, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# S Piece
+s_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0 ,0 ,0, 0],
+                [0, 0, 0 ,5 ,5, 0],
+                [0, 0, 5, 5, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,5 ,0, 0],
+                [0, 0 ,0 ,5 ,5, 0],
+                [0, 0, 0, 0, 5, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,0 ,0, 0],
+                [0, 0 ,0 ,5 ,5, 0],
+                [0, 0, 5, 5, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,5 ,0, 0],
+                [0, 0 ,0 ,5 ,5, 0],
+                [0, 0, 0, 0, 5, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# T Piece
+t_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0 ,0 ,0, 0],
+                [0, 0, 6 ,6 ,6, 0],
+                [0, 0, 0, 6, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,6 ,0, 0],
+                [0, 0 ,6 ,6 ,0, 0],
+                [0, 0, 0, 6, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,6 ,0, 0],
+                [0, 0 ,6 ,6 ,6, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0 ,0 ,6 ,0, 0],
+                [0, 0 ,0 ,6 ,6, 0],
+                [0, 0, 0, 6, 0, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# Z Piece
+z_tetromino = [[[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0 ,0, 0],
+                [0, 0, 7, 7 ,0, 0],
+                [0, 0, 0, 7, 7, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0 ,0, 7, 0],
+                [0, 0, 0 ,7, 7, 0],
+                [0, 0, 0, 7, 0, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 7, 7, 0, 0],
+                [0, 0, 0, 7, 7, 0],
+                [0, 0, 0, 0, 0, 0]],
+               [[0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 7, 0],
+                [0, 0, 0, 7, 7, 0],
+                [0, 0, 0, 7, 0, 0],
+                [0, 0, 0, 0, 0, 0]]]
+
+# Tetromino List (stored as a 6x6x4x7 matrix (6x6 blocks, 4 rotations, 7 pieces)
+tetrominoes = [i_tetromino, j_tetromino, l_tetromino, o_tetromino, s_tetromino, t_tetromino, z_tetromino]
+
+# Cell offsets from the piece center for every piece and rotation
+# (piece_cells[piece][rotation] = [(dx, dy), ...]) so that code that only
+# needs the four occupied squares doesn't have to scan the 6x6 tables
+piece_cells = [[[(i - 3, j - 3) for i in range(6) for j in range(6) if rotation[i][j] != 0]
+                for rotation in piece] for piece in tetrominoes]
+
+# The lowest square of each column a piece covers
+# (piece_bottoms[piece][rotation] = [(dx, dy), ...]), which is all that
+# decides where it lands when dropped
+piece_bottoms = [[[(dx, max(y for x, y in cells if x == dx)) for dx in sorted(set(x for x, y in cells))]
+                  for cells in piece] for piece in piece_cells]
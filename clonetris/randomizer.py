@@ -0,0 +1,150 @@
+# Piece randomizers
+#
+# Every randomizer is seeded per game and can save/restore its state as a
+# single integer (stored in replay keyframes), so the same seed always deals
+# the same pieces.
+#
+#   UniformRandomizer  every piece is equally likely (the original behaviour)
+#   NesRandomizer      the NES algorithm: a 16-bit LFSR, rerolled once if it
+#                      picks the previous piece or the unused 8th slot
+#
+# generate_sequences() deals long piece sequences for many seeds at once.
+
+import random
+from array import array
+
+# Seed used when a game asks for seed 0 (which would lock the LFSR at 0)
+NES_DEFAULT_SEED = 0x8988
+
+# The NES spawn table order (T, J, Z, O, S, L, I) as this game's piece
+# numbers, and the orientation IDs the NES adds in when it rerolls
+NES_PIECES = [5, 1, 6, 3, 4, 2, 0]
+NES_SPAWN_IDS = [0x02, 0x07, 0x08, 0x0A, 0x0B, 0x0E, 0x12]
+
+# Advances a 16-bit LFSR value one step (the NES generateNextPseudorandomNumber)
+def lfsr_step(value):
+    return (((value >> 9) ^ (value >> 1)) & 1) << 15 | (value >> 1)
+
+# Same as lfsr_step for every possible value (built the first time the bulk
+# generator needs it)
+lfsr_table = None
+
+def get_lfsr_table():
+    global lfsr_table
+
+    if lfsr_table is None:
+        lfsr_table = array("H", [lfsr_step(value) for value in range(65536)])
+    return lfsr_table
+
+############# RANDOMIZERS ###############
+
+class UniformRandomizer:
+    name = "uniform"
+
+    def __init__(self, seed=0):
+        self.random = random.Random()
+        self.reset(seed)
+
+    def reset(self, seed):
+        self.seed = seed
+        self.draws = 0
+        self.random.seed(seed)
+
+    def next_piece(self):
+        self.draws += 1
+        return self.random.randint(0, 6)
+
+    # The Mersenne Twister state is large, so the state is just how many
+    # pieces have been dealt since the seed
+    def get_state(self):
+        return self.draws
+
+    def set_state(self, state):
+        self.reset(self.seed)
+        for i in range(state):
+            self.next_piece()
+
+class NesRandomizer:
+    name = "nes"
+
+    def __init__(self, seed=0):
+        self.reset(seed)
+
+    def reset(self, seed):
+        self.seed = seed
+        self.lfsr = (seed & 0xFFFF) or NES_DEFAULT_SEED
+        self.spawn_count = 0
+        self.spawn_id = 0
+
+    # The NES steps the LFSR once a frame; here it's stepped once per piece
+    # so the sequence only depends on the seed and not on how the game was played
+    def next_piece(self):
+        self.lfsr = lfsr_step(self.lfsr)
+        self.spawn_count = (self.spawn_count + 1) & 0xFF
+
+        index = ((self.lfsr >> 8) + self.spawn_count) & 7
+        if index == 7 or NES_SPAWN_IDS[index] == self.spawn_id:
+            # Reroll
+            self.lfsr = lfsr_step(self.lfsr)
+            index = (((self.lfsr >> 8) & 7) + self.spawn_id) % 7
+
+        self.spawn_id = NES_SPAWN_IDS[index]
+        return NES_PIECES[index]
+
+    # LFSR value, spawn count and previous orientation ID packed into 32 bits
+    def get_state(self):
+        return self.lfsr | (self.spawn_count << 16) | (self.spawn_id << 24)
+
+    def set_state(self, state):
+        self.lfsr = state & 0xFFFF
+        self.spawn_count = (state >> 16) & 0xFF
+        self.spawn_id = (state >> 24) & 0xFF
+
+# Randomizers by ID (the ID is what replays store)
+RANDOMIZERS = [UniformRandomizer, NesRandomizer]
+
+def get_randomizer_id(name):
+    for i in range(len(RANDOMIZERS)):
+        if RANDOMIZERS[i].name == name:
+            return i
+    raise ValueError("unknown randomizer %r (expected one of %s)" %
+                     (name, ", ".join(randomizer.name for randomizer in RANDOMIZERS)))
+
+def make_randomizer(name, seed=0):
+    return RANDOMIZERS[get_randomizer_id(name)](seed)
+
+############# BULK GENERATION ###############
+
+# Deals `length` pieces for every seed and returns them as one flat
+# array("B") (the sequence for seeds[i] starts at i * length)
+def generate_sequences(seeds, length, name="nes"):
+    pieces = array("B", bytes(len(seeds) * length))
+    if name != "nes":
+        for i in range(len(seeds)):
+            randomizer = make_randomizer(name, seeds[i])
+            start = i * length
+            for j in range(length):
+                pieces[start + j] = randomizer.next_piece()
+        return pieces
+
+    # Same as NesRandomizer.next_piece() with the LFSR steps looked up in a
+    # table and everything kept in local variables
+    step = get_lfsr_table()
+    spawn_ids = NES_SPAWN_IDS
+    nes_pieces = NES_PIECES
+    out = 0
+    for seed in seeds:
+        lfsr = (seed & 0xFFFF) or NES_DEFAULT_SEED
+        spawn_count = 0
+        spawn_id = 0
+        for j in range(length):
+            lfsr = step[lfsr]
+            spawn_count += 1
+            index = ((lfsr >> 8) + spawn_count) & 7
+            if index == 7 or spawn_ids[index] == spawn_id:
+                lfsr = step[lfsr]
+                index = (((lfsr >> 8) & 7) + spawn_id) % 7
+            spawn_id = spawn_ids[index]
+            pieces[out] = nes_pieces[index]
+            out += 1
+    return pieces
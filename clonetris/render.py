@@ -0,0 +1,195 @@
+# Offline rendering of replays to images and raw video
+#
+# Frames are drawn by the game itself (draw_game(), drawGrid(),
+# display_next_piece()) onto an off-screen surface, with the game loaded
+# under the dummy SDL video driver (see game.py). A frame is written every
+# time the game's frame pacer would tick, so the lock and line clear delays
+# (wait_frames()) last as many frames as they do on a cabinet and the video
+# plays at the game's real speed: frame n of the video is game time n
+# (game_frame + delay_frames).
+#
+# A replay is split at its keyframes into chunks, rendered in parallel by a
+# pool of processes that each restore the keyframe their chunk starts at.
+# Since every chunk knows the game time it starts at, workers never wait
+# for each other. Frames go straight from the surface's pixel buffer to
+# disk, as one image file each or as raw video (bgr0: 4 bytes a pixel,
+# RAW_PIXEL_FORMAT) to a file or a pipe. Raw video from several workers is
+# held in temporary chunk files next to the output, deflated on the way in
+# (a game screen barely changes from one frame to the next, so a 4MB frame
+# takes tens of KB) and inflated into the output in order as chunks finish.
+#
+#   python -m clonetris video game.ctr - | ffmpeg -f rawvideo -pixel_format bgr0 \
+#       -video_size 1152x864 -framerate 60.0988 -i - game.mp4
+
+import os
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from clonetris import game as game_loader
+from clonetris import replay
+
+RAW_PIXEL_FORMAT = "bgr0"
+FRAME_SIZE = (1152, 864) # the game's window (WINDOWWIDTH, WINDOWHEIGHT)
+FRAME_NAME = "frame_%06d.%s"
+
+# Chunks per worker (more than one, so that workers that get quick chunks
+# can pick up more)
+CHUNKS_PER_WORKER = 4
+
+# Compression level of raw chunk files, and the size they're read back in
+CHUNK_COMPRESSION = 1
+CHUNK_READ_SIZE = 1 << 20
+
+# Stands in for the game's frame pacer and writes a frame on every tick
+class FrameWriter:
+    def __init__(self, surface, index, target, image_format, save_image):
+        self.surface = surface
+        self.first = index
+        self.index = index
+        self.target = target
+        self.image_format = image_format
+        self.save_image = save_image
+
+    def tick(self):
+        if self.image_format:
+            self.save_image(self.surface, os.path.join(self.target, FRAME_NAME % (self.index, self.image_format)))
+        else:
+            self.target.write(self.surface.get_view("0"))
+        self.index += 1
+
+# Raw chunk file, written deflated
+class ChunkFile:
+    def __init__(self, file_path):
+        self.file = open(file_path, "wb")
+        self.compressor = zlib.compressobj(CHUNK_COMPRESSION)
+
+    def write(self, data):
+        self.file.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file.write(self.compressor.flush())
+        self.file.close()
+
+# Inflates a raw chunk file into an output file
+def copy_chunk(file_path, output):
+    decompressor = zlib.decompressobj()
+    with open(file_path, "rb") as file:
+        while True:
+            data = file.read(CHUNK_READ_SIZE)
+            if not data:
+                break
+            output.write(decompressor.decompress(data))
+    output.write(decompressor.flush())
+
+# Renders game frames [start, end) of a replay (or up to the end of the
+# game). With an image format, each frame is saved into the target
+# directory, otherwise the raw frames are written to target (a binary file,
+# or the path of a chunk file). Returns (first video frame, frames written).
+def render_chunk(replay_path, start, end, target, image_format=None):
+    tetris = game_loader.load()
+    import pygame
+    surface = pygame.Surface(FRAME_SIZE, 0, 32)
+    window_surface = tetris.windowSurface
+    frame_pacer = tetris.frame_pacer
+    file = None
+    tetris.start_replay(replay_path)
+    try:
+        if not image_format and isinstance(target, str):
+            file = ChunkFile(target)
+        tetris.seek_replay_frame(start)
+        writer = FrameWriter(surface, tetris.game.game_frame + tetris.game.delay_frames, file or target, image_format,
+                             pygame.image.save)
+        tetris.windowSurface = surface
+        tetris.frame_pacer = writer
+        tetris.headless = False
+        while tetris.game_state == 5 and tetris.game.game_frame < end:
+            tetris.step_replay()
+            writer.tick()
+        return writer.first, writer.index - writer.first
+    finally:
+        tetris.headless = True
+        tetris.windowSurface = window_surface
+        tetris.frame_pacer = frame_pacer
+        if tetris.replay_reader:
+            tetris.stop_replay()
+        if file:
+            file.close()
+
+# Splits game frames [start, end) at the replay's keyframes into about
+# `count` chunks of whole keyframe intervals. Returns [(start, end), ...].
+def plan_chunks(replay_path, start, end, count):
+    reader = replay.ReplayReader(replay_path)
+    try:
+        bounds = [start] + [frame for frame in reader.keyframe_frames if start < frame < end] + [end]
+    finally:
+        reader.close()
+    intervals = len(bounds) - 1
+    per_chunk = max(1, -(-intervals // max(1, count)))
+    return [(bounds[i], bounds[min(i + per_chunk, intervals)]) for i in range(0, intervals, per_chunk)]
+
+# Renders game frames [start, end) of a replay (end None = the whole game)
+# with `workers` processes. Images go into output (a directory), raw video
+# into output (a path, or a binary file such as stdout). Returns how many
+# frames were written.
+def render_video(replay_path, output, start=0, end=None, workers=1, image_format=None):
+    reader = replay.ReplayReader(replay_path)
+    total_frames = reader.total_frames
+    reader.close()
+    end = total_frames if end is None else min(end, total_frames)
+    chunks = plan_chunks(replay_path, start, end, workers * CHUNKS_PER_WORKER)
+
+    if image_format:
+        os.makedirs(output, exist_ok=True)
+        if workers <= 1:
+            return render_chunk(replay_path, start, end, output, image_format)[1]
+        with ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(render_chunk, replay_path, a, b, output, image_format) for a, b in chunks]
+            return sum(future.result()[1] for future in futures)
+
+    file = open(output, "wb") if isinstance(output, str) else output
+    try:
+        if workers <= 1:
+            return render_chunk(replay_path, start, end, file)[1]
+
+        # Chunks are appended to the output in order, with no more than a
+        # few waiting on disk at a time
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output)) if file is not output else None)
+        try:
+            with ProcessPoolExecutor(workers) as executor:
+                written = 0
+                pending = []
+                next_chunk = 0
+                while next_chunk < len(chunks) or pending:
+                    while next_chunk < len(chunks) and len(pending) <= workers:
+                        chunk_path = os.path.join(temp_dir, "%06d.raw" % next_chunk)
+                        a, b = chunks[next_chunk]
+                        pending.append((executor.submit(render_chunk, replay_path, a, b, chunk_path), chunk_path))
+                        next_chunk += 1
+                    future, chunk_path = pending.pop(0)
+                    written += future.result()[1]
+                    copy_chunk(chunk_path, file)
+                    os.remove(chunk_path)
+            file.flush()
+            return written
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    finally:
+        if file is not output:
+            file.close()
+
+# Draws the game screen at the start of a frame of a replay and saves it as
+# an image (any format pygame.image.save() knows from the extension)
+def render_frame(replay_path, frame, image_path):
+    tetris = game_loader.load()
+    import pygame
+    tetris.start_replay(replay_path)
+    try:
+        tetris.seek_replay_frame(frame)
+        tetris.headless = False
+        tetris.draw_game()
+        pygame.image.save(tetris.windowSurface, image_path)
+        return tetris.game.game_frame
+    finally:
+        tetris.headless = True
+        tetris.stop_replay()
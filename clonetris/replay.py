@@ -0,0 +1,237 @@
+# Binary replay files
+#
+# A replay is the game's input codes (see INPUT CODES below) stored as
+# varints with frame deltas, plus a keyframe of the complete game state (a
+# compact GameSnapshot, see snapshot.py) every KEYFRAME_INTERVAL pieces and
+# an index of those keyframes at the end of the file, so a viewer can jump
+# to any piece or frame by restoring the nearest keyframe and only
+# simulating the few frames after it.
+#
+# File layout:
+#   header    HEADER_FORMAT (magic, version, start level, randomizer ID, seed)
+#   records   varint head, then:
+#               head & 1 == 0  input     code = head >> 1 & 31, frame delta = head >> 6
+#               head & 1 == 1  keyframe  frame delta = head >> 1, varint size, payload
+#   index     per keyframe: varint frame delta, varint piece delta, varint offset delta
+#   footer    FOOTER_FORMAT (index offset, keyframe count, total frames, magic)
+
+import mmap
+import struct
+from bisect import bisect_right
+from clonetris.binfmt import write_varint, read_varint
+from clonetris.snapshot import GameSnapshot
+
+MAGIC = b"CTRP"
+VERSION = 3
+HEADER_FORMAT = "<4sBBBI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FOOTER_MAGIC = b"CTIX"
+FOOTER_FORMAT = "<QII4s"
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+
+# Pieces between keyframes (the most a seek ever has to simulate)
+KEYFRAME_INTERVAL = 8
+
+################# INPUT CODES #################
+
+# Keyboard presses (any other key still matters since every key press
+# cancels a held down key) and releases
+KEY_RIGHT = 0
+KEY_LEFT = 1
+KEY_DOWN = 2
+KEY_ROTATE_RIGHT = 3
+KEY_ROTATE_LEFT = 4
+KEY_OTHER = 5
+KEY_RELEASE_RIGHT = 6
+KEY_RELEASE_LEFT = 7
+KEY_RELEASE_DOWN = 8
+
+# Controller buttons
+BUTTON_ROTATE_RIGHT = 9
+BUTTON_ROTATE_LEFT = 10
+
+# Controller D-pad positions: HAT_BASE + (x + 1) * 3 + (y + 1)
+HAT_BASE = 11
+
+def hat_code(value):
+    return HAT_BASE + (value[0] + 1) * 3 + (value[1] + 1)
+
+def hat_value(code):
+    code -= HAT_BASE
+    return (code // 3 - 1, code % 3 - 1)
+
+# Hard drop (space, or the controller's Y button), after the D-pad codes
+KEY_HARD_DROP = HAT_BASE + 9
+
+################### WRITING ###################
+
+# Records one game into memory; close() returns the finished file contents
+class ReplayWriter:
+    def __init__(self, start_level, randomizer, seed):
+        self.buffer = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION, start_level, randomizer, seed))
+        self.last_frame = 0
+        self.index = [] # (frame, piece count, offset)
+
+    def input(self, frame, code):
+        write_varint(self.buffer, ((frame - self.last_frame) << 6) | (code << 1))
+        self.last_frame = frame
+
+    def keyframe(self, keyframe):
+        self.index.append((keyframe.frame, keyframe.piece_count, len(self.buffer)))
+        write_varint(self.buffer, ((keyframe.frame - self.last_frame) << 1) | 1)
+        payload = keyframe.pack_compact()
+        write_varint(self.buffer, len(payload))
+        self.buffer += payload
+        self.last_frame = keyframe.frame
+
+    # Appends the keyframe index and footer
+    def close(self, total_frames):
+        index_offset = len(self.buffer)
+        last_frame = last_piece = last_offset = 0
+        for frame, piece, offset in self.index:
+            write_varint(self.buffer, frame - last_frame)
+            write_varint(self.buffer, piece - last_piece)
+            write_varint(self.buffer, offset - last_offset)
+            last_frame, last_piece, last_offset = frame, piece, offset
+        self.buffer += struct.pack(FOOTER_FORMAT, index_offset, len(self.index), total_frames, FOOTER_MAGIC)
+        return bytes(self.buffer)
+
+################### READING ###################
+
+# Reads a replay file through mmap, so opening a replay only touches the
+# header, the footer and the index no matter how long the game was
+class ReplayReader:
+    def __init__(self, file_path):
+        self.file = open(file_path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.start_level, self.randomizer, self.seed = struct.unpack_from(
+            HEADER_FORMAT, self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d clonetris replay" % (file_path, VERSION))
+
+        self.index_offset, count, self.total_frames, magic = struct.unpack_from(
+            FOOTER_FORMAT, self.data, len(self.data) - FOOTER_SIZE)
+        if magic != FOOTER_MAGIC:
+            raise ValueError("%s is missing its keyframe index" % file_path)
+
+        # Keyframe index (kept as parallel lists for bisecting)
+        self.keyframe_frames = []
+        self.keyframe_pieces = []
+        self.keyframe_offsets = []
+        pos = self.index_offset
+        frame = piece = offset = 0
+        for i in range(count):
+            delta, pos = read_varint(self.data, pos)
+            frame += delta
+            delta, pos = read_varint(self.data, pos)
+            piece += delta
+            delta, pos = read_varint(self.data, pos)
+            offset += delta
+            self.keyframe_frames.append(frame)
+            self.keyframe_pieces.append(piece)
+            self.keyframe_offsets.append(offset)
+
+    # Offset of the last keyframe at or before a frame
+    def keyframe_for_frame(self, frame):
+        return self.keyframe_offsets[max(0, bisect_right(self.keyframe_frames, frame) - 1)]
+
+    # Offset of the last keyframe at or before the spawn of a piece
+    def keyframe_for_piece(self, piece):
+        return self.keyframe_offsets[max(0, bisect_right(self.keyframe_pieces, piece) - 1)]
+
+    def read_keyframe(self, offset):
+        head, pos = read_varint(self.data, offset)
+        size, pos = read_varint(self.data, pos)
+        return GameSnapshot.unpack_compact(self.data, pos)
+
+    # Yields (frame, code) for every input recorded after the keyframe at offset
+    def inputs_from(self, offset):
+        data = self.data
+        end = self.index_offset
+        head, pos = read_varint(data, offset)
+        size, pos = read_varint(data, pos)
+        frame = struct.unpack_from("<I", data, pos)[0]
+        pos += size
+        while pos < end:
+            head, pos = read_varint(data, pos)
+            if head & 1:
+                frame += head >> 1
+                size, pos = read_varint(data, pos)
+                pos += size
+            else:
+                frame += head >> 6
+                yield frame, (head >> 1) & 31
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+# Bytes read at a time by ReplayStream
+STREAM_CHUNK_SIZE = 4096
+
+# Reads a replay once from start to end out of any seekable file object (a
+# file inside a zip archive, say), holding no more than a chunk of it in
+# memory. Opening it reads the header, the footer and the first keyframe.
+class ReplayStream:
+    def __init__(self, file):
+        self.file = file
+        magic, version, self.start_level, self.randomizer, self.seed = struct.unpack(
+            HEADER_FORMAT, file.read(HEADER_SIZE))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a version %d clonetris replay" % VERSION)
+
+        file.seek(-FOOTER_SIZE, 2)
+        index_offset, count, self.total_frames, magic = struct.unpack(FOOTER_FORMAT, file.read(FOOTER_SIZE))
+        if magic != FOOTER_MAGIC:
+            raise ValueError("replay is missing its keyframe index")
+        file.seek(HEADER_SIZE)
+
+        self.buffer = bytearray()
+        self.pos = 0
+        self.left = index_offset - HEADER_SIZE # record bytes not read from the file yet
+
+        # Every recording starts with a keyframe
+        head = self._read_varint()
+        if not head & 1:
+            raise ValueError("replay doesn't start with a keyframe")
+        self.keyframe = GameSnapshot.unpack_compact(self._read(self._read_varint()))
+
+    # Makes sure size bytes are buffered (unless the records end first)
+    def _fill(self, size):
+        if len(self.buffer) - self.pos >= size or not self.left:
+            return
+        del self.buffer[:self.pos]
+        self.pos = 0
+        while len(self.buffer) < size and self.left:
+            chunk = self.file.read(min(STREAM_CHUNK_SIZE, self.left))
+            if not chunk:
+                raise ValueError("replay ends early")
+            self.buffer += chunk
+            self.left -= len(chunk)
+
+    def _read_varint(self):
+        self._fill(10)
+        value, self.pos = read_varint(self.buffer, self.pos)
+        return value
+
+    def _read(self, size):
+        self._fill(size)
+        data = bytes(self.buffer[self.pos:self.pos + size])
+        self.pos += size
+        return data
+
+    # Yields (frame, code) for every input after the first keyframe
+    def inputs(self):
+        frame = self.keyframe.frame
+        while self.pos < len(self.buffer) or self.left:
+            head = self._read_varint()
+            if head & 1:
+                frame += head >> 1
+                self._read(self._read_varint())
+            else:
+                frame += head >> 6
+                yield frame, (head >> 1) & 31
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,528 @@
+# The game rules, without the game
+#
+# Game is the one copy of the rules (pieces, moves, locks, line clears,
+# score, level and delay frames, quirks included). tetris.py plays on a
+# Game and draws it; everything else it does as a game (sound, animation,
+# spectator streams, event logs) it does from the GameEvents the rules
+# call as things happen. Importing this doesn't import pygame, so bots,
+# batch jobs and worker processes can load it in milliseconds and play
+# games as fast as Python runs them, with no window around them.
+#
+# A game is driven by input codes (see replay.py): apply_input() for each
+# input of a frame, then run_frame(). step() does both.
+# Snapshots (snapshot.py) move games between processes: take_snapshot()
+# gives the same keyframe the game records, and restore() continues from
+# one.
+
+from clonetris import garbage, randomizer, replay, snapshot, sprint
+from clonetris.pieces import tetrominoes, piece_cells
+
+# Look-up table for level fall speeds (0-29)
+LEVEL_SPEEDS = [48, 43, 38, 33, 28, 23, 18, 13, 8, 6, 5, 5, 5, 4, 4, 4, 3, 3, 3,
+                2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 1]
+
+# Start lines until next level for each starting level (0-29)
+START_LINES = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 100, 100, 100, 100, 100,
+               100, 110, 120, 130, 140, 150, 160, 170, 180, 190, 200, 200, 200,
+               200, 200]
+
+# Points per lines cleared (times the level after the clear plus one)
+LINE_POINTS = [0, 40, 120, 300, 1200]
+
+GAME_TYPES = ["A", "B", "SPRINT"]
+
+# Frames before the first piece starts falling, and the frames the lock
+# delay and the line clear animation stand for (tetris.py waits them out)
+START_DELAY = 90
+LOCK_DELAY = 13
+LINE_CLEAR_DELAY = 10 + 4 * 4 + 6
+
+SPAWN_CENTER = (5, 0)
+SPAWN_ROTATION = 3
+
+# The squares of every piece and rotation as (dx, dy, block value)
+piece_squares = [[[(dx, dy, tetrominoes[piece][rotation][dx + 3][dy + 3]) for dx, dy in piece_cells[piece][rotation]]
+                  for rotation in range(4)] for piece in range(len(tetrominoes))]
+
+# Returns the fall speed for a given level
+def get_level_speed(level):
+    return LEVEL_SPEEDS[min(level, 29)]
+
+# Returns the amount of start lines for a given level
+def get_start_lines(level):
+    return START_LINES[min(level, 29)]
+
+# What a game tells whoever is playing it, as it happens. These do nothing
+# here; tetris.py overrides them to play sounds, animate, and stream and log
+# the game. The rules' state is up to date when they're called.
+class GameEvents:
+    # The piece was drawn for the frame and auto-shifted, and falls next
+    def frame(self):
+        pass
+
+    # The piece moved a column or turned (-1 left, 1 right)
+    def moved(self, direction):
+        pass
+
+    def rotated(self, direction):
+        pass
+
+    # The piece fell some rows without locking (yet): 1 as it falls, all
+    # of them at once when hard dropped
+    def dropped(self, rows):
+        pass
+
+    # The piece locked into the board on these [(x, y), ...] squares
+    def locked(self, cells):
+        pass
+
+    # Nothing was cleared, the lock delay (LOCK_DELAY frames) follows
+    def lock_delay(self):
+        pass
+
+    # These full rows are about to be removed (LINE_CLEAR_DELAY frames)
+    def clearing(self, rows):
+        pass
+
+    # The level went up (the rows were removed, they haven't scored yet)
+    def level_up(self):
+        pass
+
+    # The rows were removed and scored `points` (lines, level and score
+    # are up to date)
+    def cleared(self, rows, points):
+        pass
+
+    # The next piece spawned and the push-down points it was owed were
+    # added to the score (it can have spawned into the stack, see ended())
+    def spawned(self, push_down_pts):
+        pass
+
+    # The game is over: the stack topped out, or a B-Type game or a sprint
+    # cleared its lines
+    def ended(self):
+        pass
+
+class Game:
+    def __init__(self, randomizer_name="nes", events=None):
+        self.piece_randomizer = randomizer.make_randomizer(randomizer_name)
+        self.events = events or GameEvents()
+        self.block_matrix = [[0 for y in range(20)] for x in range(10)]
+        # The piece as last drawn, {(x, y): block value}. It's what the game
+        # shows and what locks, so a piece that can't drop locks
+        # where it was drawn this frame, before auto_shift() moved it.
+        self.drawn = {}
+        self.push_down_pts = 0
+        self.reset()
+
+    # Resets everything but the seed (push-down points are left alone, as
+    # the original game leaves them)
+    def reset(self):
+        self.level = 0
+        self.score = 0
+        self.lines = 0
+        self.lines_to_next_level = 0
+        self.current_rotation = SPAWN_ROTATION
+        self.current_piece = self.piece_randomizer.next_piece()
+        self.next_piece = self.piece_randomizer.next_piece()
+        for column in self.block_matrix:
+            column[:] = [0] * 20
+        self.drawn.clear()
+        self.das = 0
+        self.fall_timer = 0
+        self.center = list(SPAWN_CENTER)
+        self.start_delay = START_DELAY
+        self.is_pushing_down = False
+        self.is_pushing_left = False
+        self.is_pushing_right = False
+        self.game_frame = 0
+        self.piece_count = 0
+        self.delay_frames = 0
+        self.is_b_type = False
+        self.is_sprint = False
+        self.line_frames = [] # frame each line of a sprint was cleared on
+        self.game_over = False
+
+    # Starts a game (game_type is one of GAME_TYPES, garbage_height only
+    # matters for B-Type games)
+    def start(self, start_level, seed, game_type="A", garbage_height=0):
+        self.piece_randomizer.reset(seed)
+        self.reset()
+        self.level = start_level
+        self.lines_to_next_level = get_start_lines(start_level)
+        self.is_b_type = game_type == "B"
+        if self.is_b_type:
+            garbage.fill_matrix(self.block_matrix, garbage.generate_board(self.piece_randomizer.seed, garbage_height))
+        self.is_sprint = game_type == "SPRINT"
+
+    ############# SNAPSHOTS ###############
+
+    # The state at the start of the current frame (tetris.py adds the
+    # flags only the game has, the menu's and the music's)
+    def take_snapshot(self):
+        state = snapshot.GameSnapshot()
+        state.frame = self.game_frame
+        state.piece_count = self.piece_count
+        state.current_piece = self.current_piece
+        state.next_piece = self.next_piece
+        state.rotation = self.current_rotation
+        state.center_x = self.center[0]
+        state.center_y = self.center[1]
+        state.level = self.level
+        state.lines = self.lines
+        state.score = self.score
+        state.lines_to_next_level = self.lines_to_next_level
+        state.das = self.das
+        state.fall_timer = self.fall_timer
+        state.push_down_pts = self.push_down_pts
+        state.start_delay = self.start_delay
+        state.flags = ((self.is_pushing_down and snapshot.FLAG_DOWN) | (self.is_pushing_left and snapshot.FLAG_LEFT) |
+                       (self.is_pushing_right and snapshot.FLAG_RIGHT) | (self.is_b_type and snapshot.FLAG_B_TYPE) |
+                       (self.is_sprint and snapshot.FLAG_SPRINT))
+        state.rng_state = self.piece_randomizer.get_state()
+        state.delay_frames = self.delay_frames
+        state.set_board(self.block_matrix)
+        return state
+
+    # Continues from a snapshot (a replay keyframe, say). The randomizer
+    # has to be the one the snapshot was taken with.
+    def restore(self, state):
+        self.game_frame = state.frame
+        self.piece_count = state.piece_count
+        self.current_piece = state.current_piece
+        self.next_piece = state.next_piece
+        self.current_rotation = state.rotation
+        self.center = [state.center_x, state.center_y]
+        self.level = state.level
+        self.lines = state.lines
+        self.score = state.score
+        self.lines_to_next_level = state.lines_to_next_level
+        self.das = state.das
+        self.fall_timer = state.fall_timer
+        self.push_down_pts = state.push_down_pts
+        self.start_delay = state.start_delay
+        self.is_pushing_down = bool(state.flags & snapshot.FLAG_DOWN)
+        self.is_pushing_left = bool(state.flags & snapshot.FLAG_LEFT)
+        self.is_pushing_right = bool(state.flags & snapshot.FLAG_RIGHT)
+        self.is_b_type = bool(state.flags & snapshot.FLAG_B_TYPE)
+        self.is_sprint = bool(state.flags & snapshot.FLAG_SPRINT)
+        self.delay_frames = state.delay_frames
+        self.piece_randomizer.set_state(state.rng_state)
+        state.copy_board_to(self.block_matrix)
+        # Lines cleared before the snapshot keep their frames if this game
+        # had them (rewinding), others have none
+        del self.line_frames[self.lines:]
+        while len(self.line_frames) < min(self.lines, sprint.SPRINT_LINES):
+            self.line_frames.append(None)
+        self.game_over = False
+        self.drawn.clear()
+        self.draw_piece()
+
+    ############# FRAMES ###############
+
+    # Applies the inputs of one frame and runs it
+    def step(self, codes=()):
+        for code in codes:
+            self.apply_input(code)
+        self.run_frame()
+
+    # Runs the game logic for one frame (after the inputs have been applied)
+    def run_frame(self):
+        if self.game_over:
+            return
+        self.draw_piece()
+        self.auto_shift()
+        self.events.frame()
+
+        # Delay at the start of the game
+        if self.start_delay <= 0:
+            self.piece_fall()
+        else:
+            self.start_delay -= 1
+        self.game_frame += 1
+
+    # Applies an input code to the game
+    def apply_input(self, code):
+        ### INPUTS FOR KEYBOARD ###
+        if code <= replay.KEY_OTHER:
+            # Right movement
+            if code == replay.KEY_RIGHT:
+                self.is_pushing_right = True
+                self.is_pushing_left = False
+                self.is_pushing_down = False
+
+                # A direction pressed during the entry delay doesn't reset das
+                if self.center[1] != 0 or self.fall_timer != get_level_speed(self.level):
+                    self.das = -10
+                    self.move_left_right(1)
+            # Left movement
+            if code == replay.KEY_LEFT:
+                self.is_pushing_left = True
+                self.is_pushing_right = False
+                self.is_pushing_down = False
+
+                if self.center[1] != 0 or self.fall_timer != get_level_speed(self.level):
+                    self.das = -10
+                    self.move_left_right(-1)
+
+            self.is_pushing_down = False
+            # Down (not while moving sideways, which the original game can't do)
+            if code == replay.KEY_DOWN and not (self.is_pushing_left or self.is_pushing_right):
+                self.is_pushing_down = True
+                if self.level < 29:
+                    self.fall_timer = 2
+                self.start_delay = 0
+
+            # Rotation (up also rotates)
+            if code == replay.KEY_ROTATE_RIGHT:
+                self.rotate_right()
+            if code == replay.KEY_ROTATE_LEFT:
+                self.rotate_left()
+
+        # Resets fall speed to default
+        if code == replay.KEY_RELEASE_DOWN and self.is_pushing_down:
+            self.is_pushing_down = False
+            self.fall_timer = get_level_speed(self.level)
+
+        # Resets left and right movement when released
+        if code == replay.KEY_RELEASE_RIGHT:
+            self.is_pushing_right = False
+        if code == replay.KEY_RELEASE_LEFT:
+            self.is_pushing_left = False
+
+        ### INPUTS FOR CONTROLLER ###
+        if replay.HAT_BASE <= code < replay.KEY_HARD_DROP:
+            value = replay.hat_value(code)
+
+            # Right movement
+            if value[0] == 1 and not self.is_pushing_right:
+                self.is_pushing_right = True
+                self.is_pushing_down = False
+
+                if self.center[1] != 0 or self.fall_timer != get_level_speed(self.level):
+                    self.das = -10
+                    self.move_left_right(1)
+            # Left movement
+            if value[0] == -1 and not self.is_pushing_left:
+                self.is_pushing_left = True
+                self.is_pushing_down = False
+
+                if self.center[1] != 0 or self.fall_timer != get_level_speed(self.level):
+                    self.das = -10
+                    self.move_left_right(-1)
+
+            # Down movement (not on diagonals)
+            if value[1] == -1 and value[0] == 0 and not self.is_pushing_down:
+                self.is_pushing_down = True
+                if self.level < 29:
+                    self.fall_timer = 2
+                self.start_delay = 0
+            if value[1] == 0 and self.is_pushing_down:
+                self.is_pushing_down = False
+                self.fall_timer = get_level_speed(self.level)
+
+            # Neutral resets left and right movement
+            if value[0] == 0:
+                self.is_pushing_left = False
+                self.is_pushing_right = False
+
+        # Rotation
+        if code == replay.BUTTON_ROTATE_RIGHT:
+            self.rotate_right()
+        if code == replay.BUTTON_ROTATE_LEFT:
+            self.rotate_left()
+
+        # Hard drop
+        if code == replay.KEY_HARD_DROP:
+            self.hard_drop()
+
+    ############# MOVEMENT ###############
+
+    # Determines if the current piece's position is within the allowable
+    # playspace (squares above the top are allowed)
+    def check_valid_position(self):
+        cx, cy = self.center
+        block_matrix = self.block_matrix
+        for dx, dy in piece_cells[self.current_piece][self.current_rotation]:
+            x = cx + dx
+            y = cy + dy
+            if x < 0 or x >= 10 or y >= 20:
+                return False
+            if y >= 0 and block_matrix[x][y] != 0:
+                return False
+        return True
+
+    # Draws the piece around the center: the 6x6 area around it is
+    # overwritten, anything drawn outside it stays
+    def draw_piece(self):
+        cx, cy = self.center
+        drawn = self.drawn
+        if drawn:
+            for cell in [cell for cell in drawn if 0 <= cell[0] - cx + 3 < 6 and 0 <= cell[1] - cy + 3 < 6]:
+                del drawn[cell]
+        for dx, dy, value in piece_squares[self.current_piece][self.current_rotation]:
+            x = cx + dx
+            y = cy + dy
+            if 0 <= x < 10 and 0 <= y < 20:
+                drawn[(x, y)] = value
+
+    # Controls how fast a piece falls depending on the level and if
+    # the down key is pressed
+    def piece_fall(self):
+        if self.fall_timer > 1:
+            self.fall_timer -= 1
+            return
+        if self.is_pushing_down:
+            if get_level_speed(self.level) != 1:
+                self.fall_timer = 2
+            self.push_down_pts = (self.push_down_pts + 1) % 16 # to emulate a bug in the original game
+        else:
+            self.fall_timer = get_level_speed(self.level)
+            self.push_down_pts = 0
+
+        # Drops the piece by 1 unit, or locks it if it can't
+        self.center[1] += 1
+        if not self.check_valid_position():
+            self.center[1] -= 1
+            self.is_pushing_down = False
+            self.lock_piece()
+        else:
+            self.events.dropped(1)
+
+    # Drops the piece straight down to where it lands and locks it there at
+    # once. The rows it fell count as pushed down, as if down was held the
+    # whole way.
+    def hard_drop(self):
+        if self.game_over:
+            return
+        y = self.center[1]
+        while self.check_valid_position():
+            self.center[1] += 1
+        self.center[1] -= 1
+        if not self.is_pushing_down:
+            self.push_down_pts = 0
+        self.push_down_pts = (self.push_down_pts + self.center[1] - y) % 16
+        self.is_pushing_down = False
+        self.fall_timer = get_level_speed(self.level)
+        self.start_delay = 0
+        self.events.dropped(self.center[1] - y)
+        self.drawn.clear()
+        self.draw_piece()
+        self.lock_piece()
+
+    # Auto-shifts the piece left or right if a direction is held for long
+    # enough (long delay at first, short delay afterward)
+    def auto_shift(self):
+        if self.is_pushing_left:
+            self.das += 1
+            if self.das >= 6:
+                self.das = 0
+                self.move_left_right(-1)
+        if self.is_pushing_right:
+            self.das += 1
+            if self.das >= 6:
+                self.das = 0
+                self.move_left_right(1)
+
+    # Moves the piece one column (-1 left, 1 right)
+    def move_left_right(self, direction):
+        self.center[0] += direction
+        if not self.check_valid_position():
+            self.center[0] -= direction
+            self.das = 6 # allows for piece tucking and "wall charges"
+        else:
+            self.events.moved(direction)
+
+    def rotate_left(self):
+        old_rotation = self.current_rotation
+        self.current_rotation = (old_rotation + 1) % 4
+        if not self.check_valid_position():
+            self.current_rotation = old_rotation
+        else:
+            self.events.rotated(-1)
+
+    def rotate_right(self):
+        old_rotation = self.current_rotation
+        self.current_rotation = (old_rotation - 1) % 4
+        if not self.check_valid_position():
+            self.current_rotation = old_rotation
+        else:
+            self.events.rotated(1)
+
+    ############# LOCKING ###############
+
+    # Locks the drawn piece to the board and prepares the next one
+    def lock_piece(self):
+        block_matrix = self.block_matrix
+        cells = list(self.drawn)
+        for (x, y), value in self.drawn.items():
+            block_matrix[x][y] = value
+        self.drawn.clear()
+        self.events.locked(cells)
+
+        if not self.clear_lines(cells):
+            self.delay_frames += LOCK_DELAY
+            self.events.lock_delay()
+
+        # B-Type games end once enough lines are cleared
+        if self.is_b_type and self.lines >= garbage.B_TYPE_LINES:
+            self.game_over = True
+            self.events.ended()
+            return
+
+        # So do sprints (after noting the frame of every line cleared)
+        if self.is_sprint:
+            while len(self.line_frames) < min(self.lines, sprint.SPRINT_LINES):
+                self.line_frames.append(max(0, self.game_frame + self.delay_frames - START_DELAY))
+            if self.lines >= sprint.SPRINT_LINES:
+                self.game_over = True
+                self.events.ended()
+                return
+
+        self.current_piece = self.next_piece
+        self.next_piece = self.piece_randomizer.next_piece()
+        self.piece_count += 1
+        self.center = list(SPAWN_CENTER)
+        self.current_rotation = SPAWN_ROTATION
+        push_down_pts = self.push_down_pts
+        self.score += push_down_pts
+        self.push_down_pts = 0
+        self.draw_piece()
+        self.events.spawned(push_down_pts)
+
+        # Game over if the new piece collides with the stack
+        if not self.check_valid_position():
+            self.game_over = True
+            self.events.ended()
+
+    # Clears any full rows and moves the rows above them down. Only the
+    # rows of the squares that just locked can have filled up.
+    def clear_lines(self, cells):
+        block_matrix = self.block_matrix
+        rows = sorted(y for y in set(y for x, y in cells) if all(column[y] for column in block_matrix))
+        if not rows:
+            return False
+        self.events.clearing(rows)
+        self.delay_frames += LINE_CLEAR_DELAY
+
+        # Takes each cleared row out of every column and adds an empty row
+        # at the top, which moves the rows above it down (top-down, so the
+        # rows still to clear keep their place), without a new list
+        for y in rows:
+            for column in block_matrix:
+                del column[y]
+                column.insert(0, 0)
+
+        # Updates lines, level, and score accordingly
+        cleared = len(rows)
+        self.lines += cleared
+        if not (self.is_b_type or self.is_sprint):
+            self.lines_to_next_level -= cleared
+            if self.lines_to_next_level <= 0:
+                self.level += 1
+                self.lines_to_next_level += 10
+                self.events.level_up()
+        points = LINE_POINTS[cleared] * (self.level + 1)
+        self.score += points
+        self.events.cleared(rows, points)
+        return True
@@ -0,0 +1,124 @@
+# Headless games on the rules (rules.py)
+#
+#   play_game()     plays one game with the placement bot (bot.py)
+#   simulate()      plays many, spread over worker processes if asked
+#                   (each worker only imports the rules, so starting one
+#                   costs milliseconds, not a game launch)
+#   benchmark()     times importing the rules and playing frames
+#   check_replay()  plays a recorded game on the rules from its first
+#                   keyframe and checks every later keyframe against it
+
+import os
+import random
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
+from clonetris import bot, randomizer, replay, rules, snapshot, sprint
+
+DEFAULT_LEVEL = 18
+DEFAULT_MAX_FRAMES = 60 * 60 * 60
+
+# Chance of a random input on a frame in the benchmark
+BENCHMARK_INPUT_RATE = 0.15
+
+############### GAMES ###############
+
+# Plays one game with the bot. Returns (seed, frames, pieces, lines, score,
+# level, sprint time or None).
+def play_game(seed, start_level=DEFAULT_LEVEL, game_type="A", garbage_height=0, max_frames=DEFAULT_MAX_FRAMES,
+              randomizer_name="nes"):
+    game = rules.Game(randomizer_name)
+    game.start(start_level, seed, game_type, garbage_height)
+    player = bot.Bot(game)
+    while not game.game_over and game.game_frame < max_frames:
+        game.step(player.inputs())
+    time = game.line_frames[-1] if game.is_sprint and game.lines >= sprint.SPRINT_LINES else None
+    return (seed, game.game_frame, game.piece_count, game.lines, game.score, game.level, time)
+
+# Piece seeds for a number of games (drawn from one seed, since nearby
+# seeds deal much the same pieces with the NES randomizer)
+def game_seeds(seed, count):
+    rng = random.Random(seed)
+    return [rng.getrandbits(16) for i in range(count)]
+
+# Plays a game for each seed (in order), yielding play_game()'s results as
+# they finish
+def simulate(seeds, workers=1, **settings):
+    if workers <= 1:
+        for seed in seeds:
+            yield play_game(seed, **settings)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        yield from executor.map(partial(play_game, **settings), seeds)
+
+############### BENCHMARK ###############
+
+# Prints how long a fresh interpreter takes to import the rules, and how
+# many frames a second games with random inputs and with the bot run at
+def benchmark(frames, seed):
+    code = "from time import perf_counter; start = perf_counter(); import clonetris.rules; print(perf_counter() - start)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True).stdout
+    print("import clonetris.rules: %.1fms" % (float(output) * 1000))
+
+    rng = random.Random(seed)
+    for name in ("random inputs", "bot"):
+        game = rules.Game()
+        played = 0
+        games = 0
+        start = perf_counter()
+        while played < frames:
+            if games == 0 or game.game_over:
+                game.start(rng.choice((0, 9, 18)), rng.getrandbits(16))
+                player = bot.Bot(game)
+                games += 1
+            if name == "bot":
+                game.step(player.inputs())
+            elif rng.random() < BENCHMARK_INPUT_RATE:
+                game.step((rng.randrange(replay.HAT_BASE + 9),))
+            else:
+                game.run_frame()
+            played += 1
+        elapsed = perf_counter() - start
+        print("%s: %d frames (%d games) in %.2fs, %.0f frames a second"
+              % (name, played, games, elapsed, played / elapsed))
+
+############### REPLAYS ###############
+
+# Plays a replay file on the rules. Returns the finished game, how many
+# keyframes were checked and the frames of those that didn't match.
+def check_replay(file_path):
+    reader = replay.ReplayReader(file_path)
+    try:
+        keyframes = [reader.read_keyframe(offset) for offset in reader.keyframe_offsets]
+        game = rules.Game(randomizer.RANDOMIZERS[reader.randomizer].name)
+        game.piece_randomizer.reset(reader.seed)
+        game.restore(keyframes[0])
+        inputs = reader.inputs_from(reader.keyframe_offsets[0])
+        next_input = next(inputs, None)
+        next_keyframe = 1
+        checked = 0
+        mismatches = []
+        while game.game_frame < reader.total_frames and not game.game_over:
+            while next_keyframe < len(keyframes) and keyframes[next_keyframe].frame <= game.game_frame:
+                expected = keyframes[next_keyframe]
+                next_keyframe += 1
+                if expected.frame < game.game_frame:
+                    continue
+                # The rules don't play music
+                expected.flags &= ~snapshot.FLAG_FAST_MUSIC
+                checked += 1
+                if expected.pack_compact() != game.take_snapshot().pack_compact():
+                    mismatches.append(expected.frame)
+            codes = []
+            while next_input and next_input[0] == game.game_frame:
+                codes.append(next_input[1])
+                next_input = next(inputs, None)
+            game.step(codes)
+        # Keyframes the game never got to
+        mismatches.extend(keyframe.frame for keyframe in keyframes[next_keyframe:])
+        return game, checked, mismatches
+    finally:
+        reader.close()
@@ -0,0 +1,137 @@
+# Compact snapshots of the complete game state
+#
+# A GameSnapshot holds everything needed to put a game back exactly where it
+# was. It packs into a fixed-size record (RECORD_FORMAT followed by the board
+# as 200 raw bytes, column by column), which is cheap enough to take every
+# frame. SnapshotRing keeps the last N of these records in one preallocated
+# bytearray for rewinding. Replay keyframes use the same fields with the board
+# packed two squares to a byte (pack_compact/unpack_compact).
+
+import struct
+from itertools import chain
+from clonetris.binfmt import pack_board, unpack_board
+
+# frame, piece count, current piece, next piece, rotation, center x, center y,
+# level, lines, score, lines to next level, das, fall timer, push-down points,
+# start delay, input flags, randomizer state, delay frames
+RECORD_FORMAT = "<IIBBBbbBIIhbBBBBII"
+HEADER_SIZE = struct.calcsize(RECORD_FORMAT)
+RECORD_SIZE = HEADER_SIZE + 200
+COMPACT_SIZE = HEADER_SIZE + 100
+
+# Input flags
+FLAG_UP = 1
+FLAG_DOWN = 2
+FLAG_LEFT = 4
+FLAG_RIGHT = 8
+FLAG_FAST_MUSIC = 16
+FLAG_B_TYPE = 32
+FLAG_SPRINT = 64
+
+EMPTY_BOARD = bytes(200)
+
+class GameSnapshot:
+    __slots__ = ("frame", "piece_count", "current_piece", "next_piece", "rotation",
+                 "center_x", "center_y", "level", "lines", "score", "lines_to_next_level",
+                 "das", "fall_timer", "push_down_pts", "start_delay", "flags", "rng_state",
+                 "delay_frames", "board")
+
+    def __init__(self):
+        self.frame = 0
+        self.piece_count = 0
+        self.current_piece = 0
+        self.next_piece = 0
+        self.rotation = 3
+        self.center_x = 5
+        self.center_y = 0
+        self.level = 0
+        self.lines = 0
+        self.score = 0
+        self.lines_to_next_level = 0
+        self.das = 0
+        self.fall_timer = 0
+        self.push_down_pts = 0
+        self.start_delay = 0
+        self.flags = 0
+        self.rng_state = 0
+        self.delay_frames = 0
+        self.board = EMPTY_BOARD
+
+    # Stores a 10x20 [column][row] matrix as 200 bytes
+    def set_board(self, matrix):
+        self.board = bytes(chain.from_iterable(matrix))
+
+    # Copies the board into an existing [column][row] matrix
+    def copy_board_to(self, matrix):
+        board = self.board
+        for x in range(10):
+            matrix[x][:] = board[x * 20:x * 20 + 20]
+
+    def _fields(self):
+        return (self.frame, self.piece_count, self.current_piece, self.next_piece, self.rotation,
+                self.center_x, self.center_y, self.level, self.lines, self.score,
+                self.lines_to_next_level, self.das, self.fall_timer, self.push_down_pts,
+                self.start_delay, self.flags, self.rng_state, self.delay_frames)
+
+    def _set_fields(self, fields):
+        (self.frame, self.piece_count, self.current_piece, self.next_piece, self.rotation,
+         self.center_x, self.center_y, self.level, self.lines, self.score,
+         self.lines_to_next_level, self.das, self.fall_timer, self.push_down_pts,
+         self.start_delay, self.flags, self.rng_state, self.delay_frames) = fields
+
+    # Fixed-size record (RECORD_SIZE bytes)
+    def pack(self):
+        return struct.pack(RECORD_FORMAT, *self._fields()) + self.board
+
+    def pack_into(self, buffer, offset):
+        struct.pack_into(RECORD_FORMAT, buffer, offset, *self._fields())
+        buffer[offset + HEADER_SIZE:offset + RECORD_SIZE] = self.board
+
+    @classmethod
+    def unpack(cls, data, offset=0):
+        snapshot = cls()
+        snapshot._set_fields(struct.unpack_from(RECORD_FORMAT, data, offset))
+        snapshot.board = bytes(data[offset + HEADER_SIZE:offset + RECORD_SIZE])
+        return snapshot
+
+    # Smaller record for files (COMPACT_SIZE bytes)
+    def pack_compact(self):
+        matrix = [[0 for y in range(20)] for x in range(10)]
+        self.copy_board_to(matrix)
+        return struct.pack(RECORD_FORMAT, *self._fields()) + pack_board(matrix)
+
+    @classmethod
+    def unpack_compact(cls, data, offset=0):
+        snapshot = cls()
+        snapshot._set_fields(struct.unpack_from(RECORD_FORMAT, data, offset))
+        matrix = [[0 for y in range(20)] for x in range(10)]
+        unpack_board(data, matrix, offset + HEADER_SIZE)
+        snapshot.set_board(matrix)
+        return snapshot
+
+# The last `capacity` snapshots, newest last, in one preallocated buffer
+class SnapshotRing:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity * RECORD_SIZE)
+        self.head = 0 # slot the next snapshot goes into
+        self.count = 0
+
+    # Adds a snapshot, overwriting the oldest one once the ring is full
+    def push(self, snapshot):
+        snapshot.pack_into(self.buffer, self.head * RECORD_SIZE)
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    # Removes and returns the newest snapshot (None if there aren't any)
+    def pop(self):
+        if self.count == 0:
+            return None
+        self.head = (self.head - 1) % self.capacity
+        self.count -= 1
+        return GameSnapshot.unpack(self.buffer, self.head * RECORD_SIZE)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
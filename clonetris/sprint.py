@@ -0,0 +1,128 @@
+# 40 line sprints
+#
+# A sprint is timed in game frames, not wall clock time: every frame the
+# game runs plus the fixed number of frames each lock and line clear delay
+# stands for (rules.LOCK_DELAY and LINE_CLEAR_DELAY). A sprint takes the same
+# number of frames however fast the machine is and however many frames it
+# fails to draw, so times from different cabinets can be compared, and a
+# replay of a sprint times it exactly the same.
+#
+# The game remembers the frame every line was cleared on, which gives the
+# split every SPLIT_LINES lines and lets the current run be compared with
+# the best one at any line. Personal bests are kept per start level in
+# SprintRecords: an index of fixed-size records in one small file that is
+# read once when the game starts and saved whole after a run.
+#
+# File layout:
+#   header   HEADER_FORMAT (magic, version, record count)
+#   records  RECORD_FORMAT (start level, runs, frame each line of the best
+#            run was cleared on, best time for each split)
+
+import struct
+from clonetris.pacer import NES_FRAME_RATE
+
+SPRINT_LINES = 40
+SPLIT_LINES = 10
+SPLIT_COUNT = SPRINT_LINES // SPLIT_LINES
+
+MAGIC = b"CTSP"
+VERSION = 1
+HEADER_FORMAT = "<4sBH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_FORMAT = "<BI%dI%dI" % (SPRINT_LINES, SPLIT_COUNT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Sprint time (frames) as minutes'seconds"hundredths (the game's font has
+# no colon)
+def format_time(frames):
+    hundredths = int(frames * 100 / NES_FRAME_RATE)
+    return "%d'%02d\"%02d" % (hundredths // 6000, hundredths // 100 % 60, hundredths % 100)
+
+# Time difference (frames) from the best run, ahead of it is negative (the
+# font has no plus or minus either)
+def format_delta(frames):
+    hundredths = int(abs(frames) * 100 / NES_FRAME_RATE)
+    return "%d.%02d %s" % (hundredths // 100, hundredths % 100, "AHEAD" if frames <= 0 else "BEHIND")
+
+# Time each split took, from the frame each line was cleared on
+def split_times(line_frames):
+    splits = []
+    previous = 0
+    for split in range(SPLIT_COUNT):
+        frame = line_frames[(split + 1) * SPLIT_LINES - 1]
+        splits.append(frame - previous)
+        previous = frame
+    return splits
+
+# Best sprint on one start level
+class SprintRecord:
+    __slots__ = ("level", "runs", "line_frames", "best_splits")
+
+    def __init__(self, level):
+        self.level = level
+        self.runs = 0
+        self.line_frames = None # frame each line of the best run was cleared on
+        self.best_splits = None # fastest time of each split over all runs
+
+    def time(self):
+        return self.line_frames[-1]
+
+class SprintRecords:
+    def __init__(self):
+        self.records = {} # start level -> SprintRecord
+
+    @classmethod
+    def unpack(cls, data):
+        records = cls()
+        magic, version, count = struct.unpack_from(HEADER_FORMAT, data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a version %d clonetris sprint record file" % VERSION)
+        for i in range(count):
+            fields = struct.unpack_from(RECORD_FORMAT, data, HEADER_SIZE + i * RECORD_SIZE)
+            record = SprintRecord(fields[0])
+            record.runs = fields[1]
+            record.line_frames = list(fields[2:2 + SPRINT_LINES])
+            record.best_splits = list(fields[2 + SPRINT_LINES:])
+            records.records[record.level] = record
+        return records
+
+    # Reads a record file, an unreadable or missing one gives no records
+    @classmethod
+    def load(cls, file_path):
+        try:
+            with open(file_path, "rb") as file:
+                return cls.unpack(file.read())
+        except (OSError, ValueError, struct.error):
+            return cls()
+
+    def pack(self):
+        data = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(self.records)))
+        for level in sorted(self.records):
+            record = self.records[level]
+            data += struct.pack(RECORD_FORMAT, record.level, record.runs, *record.line_frames, *record.best_splits)
+        return bytes(data)
+
+    def get(self, level):
+        return self.records.get(level)
+
+    # Adds a finished sprint (the frame each of its lines was cleared on).
+    # Returns whether it's a new best and which of its splits are.
+    def add_run(self, level, line_frames):
+        record = self.records.get(level)
+        if record is None:
+            record = SprintRecord(level)
+            self.records[level] = record
+        record.runs += 1
+
+        splits = split_times(line_frames)
+        if record.best_splits is None:
+            best_splits = [True] * SPLIT_COUNT
+            record.best_splits = splits
+        else:
+            best_splits = [splits[i] < record.best_splits[i] for i in range(SPLIT_COUNT)]
+            record.best_splits = [min(splits[i], record.best_splits[i]) for i in range(SPLIT_COUNT)]
+
+        is_best = record.line_frames is None or line_frames[-1] < record.time()
+        if is_best:
+            record.line_frames = list(line_frames)
+        return is_best, best_splits
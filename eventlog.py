@@ -0,0 +1,316 @@
+# Per-game event logs and the tools to aggregate them
+#
+# Every game can write a small log of what happened in it (one file per
+# game). The aggregator reads any number of these logs one at a time and
+# only keeps counters and histograms, so its memory use doesn't grow with
+# the number of games. Run this file to aggregate logs from the command line:
+#
+#   python eventlog.py [--jobs N] <log file or directory>...
+#
+# File layout:
+#   header   HEADER_FORMAT (magic, version, start level, randomizer ID, seed)
+#   events   varint head = (frame delta << 3) | event type, then:
+#              SPAWN      byte piece
+#              LOCK       byte piece | rotation << 4, varint zigzag(x), varint zigzag(y)
+#              CLEAR      byte lines, varint points
+#              LEVEL      varint new level
+#              PUSH_DOWN  varint points
+#              GAME_OVER  varint score, varint lines, varint level
+
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from clonetris.binfmt import write_varint, read_varint, zigzag, unzigzag
+
+MAGIC = b"CTEV"
+VERSION = 1
+HEADER_FORMAT = "<4sBBBI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+FILE_EXTENSION = ".cte"
+
+EVENT_SPAWN = 0
+EVENT_LOCK = 1
+EVENT_CLEAR = 2
+EVENT_LEVEL = 3
+EVENT_PUSH_DOWN = 4
+EVENT_GAME_OVER = 5
+
+# The I piece (droughts are the runs of pieces between two of them)
+I_PIECE = 0
+
+# Droughts this long or longer share the last histogram bucket
+MAX_DROUGHT = 100
+
+################### WRITING ###################
+
+# Records one game's events into memory; close() returns the file contents
+class EventLogWriter:
+    def __init__(self, start_level, randomizer, seed):
+        self.buffer = bytearray(struct.pack(HEADER_FORMAT, MAGIC, VERSION, start_level, randomizer, seed))
+        self.last_frame = 0
+
+    def _begin(self, frame, event):
+        write_varint(self.buffer, ((frame - self.last_frame) << 3) | event)
+        self.last_frame = frame
+
+    def spawn(self, frame, piece):
+        self._begin(frame, EVENT_SPAWN)
+        self.buffer.append(piece)
+
+    def lock(self, frame, piece, rotation, x, y):
+        self._begin(frame, EVENT_LOCK)
+        self.buffer.append(piece | (rotation << 4))
+        write_varint(self.buffer, zigzag(x))
+        write_varint(self.buffer, zigzag(y))
+
+    def clear(self, frame, lines, points):
+        self._begin(frame, EVENT_CLEAR)
+        self.buffer.append(lines)
+        write_varint(self.buffer, points)
+
+    def level_up(self, frame, level):
+        self._begin(frame, EVENT_LEVEL)
+        write_varint(self.buffer, level)
+
+    def push_down(self, frame, points):
+        self._begin(frame, EVENT_PUSH_DOWN)
+        write_varint(self.buffer, points)
+
+    def game_over(self, frame, score, lines, level):
+        self._begin(frame, EVENT_GAME_OVER)
+        write_varint(self.buffer, score)
+        write_varint(self.buffer, lines)
+        write_varint(self.buffer, level)
+
+    def close(self):
+        return bytes(self.buffer)
+
+################### READING ###################
+
+# Returns (start level, randomizer ID, seed) and a generator of
+# (frame, event, values) for every event in a log
+def read_events(data):
+    magic, version, start_level, randomizer, seed = struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a version %d clonetris event log" % VERSION)
+    return (start_level, randomizer, seed), _events(data)
+
+def _events(data):
+    pos = HEADER_SIZE
+    frame = 0
+    end = len(data)
+    while pos < end:
+        head, pos = read_varint(data, pos)
+        frame += head >> 3
+        event = head & 7
+        if event == EVENT_SPAWN:
+            values = (data[pos],)
+            pos += 1
+        elif event == EVENT_LOCK:
+            packed = data[pos]
+            x, pos = read_varint(data, pos + 1)
+            y, pos = read_varint(data, pos)
+            values = (packed & 0x0F, packed >> 4, unzigzag(x), unzigzag(y))
+        elif event == EVENT_CLEAR:
+            lines = data[pos]
+            points, pos = read_varint(data, pos + 1)
+            values = (lines, points)
+        elif event == EVENT_GAME_OVER:
+            score, pos = read_varint(data, pos)
+            lines, pos = read_varint(data, pos)
+            level, pos = read_varint(data, pos)
+            values = (score, lines, level)
+        elif event == EVENT_LEVEL or event == EVENT_PUSH_DOWN:
+            value, pos = read_varint(data, pos)
+            values = (value,)
+        else:
+            raise ValueError("unknown event type %d" % event)
+        yield frame, event, values
+
+################# AGGREGATING #################
+
+# Running totals over any number of games. Stats from different processes
+# can be combined with merge().
+class EventStats:
+    def __init__(self):
+        self.games = 0
+        self.bad_logs = 0
+        self.pieces = [0] * 7
+        self.clears = [0] * 5 # clears by number of lines
+        self.droughts = [0] * (MAX_DROUGHT + 1)
+        self.longest_drought = 0
+        self.frames = 0
+        self.total_score = 0
+        self.level_points = {} # level -> points scored at that level
+        self.level_games = {} # level -> games that reached it
+        self.final_levels = {} # level -> games that ended at it
+
+    def add_log(self, data):
+        try:
+            (start_level, randomizer, seed), events = read_events(data)
+            self._add_game(start_level, events)
+        except (ValueError, IndexError, struct.error):
+            self.bad_logs += 1
+
+    def add_file(self, file_path):
+        with open(file_path, "rb") as file:
+            self.add_log(file.read())
+
+    def _add_game(self, start_level, events):
+        # Counted into locals first so that a truncated log adds nothing
+        pieces = [0] * 7
+        clears = [0] * 5
+        droughts = []
+        level_points = {}
+        level = start_level
+        levels = [start_level]
+        drought = 0
+        frame = 0
+        final = None
+
+        for frame, event, values in events:
+            if event == EVENT_SPAWN:
+                pieces[values[0]] += 1
+                if values[0] == I_PIECE:
+                    droughts.append(drought)
+                    drought = 0
+                else:
+                    drought += 1
+            elif event == EVENT_CLEAR:
+                clears[values[0]] += 1
+                level_points[level] = level_points.get(level, 0) + values[1]
+            elif event == EVENT_PUSH_DOWN:
+                level_points[level] = level_points.get(level, 0) + values[0]
+            elif event == EVENT_LEVEL:
+                level = values[0]
+                levels.append(level)
+            elif event == EVENT_GAME_OVER:
+                final = values
+        # The pieces since the last I piece count too
+        droughts.append(drought)
+
+        self.games += 1
+        self.frames += frame
+        for i in range(7):
+            self.pieces[i] += pieces[i]
+        for i in range(5):
+            self.clears[i] += clears[i]
+        for length in droughts:
+            self.droughts[min(length, MAX_DROUGHT)] += 1
+            self.longest_drought = max(self.longest_drought, length)
+        for reached, points in level_points.items():
+            self.level_points[reached] = self.level_points.get(reached, 0) + points
+        for reached in levels:
+            self.level_games[reached] = self.level_games.get(reached, 0) + 1
+        if final:
+            self.total_score += final[0]
+            self.final_levels[final[2]] = self.final_levels.get(final[2], 0) + 1
+
+    def merge(self, other):
+        self.games += other.games
+        self.bad_logs += other.bad_logs
+        self.frames += other.frames
+        self.total_score += other.total_score
+        self.longest_drought = max(self.longest_drought, other.longest_drought)
+        for i in range(7):
+            self.pieces[i] += other.pieces[i]
+        for i in range(5):
+            self.clears[i] += other.clears[i]
+        for i in range(MAX_DROUGHT + 1):
+            self.droughts[i] += other.droughts[i]
+        for table, other_table in ((self.level_points, other.level_points),
+                                   (self.level_games, other.level_games),
+                                   (self.final_levels, other.final_levels)):
+            for key, value in other_table.items():
+                table[key] = table.get(key, 0) + value
+
+    def summary(self):
+        lines = sum(count * cleared for cleared, count in enumerate(self.clears))
+        tetris_lines = 4 * self.clears[4]
+        total_pieces = sum(self.pieces)
+        drought_count = sum(self.droughts)
+        drought_total = sum(length * count for length, count in enumerate(self.droughts))
+
+        return {
+            "games": self.games,
+            "bad_logs": self.bad_logs,
+            "pieces": total_pieces,
+            "lines": lines,
+            "frames": self.frames,
+            "average_score": self.total_score / self.games if self.games else 0,
+            "tetris_rate": tetris_lines / lines if lines else 0,
+            "burn_rate": (lines - tetris_lines) / lines if lines else 0,
+            "clears": {str(cleared): self.clears[cleared] for cleared in range(1, 5)},
+            "piece_distribution": [count / total_pieces if total_pieces else 0 for count in self.pieces],
+            "average_drought": drought_total / drought_count if drought_count else 0,
+            "longest_drought": self.longest_drought,
+            "drought_histogram": {("%d+" % length if length == MAX_DROUGHT else str(length)): count
+                                  for length, count in enumerate(self.droughts) if count},
+            # Average points scored at each level by the games that reached it
+            "score_per_level": {str(level): self.level_points.get(level, 0) / self.level_games[level]
+                                for level in sorted(self.level_games)},
+            "final_levels": {str(level): self.final_levels[level] for level in sorted(self.final_levels)},
+        }
+
+################ COMMAND LINE #################
+
+# Yields every log file under the given files and directories
+def find_logs(paths):
+    for file_path in paths:
+        if os.path.isdir(file_path):
+            for directory, subdirectories, files in os.walk(file_path):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.endswith(FILE_EXTENSION):
+                        yield os.path.join(directory, name)
+        else:
+            yield file_path
+
+def aggregate_files(file_paths):
+    stats = EventStats()
+    for file_path in file_paths:
+        stats.add_file(file_path)
+    return stats
+
+# Files are handed to the workers in batches, with only a few batches
+# waiting at a time so that the list of files is never held in memory
+BATCH_SIZE = 512
+
+def aggregate(paths, jobs=1):
+    logs = find_logs(paths)
+    if jobs <= 1:
+        return aggregate_files(logs)
+
+    stats = EventStats()
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = []
+        batch = []
+        for file_path in logs:
+            batch.append(file_path)
+            if len(batch) == BATCH_SIZE:
+                pending.append(executor.submit(aggregate_files, batch))
+                batch = []
+                if len(pending) >= jobs * 2:
+                    stats.merge(pending.pop(0).result())
+        if batch:
+            pending.append(executor.submit(aggregate_files, batch))
+        for future in pending:
+            stats.merge(future.result())
+    return stats
+
+def main(args):
+    jobs = 1
+    if len(args) >= 2 and args[0] == "--jobs":
+        jobs = int(args[1])
+        args = args[2:]
+    if not args:
+        print("usage: python eventlog.py [--jobs N] <log file or directory>...")
+        return 1
+    json.dump(aggregate(args, jobs).summary(), sys.stdout, indent=2)
+    print()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
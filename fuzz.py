@@ -0,0 +1,424 @@
+# Input fuzzer for the game rules
+#
+# Plays lots of short games of the game (tetris.py) with seeded random
+# inputs, fed in every frame through apply_game_input() (the path recorded
+# replays take), and checks the game after every frame:
+#   - the active piece is inside the board and doesn't overlap the stack
+#   - the drawn piece doesn't overlap the stack
+#   - das and the rotation stay in range
+#   - no full row is left after clear_lines()
+#   - lines, level and score follow the rules of clear_lines() (written out
+#     again below, so a change to them shows up)
+#   - the incremental board features (features.py) match the board
+#   - the board a spectator decodes from the game's stream (spectate.py)
+#     matches the board
+#   - with --rules, a bare rules.Game (no game around it) played in
+#     lockstep is in exactly the same state, so nothing the game does
+#     around the rules (animations, snapshots, streams) changes them
+# The inputs lean towards awkward cases: left and right on the same frame,
+# rotating and moving into walls while the piece is still in its spawn row
+# (center[1] == 0), and inputs during the start delay.
+#
+# A failing game's inputs are shrunk (chunks of inputs are dropped for as
+# long as the game keeps failing the same way) and saved as JSON, which
+# `replay` plays again. `golden` plays a fixed set of seeds and compares
+# checkpoints of each game with GOLDEN_FILE, which catches changes in
+# behavior that don't break any invariant (after a deliberate rule change
+# or a change to the input generator, run it with --update).
+#
+#   python fuzz.py run [--games N] [--frames N] [--seed N] [--out DIR] [--rules]
+#   python fuzz.py replay <failure file> [--rules]
+#   python fuzz.py golden [--update] [--rules]
+#
+# The game is imported headless (no window, sound or delays) and without
+# the CLONETRIS_* settings that record, stream or load games.
+
+import json
+import os
+import random
+import sys
+from time import perf_counter
+import clonetris.game
+from clonetris.binfmt import pack_board
+import spectate
+from clonetris import features, replay, rules
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fuzz_golden.json")
+GOLDEN_GAMES = 16
+GOLDEN_FRAMES = 3000
+GOLDEN_INTERVAL = 500
+
+DEFAULT_GAMES = 2000
+DEFAULT_FRAMES = 600
+
+START_LEVELS = [0, 5, 9, 13, 16, 18, 19, 29]
+
+# Points per lines cleared (times the level after the clear plus one), and
+# the most push-down points a piece can add
+LINE_POINTS = [0, 40, 120, 300, 1200]
+MAX_PUSH_DOWN = 15
+
+# Input codes and how often each comes up
+INPUT_WEIGHTS = [
+    (replay.KEY_RIGHT, 4), (replay.KEY_LEFT, 4), (replay.KEY_DOWN, 1),
+    (replay.KEY_ROTATE_RIGHT, 3), (replay.KEY_ROTATE_LEFT, 3), (replay.KEY_OTHER, 1),
+    (replay.KEY_RELEASE_RIGHT, 2), (replay.KEY_RELEASE_LEFT, 2), (replay.KEY_RELEASE_DOWN, 1),
+    (replay.BUTTON_ROTATE_RIGHT, 2), (replay.BUTTON_ROTATE_LEFT, 2), (replay.KEY_HARD_DROP, 1),
+] + [(replay.hat_code((x, y)), 1) for x in (-1, 0, 1) for y in (-1, 0, 1)]
+INPUT_CODES = [code for code, weight in INPUT_WEIGHTS for i in range(weight)]
+
+# Both directions at once, in either order
+CHORDS = [(replay.KEY_LEFT, replay.KEY_RIGHT), (replay.KEY_RIGHT, replay.KEY_LEFT),
+          (replay.hat_code((-1, 0)), replay.hat_code((1, 0))), (replay.KEY_LEFT, replay.hat_code((1, 0))),
+          (replay.hat_code((-1, -1)), replay.KEY_RIGHT)]
+
+# Chance of an input on a frame (higher in the spawn row and start delay)
+INPUT_RATE = 0.15
+SPAWN_INPUT_RATE = 0.5
+CHORD_RATE = 0.1
+
+# Most frames a spectator gets to decode what one game frame sent
+SPECTATOR_FRAMES = 1000
+
+tetris = None
+game = None
+shadow = None
+spectator = None
+
+class InvariantError(Exception):
+    def __init__(self, name, message):
+        Exception.__init__(self, "%s: %s" % (name, message))
+        self.name = name
+        self.message = message
+
+# A failed check: which one, on which frame
+class Failure:
+    def __init__(self, name, message, frame):
+        self.name = name
+        self.message = message
+        self.frame = frame
+
+    def __str__(self):
+        return "frame %d: %s: %s" % (self.frame, self.name, self.message)
+
+############### THE GAME ###############
+
+# Imports the game headless (once). game is the rules.Game it plays on.
+def load_game():
+    global tetris
+    global game
+
+    if tetris is None:
+        tetris = clonetris.game.load()
+        # So that no fuzzed game ever saves a high score
+        tetris.high_score = sys.maxsize
+        game = tetris.game
+    return tetris
+
+# Plays every game on a bare rules.Game too (see compare_rules())
+def use_rules():
+    global shadow
+
+    load_game()
+    shadow = rules.Game(game.piece_randomizer.name)
+
+# A game to play: start level, type, piece seed and the inputs as
+# [frame, code] pairs (filled in as the game is played when generated)
+def make_case(seed, frames):
+    rng = random.Random(seed)
+    return {
+        "seed": seed,
+        "piece_seed": rng.getrandbits(16),
+        "level": rng.choice(START_LEVELS),
+        "game_type": "B" if rng.random() < 0.2 else "A",
+        "garbage_height": rng.randrange(6),
+        "frames": frames,
+        "inputs": [],
+    }
+
+# Takes in the stream a game sends to its spectators, like a viewer would
+class SpectatorSink:
+    def __init__(self):
+        self.decoder = spectate.StreamDecoder()
+
+    def write(self, data):
+        self.decoder.feed(data)
+
+    def flush(self):
+        pass
+
+def start_case(case):
+    global spectator
+
+    # Every game is streamed to a spectator of its own from the start
+    spectator = SpectatorSink()
+    tetris.broadcaster = spectate.StreamBroadcaster()
+    tetris.broadcaster.add_sink(spectator)
+    tetris.game_type = case["game_type"]
+    tetris.garbage_height = case["garbage_height"]
+    os.environ["CLONETRIS_SEED"] = str(case["piece_seed"])
+    try:
+        tetris.start_game(case["level"])
+    finally:
+        del os.environ["CLONETRIS_SEED"]
+    if shadow:
+        shadow.start(case["level"], case["piece_seed"], case["game_type"], case["garbage_height"])
+
+# Inputs for this frame, picked with an eye on the game state
+def generate_inputs(rng):
+    rate = SPAWN_INPUT_RATE if game.center[1] == 0 or game.start_delay > 0 else INPUT_RATE
+    if rng.random() >= rate:
+        return ()
+    if rng.random() < CHORD_RATE:
+        return rng.choice(CHORDS)
+    return (rng.choice(INPUT_CODES),)
+
+# Plays a case (generating its inputs if rng is given) and checks every
+# frame. Returns the first Failure, or None. on_frame(frame) is called after
+# every frame.
+def play_case(case, rng=None, on_frame=None):
+    start_case(case)
+    inputs = case["inputs"]
+    next_input = 0
+    for frame in range(case["frames"]):
+        if rng:
+            for code in generate_inputs(rng):
+                inputs.append([frame, code])
+        before = (game.lines, game.score, game.level, game.lines_to_next_level, game.piece_count)
+        try:
+            while next_input < len(inputs) and inputs[next_input][0] == frame:
+                tetris.apply_game_input(inputs[next_input][1])
+                if shadow:
+                    shadow.apply_input(inputs[next_input][1])
+                next_input += 1
+            # (unless a hard drop ended the game)
+            if tetris.piece_in_play:
+                tetris.run_game_frame()
+                tetris.end_game_frame()
+            check_frame(before)
+            if shadow:
+                shadow.run_frame()
+                compare_rules()
+        except InvariantError as error:
+            return Failure(error.name, error.message, frame)
+        except Exception as error:
+            return Failure(type(error).__name__, repr(error), frame)
+        if on_frame:
+            on_frame(frame)
+        if tetris.game_state != 2:
+            break
+    return None
+
+############### INVARIANTS ###############
+
+def check_frame(before):
+    lines, score, level, lines_to_next_level, piece_count = before
+
+    # Lines, level and score
+    cleared = game.lines - lines
+    if not 0 <= cleared <= 4:
+        raise InvariantError("lines", "%d lines cleared at once" % cleared)
+    expected_level = level
+    if cleared and lines_to_next_level - cleared <= 0 and not (game.is_b_type or game.is_sprint):
+        expected_level += 1
+    if game.level != expected_level:
+        raise InvariantError("level", "level %d after %d lines at level %d with %d to go"
+                             % (game.level, cleared, level, lines_to_next_level))
+    points = game.score - score - LINE_POINTS[cleared] * (game.level + 1)
+    pushed_down = points if game.piece_count != piece_count else 0
+    if points != pushed_down or not 0 <= pushed_down <= MAX_PUSH_DOWN:
+        raise InvariantError("score", "score went from %d to %d clearing %d lines at level %d"
+                             % (score, game.score, cleared, game.level))
+
+    if tetris.game_state != 2:
+        return
+
+    # The active piece and the drawn piece
+    if not game.check_valid_position():
+        raise InvariantError("overlap", "piece %d rotation %d at %s overlaps the stack or a wall"
+                             % (game.current_piece, game.current_rotation, game.center))
+    for x, y in game.drawn:
+        if game.block_matrix[x][y]:
+            raise InvariantError("drawn_overlap", "drawn piece overlaps the stack at (%d, %d)" % (x, y))
+    if not -10 <= game.das <= 6:
+        raise InvariantError("das", "das is %d" % game.das)
+    if not 0 <= game.current_rotation <= 3:
+        raise InvariantError("rotation", "rotation is %d" % game.current_rotation)
+
+    # The board only changes when a piece locks
+    if game.piece_count != piece_count:
+        columns = features.matrix_to_columns(game.block_matrix)
+        full = features.full_rows(columns)
+        if full:
+            raise InvariantError("full_row", "row %d is full after clear_lines()" % (full.bit_length() - 1))
+        if columns != tetris.board_features.columns:
+            raise InvariantError("features", "board features are out of date")
+    check_spectator()
+
+# The spectator has the game's board once it has decoded everything sent
+def check_spectator():
+    decoder = spectator.decoder
+    for i in range(SPECTATOR_FRAMES):
+        if not decoder.pending_bytes():
+            break
+        decoder.advance()
+    if decoder.pending_bytes():
+        raise InvariantError("spectator", "%d bytes of the stream weren't decoded" % decoder.pending_bytes())
+    if decoder.block_matrix != game.block_matrix:
+        for x in range(10):
+            for y in range(20):
+                if decoder.block_matrix[x][y] != game.block_matrix[x][y]:
+                    raise InvariantError("spectator", "the spectator has %d at (%d, %d) where the game has %d"
+                                         % (decoder.block_matrix[x][y], x, y, game.block_matrix[x][y]))
+
+# The bare rules must play the game exactly as the game does
+def compare_rules():
+    fields = ["current_piece", "next_piece", "current_rotation", "center", "das", "fall_timer", "start_delay",
+              "push_down_pts", "level", "lines", "lines_to_next_level", "score", "piece_count", "game_frame",
+              "delay_frames", "is_pushing_down", "is_pushing_left", "is_pushing_right", "line_frames", "game_over"]
+    for name in fields:
+        if getattr(shadow, name) != getattr(game, name):
+            raise InvariantError("rules", "%s is %s in the bare rules and %s in the game"
+                                 % (name, getattr(shadow, name), getattr(game, name)))
+    if shadow.game_over != (tetris.game_state != 2):
+        raise InvariantError("rules", "the game is %sover in the rules" % ("" if shadow.game_over else "not "))
+    if tetris.game_state == 2:
+        if shadow.block_matrix != game.block_matrix:
+            raise InvariantError("rules", "the boards differ")
+        if shadow.drawn != game.drawn:
+            raise InvariantError("rules", "the drawn pieces differ")
+
+############### SHRINKING ###############
+
+# Drops chunks of inputs (halving the chunk size when none can go) for as
+# long as the case still fails the same check, and cuts it off at the
+# failing frame
+def shrink(case, failure):
+    inputs = [pair for pair in case["inputs"] if pair[0] <= failure.frame]
+    frames = failure.frame + 1
+    chunk = max(1, len(inputs) // 2)
+    while inputs:
+        i = 0
+        removed = False
+        while i < len(inputs):
+            candidate = dict(case, inputs=inputs[:i] + inputs[i + chunk:], frames=frames)
+            result = play_case(candidate)
+            if result and result.name == failure.name:
+                inputs = candidate["inputs"]
+                frames = result.frame + 1
+                failure = result
+                removed = True
+            else:
+                i += chunk
+        if chunk == 1 and not removed:
+            break
+        if not removed:
+            chunk = max(1, chunk // 2)
+    return dict(case, inputs=inputs, frames=frames), failure
+
+############### COMMANDS ###############
+
+def run(games, frames, seed, out):
+    load_game()
+    total_frames = 0
+    failures = 0
+    start = perf_counter()
+    for i in range(games):
+        case = make_case(seed + i, frames)
+        failure = play_case(case, random.Random(case["seed"] ^ 0x5EED))
+        total_frames += failure.frame + 1 if failure else game.game_frame
+        if failure:
+            failures += 1
+            small, small_failure = shrink(case, failure)
+            small["failure"] = str(small_failure)
+            os.makedirs(out, exist_ok=True)
+            file_path = os.path.join(out, "seed_%d.json" % case["seed"])
+            with open(file_path, "w") as file:
+                json.dump(small, file)
+            print("seed %d failed at %s (shrunk to %d inputs, %d frames): %s"
+                  % (case["seed"], failure, len(small["inputs"]), small["frames"], file_path))
+    elapsed = perf_counter() - start
+    print("%d games, %d frames in %.1fs (%.2fM frames a minute), %d failures"
+          % (games, total_frames, elapsed, total_frames * 60 / elapsed / 1e6, failures))
+    return 1 if failures else 0
+
+def replay_failure(file_path):
+    load_game()
+    with open(file_path) as file:
+        case = json.load(file)
+    failure = play_case(case)
+    print(failure if failure else "no longer fails")
+    return 1 if failure else 0
+
+# Plays a golden seed and returns its checkpoints (every GOLDEN_INTERVAL
+# frames and at the end of the game)
+def golden_checkpoints(seed):
+    checkpoints = []
+    board = [None]
+
+    def checkpoint(frame):
+        # The board is cleared when the game ends, so the last one is kept
+        if tetris.game_state == 2:
+            board[0] = pack_board(game.block_matrix).hex()
+        if frame % GOLDEN_INTERVAL == GOLDEN_INTERVAL - 1 or tetris.game_state != 2:
+            checkpoints.append([frame, game.piece_count, game.current_piece, game.current_rotation,
+                                game.center[0], game.center[1], game.score, game.lines, game.level, board[0]])
+
+    case = make_case(seed, GOLDEN_FRAMES)
+    failure = play_case(case, random.Random(seed ^ 0x5EED), checkpoint)
+    if failure:
+        checkpoints.append(["failure", str(failure)])
+    return checkpoints
+
+def golden(update):
+    load_game()
+    results = {str(seed): golden_checkpoints(seed) for seed in range(GOLDEN_GAMES)}
+    if update:
+        # One checkpoint a line, so that changes are easy to read in a diff
+        with open(GOLDEN_FILE, "w") as file:
+            file.write("{\n" + ",\n".join(
+                '"%s": [\n%s\n]' % (seed, ",\n".join(json.dumps(checkpoint) for checkpoint in checkpoints))
+                for seed, checkpoints in results.items()) + "\n}\n")
+        print("Saved %d golden games to %s" % (GOLDEN_GAMES, GOLDEN_FILE))
+        return 0
+
+    with open(GOLDEN_FILE) as file:
+        expected = json.load(file)
+    changed = 0
+    for seed, checkpoints in results.items():
+        if checkpoints != expected.get(seed):
+            changed += 1
+            old = expected.get(seed) or []
+            for i in range(max(len(old), len(checkpoints))):
+                if i >= len(old) or i >= len(checkpoints) or old[i] != checkpoints[i]:
+                    print("seed %s first differs at checkpoint %d:\n  expected %s\n  got      %s"
+                          % (seed, i, old[i] if i < len(old) else None,
+                             checkpoints[i] if i < len(checkpoints) else None))
+                    break
+    print("%d of %d golden games changed" % (changed, len(results)))
+    return 1 if changed else 0
+
+def main(args):
+    # --rules (anywhere) plays every game on the rules too
+    if "--rules" in args:
+        args = [arg for arg in args if arg != "--rules"]
+        use_rules()
+    options = {"--games": DEFAULT_GAMES, "--frames": DEFAULT_FRAMES, "--seed": 0, "--out": "fuzz_failures"}
+    if args and args[0] == "run":
+        rest = args[1:]
+        while len(rest) >= 2 and rest[0] in options:
+            options[rest[0]] = rest[1] if rest[0] == "--out" else int(rest[1])
+            rest = rest[2:]
+        if not rest:
+            return run(options["--games"], options["--frames"], options["--seed"], options["--out"])
+    elif len(args) == 2 and args[0] == "replay":
+        return replay_failure(args[1])
+    elif args and args[0] == "golden" and args[1:] in ([], ["--update"]):
+        return golden(args[1:] == ["--update"])
+    print("usage: python fuzz.py run [--games N] [--frames N] [--seed N] [--out DIR] [--rules]\n"
+          "       python fuzz.py replay <failure file> [--rules]\n"
+          "       python fuzz.py golden [--update] [--rules]")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+# Garbage collection scheduling
+#
+# CPython's cyclic garbage collector runs whenever enough objects have been
+# allocated, which can be in the middle of a frame. A full collection walks
+# every object the game has (all the assets), so at the high fall speeds
+# one is enough to drop a frame.
+#
+# In the scheduled mode (the default, CLONETRIS_GC=auto leaves CPython to
+# it) the GCScheduler:
+#   - collects once and freezes everything the game loaded (gc.freeze()),
+#     so later collections never walk the assets again
+#   - turns automatic collection off while a game is being played
+#   - collects in the game's natural pauses instead: the entry delay after
+#     a piece locks and the line clear animation, where nothing moves for
+#     at least ten frames. It collects the generations CPython would have
+#     by now (the counts in gc.get_count() against gc.get_threshold()), so
+#     collections stay as small and as frequent as they would have been
+#   - turns automatic collection back on after the game and collects
+#     everything on the score screen
+#
+# Every collection is timed (gc.callbacks) in either mode. summary() counts
+# them by generation and by where they ran: in a pause, on a menu, or in
+# the middle of a frame of play (also counted separately from FAST_LEVEL
+# up, where there should never be any in the scheduled mode).
+
+import gc
+from time import perf_counter
+
+GC_MODES = ("scheduled", "auto")
+
+# Level 19 is where pieces fall a row every other frame
+FAST_LEVEL = 19
+
+class GCScheduler:
+    def __init__(self, mode="scheduled"):
+        if mode not in GC_MODES:
+            raise ValueError("unknown gc mode %r (expected one of %s)" % (mode, ", ".join(GC_MODES)))
+        self.mode = mode
+        self.scheduled = mode == "scheduled"
+        self.playing = False
+        self.in_pause = False
+        self.level = 0
+        self.thresholds = gc.get_threshold()
+        self.collection_start = None
+        self.reset_stats()
+        gc.callbacks.append(self._callback)
+
+    def reset_stats(self):
+        self.collections = [0, 0, 0]
+        self.paused_collections = 0
+        self.frame_collections = 0
+        self.fast_frame_collections = 0
+        self.pause_time = 0.0
+        self.longest_pause = 0.0
+        self.longest_frame_pause = 0.0
+
+    # Collects and freezes everything allocated so far (call once the assets
+    # are loaded)
+    def freeze(self):
+        if self.scheduled:
+            self.in_pause = True
+            gc.collect()
+            self.in_pause = False
+            gc.freeze()
+
+    # A game starts (at level)
+    def start_play(self, level):
+        self.playing = True
+        self.level = level
+        if self.scheduled:
+            gc.disable()
+
+    def set_level(self, level):
+        self.level = level
+
+    # The game is over
+    def stop_play(self):
+        self.playing = False
+        if self.scheduled:
+            gc.enable()
+
+    # Runs the collection CPython would have run by now, if any (in one of
+    # the game's pauses)
+    def collect_pause(self):
+        if not (self.scheduled and self.playing):
+            return
+        counts = gc.get_count()
+        if counts[0] < self.thresholds[0]:
+            return
+        if counts[2] >= self.thresholds[2] and counts[1] >= self.thresholds[1]:
+            generation = 2
+        elif counts[1] >= self.thresholds[1]:
+            generation = 1
+        else:
+            generation = 0
+        self.in_pause = True
+        gc.collect(generation)
+        self.in_pause = False
+
+    # Collects everything (on the score screen, where there's time)
+    def collect_idle(self):
+        if self.scheduled:
+            self.in_pause = True
+            gc.collect()
+            self.in_pause = False
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self.collection_start = perf_counter()
+            return
+        if self.collection_start is None:
+            return
+        elapsed = perf_counter() - self.collection_start
+        self.collection_start = None
+        self.collections[info["generation"]] += 1
+        self.pause_time += elapsed
+        self.longest_pause = max(self.longest_pause, elapsed)
+        if self.in_pause:
+            self.paused_collections += 1
+        elif self.playing:
+            self.frame_collections += 1
+            self.longest_frame_pause = max(self.longest_frame_pause, elapsed)
+            if self.level >= FAST_LEVEL:
+                self.fast_frame_collections += 1
+
+    # One line summary, times in milliseconds
+    def summary(self):
+        return "%s  collections %d/%d/%d  in pauses %d  in frames %d (level %d+: %d, longest %.2f)  total %.1f  longest %.2f" % (
+            self.mode, self.collections[0], self.collections[1], self.collections[2], self.paused_collections,
+            self.frame_collections, FAST_LEVEL, self.fast_frame_collections, self.longest_frame_pause * 1000,
+            self.pause_time * 1000, self.longest_pause * 1000)
@@ -0,0 +1,172 @@
+# Draws many games in one window (for monitoring walls and bot evaluation)
+#
+# Every game is shown as a scaled-down panel: the board, the next piece and
+# a line with the score, lines and level. All of the block blits for every
+# panel are collected into one list and drawn with a single Surface.blits()
+# call, and the scaled block tiles are shared by every panel of the same size.
+#
+# The games come from spectator streams (see spectate.py), either live ones
+# or stream files recorded earlier.
+
+import math
+from os import path
+import pygame
+import spectate
+from clonetris.pieces import piece_cells
+
+FONT_PATH = "textures/8_bit_fortress.ttf"
+
+# Panel size in tiles (10 board columns + 1 gap + 4 for the next piece,
+# 20 board rows + 2 for the text line)
+PANEL_COLUMNS = 15
+PANEL_ROWS = 22
+
+# Spacing between panels in pixels
+PANEL_MARGIN = 8
+
+# Scaled block textures and fonts, shared by every panel of the same size
+tile_cache = {}
+font_cache = {}
+
+def get_tiles(blocks, size):
+    if size not in tile_cache:
+        tile_cache[size] = [pygame.transform.scale(block, (size, size)).convert() for block in blocks]
+    return tile_cache[size]
+
+def get_font(size):
+    if size not in font_cache:
+        font_cache[size] = pygame.font.Font(FONT_PATH, size)
+    return font_cache[size]
+
+############# BLIT LISTS ###############
+
+# Adds a blit for every filled square of a 10x20 [column][row] matrix
+# whose top left corner is at (x0, y0)
+def grid_blits(matrix, tiles, x0, y0, size, blits):
+    for x in range(len(matrix)):
+        column = matrix[x]
+        px = x0 + size * x
+        for y in range(len(column)):
+            if column[y] != 0:
+                blits.append((tiles[column[y] - 1], (px, y0 + size * y)))
+
+# Same as grid_blits() with the tiles being areas of one atlas surface
+# (see palette.py)
+def atlas_grid_blits(matrix, atlas, rects, x0, y0, size, blits):
+    for x in range(len(matrix)):
+        column = matrix[x]
+        px = x0 + size * x
+        for y in range(len(column)):
+            if column[y] != 0:
+                blits.append((atlas, (px, y0 + size * y), rects[column[y] - 1]))
+
+# Same as atlas_grid_blits() for squares given as {(x, y): block value}
+def atlas_cell_blits(cells, atlas, rects, x0, y0, size, blits):
+    for (x, y), value in cells.items():
+        blits.append((atlas, (x0 + size * x, y0 + size * y), rects[value - 1]))
+
+# Adds a blit for every square of a piece (squares above the board are skipped)
+def piece_blits(piece, rotation, center, tiles, x0, y0, size, blits):
+    tile = tiles[piece]
+    for dx, dy in piece_cells[piece][rotation]:
+        x = center[0] + dx
+        y = center[1] + dy
+        if 0 <= x < 10 and 0 <= y < 20:
+            blits.append((tile, (x0 + size * x, y0 + size * y)))
+
+############# GAMES ###############
+
+# One game on the wall, read from a spectator stream
+class BoardView:
+    def __init__(self, stream_path):
+        self.name = path.basename(stream_path)
+        self.source = spectate.StreamSource(stream_path)
+        self.decoder = spectate.StreamDecoder()
+        self.text = None
+        self.text_key = None
+
+    def update(self):
+        self.decoder.feed(self.source.read())
+        self.decoder.advance()
+
+    # The text line only gets rendered again when the numbers change
+    def get_text(self, font):
+        decoder = self.decoder
+        key = (decoder.score, decoder.lines, decoder.level, decoder.game_over, font)
+        if key != self.text_key:
+            text = "%d  %d  L%d" % (decoder.score, decoder.lines, decoder.level)
+            if decoder.game_over:
+                text += "  OVER"
+            self.text = font.render(text, True, (255, 255, 255))
+            self.text_key = key
+        return self.text
+
+    def close(self):
+        self.source.close()
+
+############# WALL ###############
+
+class GridView:
+    def __init__(self, surface, blocks, views):
+        self.surface = surface
+        self.blocks = blocks
+        self.views = views
+        self.layout()
+
+    # Picks the number of columns that gives the biggest tiles and
+    # pre-renders the panel frames
+    def layout(self):
+        width, height = self.surface.get_size()
+        count = max(1, len(self.views))
+
+        self.size = 1
+        self.columns = 1
+        for columns in range(1, count + 1):
+            rows = math.ceil(count / columns)
+            size = min((width - PANEL_MARGIN * (columns + 1)) // (columns * PANEL_COLUMNS),
+                       (height - PANEL_MARGIN * (rows + 1)) // (rows * PANEL_ROWS))
+            if size > self.size:
+                self.size = size
+                self.columns = columns
+
+        panel_width = self.size * PANEL_COLUMNS + PANEL_MARGIN
+        panel_height = self.size * PANEL_ROWS + PANEL_MARGIN
+        self.origins = [(PANEL_MARGIN + (i % self.columns) * panel_width,
+                         PANEL_MARGIN + (i // self.columns) * panel_height) for i in range(len(self.views))]
+
+        self.tiles = get_tiles(self.blocks, self.size)
+        self.font = get_font(max(8, self.size * 3 // 4))
+
+        # Background with a frame around each board
+        self.background = pygame.Surface((width, height)).convert()
+        self.background.fill((0, 0, 0))
+        for x0, y0 in self.origins:
+            pygame.draw.rect(self.background, (64, 64, 64),
+                             (x0 - 2, y0 - 2, self.size * 10 + 4, self.size * 20 + 4), 1)
+
+    def update(self):
+        for view in self.views:
+            view.update()
+
+    def draw(self):
+        size = self.size
+        tiles = self.tiles
+        blits = []
+
+        for view, (x0, y0) in zip(self.views, self.origins):
+            decoder = view.decoder
+            grid_blits(decoder.block_matrix, tiles, x0, y0, size, blits)
+            if decoder.synced and not decoder.game_over:
+                piece_blits(decoder.current_piece, decoder.rotation, decoder.center, tiles, x0, y0, size, blits)
+
+            # Next piece (drawn in its spawn rotation)
+            piece_blits(decoder.next_piece, 3, (2, 2), tiles, x0 + size * 11, y0, size, blits)
+
+            blits.append((view.get_text(self.font), (x0, y0 + size * 20 + size // 2)))
+
+        self.surface.blit(self.background, (0, 0))
+        self.surface.blits(blits, False)
+
+    def close(self):
+        for view in self.views:
+            view.close()
@@ -0,0 +1,103 @@
+# Best-move hints for training
+#
+# A HintWorker finds the best place for the current piece, looking at the
+# next piece too (bot.choose_placement_ahead(), with the placement bot's
+# weights and only placements the piece can still get to, see finesse.py),
+# and gives back the squares it would end up on so the game can outline
+# them.
+#
+# The search runs in a separate process with a lower priority, so it never
+# holds up a frame (not even for the GIL). The game asks for a hint when a
+# piece spawns, handing over the board as column masks (a snapshot, since
+# the search only starts later), and checks on every frame whether the
+# answer is in, without ever waiting for it. Asking again (for the next
+# piece, or after a rewind) drops the hint before, so an answer for a
+# piece that's gone is never shown. The search takes milliseconds,
+# while even at level 29 a piece takes a third of a second to fall.
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from clonetris import bot, features
+from clonetris.pieces import piece_cells
+
+# How much lower the worker's priority is than the game's
+WORKER_NICENESS = 10
+
+class HintWorker:
+    def __init__(self):
+        # The game's module can't be imported again in a worker, so workers
+        # are forked (on systems without fork the search runs in a thread)
+        if "fork" in multiprocessing.get_all_start_methods():
+            self.executor = ProcessPoolExecutor(1, multiprocessing.get_context("fork"), _lower_priority)
+        else:
+            self.executor = ThreadPoolExecutor(1, "hints")
+        self.future = None
+        self.squares = None
+        self.requested_at = 0.0
+
+        self.requests = 0
+        self.delivered = 0
+        self.discarded = 0
+        self.longest = 0.0
+
+    # Asks for the best placement of piece on the board (a [column][row]
+    # matrix). The hint before, or the answer still coming for it, is
+    # dropped.
+    def request(self, block_matrix, piece, next_piece, speed, das, fall_timer):
+        self.clear()
+        self.requested_at = perf_counter()
+        self.requests += 1
+        columns = tuple(features.matrix_to_columns(block_matrix))
+        self.future = self.executor.submit(find_hint, columns, piece, next_piece, speed, das, fall_timer)
+
+    # Takes the answer if it's in, never waits. Returns True when it just
+    # came in (the squares to outline are then in squares, None if the
+    # piece has nowhere to go).
+    def poll(self):
+        if self.future is None or not self.future.done():
+            return False
+        future = self.future
+        self.future = None
+        try:
+            self.squares = future.result()
+        except Exception:
+            self.squares = None
+        self.delivered += 1
+        self.longest = max(self.longest, perf_counter() - self.requested_at)
+        return True
+
+    # Drops the hint (and any answer still coming)
+    def clear(self):
+        self._drop()
+        self.squares = None
+
+    def _drop(self):
+        if self.future is not None:
+            # (one the worker has started on finishes, but nobody reads it)
+            self.future.cancel()
+            self.future = None
+            self.discarded += 1
+
+    def close(self):
+        self._drop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # One line summary, times in milliseconds
+    def summary(self):
+        return "hints asked %d  delivered %d  discarded %d  longest %.1f" % (
+            self.requests, self.delivered, self.discarded, self.longest * 1000)
+
+# The squares the best placement puts the piece on, or None (runs in the worker)
+def find_hint(columns, piece, next_piece, speed, das, fall_timer):
+    placement = bot.choose_placement_ahead(columns, piece, next_piece, speed, das, fall_timer)
+    if placement is None:
+        return None
+    rotation, x, path = placement
+    y = features.landing_row(columns, piece, rotation, x)
+    return [(x + dx, y + dy) for dx, dy in piece_cells[piece][rotation] if y + dy >= 0]
+
+def _lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICENESS)
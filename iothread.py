@@ -0,0 +1,220 @@
+# Background disk writes
+#
+# Cabinets save to slow SD cards, where a single write (and especially an
+# fsync) can take longer than a frame. Everything the game saves goes
+# through a DiskWriter instead, which hands it to a background thread over a
+# bounded queue, so the game loop never does more than queue some bytes.
+#
+# The thread takes everything queued in one go (waiting up to BATCH_DELAY
+# for more to arrive), so writes to the same file in one batch turn into a
+# single write, then saves the files and syncs them by the fsync policy:
+#   never   leave it to the OS
+#   batch   sync every file and directory written once per batch (default)
+#   always  sync after every write
+# Whole files are written to a temporary file and renamed over the old one,
+# so a power cut leaves either the old file or the new one, never half of
+# one (unless the policy is never).
+#
+# If the disk falls so far behind that the queue fills up, the game waits
+# for room rather than losing a save. Those waits are counted, so summary()
+# shows when a card is too slow.
+
+import os
+import queue
+import threading
+from time import perf_counter
+
+FSYNC_POLICIES = ("never", "batch", "always")
+
+# Writes waiting at most (the game waits for room after this)
+DEFAULT_QUEUE_SIZE = 64
+
+# Longest the thread waits for more writes before saving a batch (seconds)
+# and the most writes in one batch
+BATCH_DELAY = 0.1
+BATCH_SIZE = 32
+
+_REPLACE = 0
+_APPEND = 1
+_FLUSH = 2
+_STOP = 3
+
+class DiskWriter:
+    def __init__(self, fsync="batch", queue_size=DEFAULT_QUEUE_SIZE):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("unknown fsync policy %r (expected one of %s)" % (fsync, ", ".join(FSYNC_POLICIES)))
+        self.fsync = fsync
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+
+        # Counted on the game's thread
+        self.queued = 0
+        self.max_depth = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+
+        # Counted on the writer thread
+        self.written = 0
+        self.bytes_written = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_error = None
+        self.write_time = 0.0
+        self.longest_batch = 0.0
+
+        self.thread = threading.Thread(target=self._run, name="disk writer", daemon=True)
+        self.thread.start()
+
+    ############# GAME THREAD ###############
+
+    # Replaces the whole file with data (bytes), creating its directory if needed
+    def write_file(self, file_path, data):
+        self._put((_REPLACE, file_path, bytes(data)))
+
+    # Adds data (bytes) to the end of the file
+    def append(self, file_path, data):
+        self._put((_APPEND, file_path, bytes(data)))
+
+    # Makes the thread save and sync everything queued so far right away.
+    # With wait the call returns once that's done (or after timeout seconds),
+    # otherwise it returns at once.
+    def flush(self, wait=False, timeout=None):
+        done = threading.Event()
+        self._put((_FLUSH, None, done))
+        if wait:
+            return done.wait(timeout)
+        return True
+
+    # Saves everything still queued and stops the thread
+    def close(self, timeout=None):
+        if self.closed:
+            return
+        self._put((_STOP, None, None))
+        self.closed = True
+        self.thread.join(timeout)
+
+    def _put(self, item):
+        if self.closed:
+            raise ValueError("disk writer is closed")
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Back-pressure: the disk is a whole queue behind
+            start = perf_counter()
+            self.queue.put(item)
+            self.stalls += 1
+            self.stall_time += perf_counter() - start
+        if item[0] <= _APPEND:
+            self.queued += 1
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def pending(self):
+        return self.queue.qsize()
+
+    # One line summary, times in milliseconds
+    def summary(self):
+        return "queued %d  written %d (%d bytes)  batches %d  coalesced %d  max queue %d  stalls %d (%.1f)  longest batch %.1f  errors %d" % (
+            self.queued, self.written, self.bytes_written, self.batches, self.coalesced, self.max_depth,
+            self.stalls, self.stall_time * 1000, self.longest_batch * 1000, self.errors)
+
+    ############# WRITER THREAD ###############
+
+    def _run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # Gathers more writes until the batch is full, a flush or stop
+            # comes in, or nothing arrives for BATCH_DELAY
+            while len(batch) < BATCH_SIZE and batch[-1][0] <= _APPEND:
+                try:
+                    batch.append(self.queue.get(timeout=BATCH_DELAY))
+                except queue.Empty:
+                    break
+
+            writes = [item for item in batch if item[0] <= _APPEND]
+            if writes:
+                self._save(writes)
+            for kind, file_path, data in batch:
+                if kind == _FLUSH:
+                    data.set()
+                elif kind == _STOP:
+                    running = False
+
+    def _save(self, writes):
+        start = perf_counter()
+
+        # Merges writes to the same file: a replace followed by appends
+        # becomes one replace, anything followed by a replace is dropped
+        merged = {}
+        for kind, file_path, data in writes:
+            previous = merged.get(file_path)
+            if previous is None or kind == _REPLACE:
+                merged[file_path] = (kind, data)
+            else:
+                merged[file_path] = (previous[0], previous[1] + data)
+        self.coalesced += len(writes) - len(merged)
+
+        synced = self.fsync != "never"
+        appended = []
+        directories = set()
+        for file_path, (kind, data) in merged.items():
+            try:
+                directory = os.path.dirname(file_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if kind == _REPLACE:
+                    temporary = file_path + ".tmp"
+                    with open(temporary, "wb") as file:
+                        file.write(data)
+                        if synced:
+                            file.flush()
+                            os.fsync(file.fileno())
+                    os.replace(temporary, file_path)
+                    directories.add(directory or ".")
+                else:
+                    with open(file_path, "ab") as file:
+                        file.write(data)
+                        if self.fsync == "always":
+                            file.flush()
+                            os.fsync(file.fileno())
+                    appended.append(file_path)
+                if self.fsync == "always":
+                    _sync_directory(directory or ".")
+                self.written += 1
+                self.bytes_written += len(data)
+            except OSError as error:
+                self._error(file_path, error)
+
+        if self.fsync == "batch":
+            for file_path in appended:
+                try:
+                    _sync_file(file_path)
+                except OSError as error:
+                    self._error(file_path, error)
+            for directory in directories:
+                _sync_directory(directory)
+
+        self.batches += 1
+        elapsed = perf_counter() - start
+        self.write_time += elapsed
+        self.longest_batch = max(self.longest_batch, elapsed)
+
+    def _error(self, file_path, error):
+        self.errors += 1
+        self.last_error = "%s: %s" % (file_path, error)
+        print("Couldn't save " + self.last_error)
+
+def _sync_file(file_path):
+    descriptor = os.open(file_path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+# Makes a rename durable (not possible on every OS, which is fine)
+def _sync_directory(directory):
+    try:
+        _sync_file(directory)
+    except OSError:
+        pass
@@ -0,0 +1,371 @@
+# Leaderboard uploads
+#
+# Every finished game (score, level, lines, start level, the hash of its
+# replay...) is sent to a central leaderboard over HTTP. The game only
+# hands results to a LeaderboardClient, which puts them on a queue; a
+# background thread does everything else, so a slow or missing network
+# never costs the game a frame.
+#
+# The thread keeps every result it hasn't managed to upload in a spool file
+# (one JSON result a line), so results survive the cabinet being offline or
+# switched off. It uploads once SYNC_THRESHOLD results are waiting or the
+# oldest has waited SYNC_INTERVAL seconds, up to BATCH_SIZE results in each
+# request: a POST of {"cabinet": ..., "results": [...]} as gzipped JSON.
+# A failed upload is tried again after a backoff that doubles up to
+# MAX_BACKOFF (with some jitter, so cabinets that lost the network together
+# don't come back together), or after the server's Retry-After. Results the
+# server rejects outright (a 4xx other than 408/429) are moved to a
+# .rejected file next to the spool instead of blocking the ones after them.
+# Each result has an id, so a server can ignore one it's seen before (a
+# batch whose response got lost is sent again).
+#
+# A stand-in server for trying it out (with --fail, that share of requests
+# fails with a 503):
+#
+#   python leaderboard.py serve [--port N] [--fail F] [--out FILE]
+#   python leaderboard.py sync <url> [spool]
+#   python leaderboard.py status [spool]
+
+import gzip
+import http.server
+import json
+import os
+import queue
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+DEFAULT_SPOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved", "leaderboard.jsonl")
+DEFAULT_PORT = 8765
+
+# Results in one upload, how many waiting (or how long the oldest has waited,
+# in seconds) before uploading
+BATCH_SIZE = 500
+SYNC_THRESHOLD = 100
+SYNC_INTERVAL = 10 * 60
+
+# Retry backoff and request timeout (seconds)
+MIN_BACKOFF = 5
+MAX_BACKOFF = 30 * 60
+REQUEST_TIMEOUT = 20
+
+# Responses worth trying again later
+RETRY_STATUSES = (408, 429)
+
+class LeaderboardClient:
+    def __init__(self, url, spool_path=DEFAULT_SPOOL, cabinet=None, batch_size=BATCH_SIZE,
+                 sync_threshold=SYNC_THRESHOLD, sync_interval=SYNC_INTERVAL):
+        self.url = url
+        self.spool_path = spool_path
+        self.cabinet = cabinet or socket.gethostname()
+        self.batch_size = batch_size
+        self.sync_threshold = sync_threshold
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue()
+        self.wake = threading.Event()
+        self.closed = False
+
+        # Results in the spool (the lock covers it and the spool file)
+        self.lock = threading.Lock()
+        self.pending = []
+
+        # Only touched on the sync thread
+        self.forced = False
+        self.failures = 0
+        self.retry_at = 0.0
+
+        # Counted on the sync thread
+        self.uploaded = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.failed_requests = 0
+        self.rejected = 0
+        self.last_error = None
+
+        self.thread = threading.Thread(target=self._run, name="leaderboard", daemon=True)
+        self.thread.start()
+
+    ############# GAME THREAD ###############
+
+    # Queues a finished game's result (a dict, see make_result()). Never
+    # blocks or raises.
+    def submit(self, result):
+        if not self.closed:
+            self.queue.put(result)
+            self.wake.set()
+
+    # Uploads everything waiting as soon as it can (on the next retry if the
+    # last upload failed), however few results there are
+    def sync(self):
+        self.queue.put(None)
+        self.wake.set()
+
+    # Stops the thread once the queued results are in the spool (they're
+    # uploaded next time). With sync, tries one last upload first. If the
+    # thread is still waiting on the network after timeout seconds, the
+    # results it hasn't got to are spooled here.
+    def close(self, timeout=None, sync=False):
+        if self.closed:
+            return
+        if sync:
+            self.sync()
+        self.closed = True
+        self.wake.set()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            self._take_submitted()
+
+    # One line summary
+    def summary(self):
+        return "waiting %d  uploaded %d  requests %d (%d bytes)  failed %d  rejected %d%s" % (
+            len(self.pending) + self.queue.qsize(), self.uploaded, self.requests, self.bytes_sent,
+            self.failed_requests, self.rejected, "  last error: %s" % self.last_error if self.last_error else "")
+
+    ############# SYNC THREAD ###############
+
+    def _run(self):
+        with self.lock:
+            self.pending[:0] = load_spool(self.spool_path)
+        while True:
+            self.wake.wait(self._wait_time())
+            self.wake.clear()
+            self._take_submitted()
+            if self.closed and not self.forced:
+                break
+            if self._sync_due():
+                self._upload_pending()
+            if self.closed:
+                break
+
+    # Moves queued results into the spool
+    def _take_submitted(self):
+        with self.lock:
+            results = []
+            while True:
+                try:
+                    result = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if result is None:
+                    self.forced = True
+                else:
+                    results.append(result)
+            if results:
+                try:
+                    append_spool(self.spool_path, results)
+                except OSError as error:
+                    # Still uploaded from memory, just not safe from a power cut
+                    self.last_error = "spool: %s" % error
+                self.pending.extend(results)
+
+    def _sync_due(self):
+        if not self.pending:
+            self.forced = False
+            return False
+        if time.time() < self.retry_at:
+            return False
+        return (self.forced or len(self.pending) >= self.sync_threshold
+                or time.time() - self.pending[0].get("finished", 0) >= self.sync_interval)
+
+    # Seconds until there could be something to upload
+    def _wait_time(self):
+        if not self.pending:
+            return None
+        now = time.time()
+        if now < self.retry_at:
+            return self.retry_at - now
+        if self.forced or len(self.pending) >= self.sync_threshold:
+            return 0.0
+        return max(0.0, self.pending[0].get("finished", 0) + self.sync_interval - now)
+
+    def _upload_pending(self):
+        while self.pending:
+            batch = self.pending[:self.batch_size]
+            outcome, retry_after = self._post(batch)
+            if outcome is None:
+                self.failures += 1
+                backoff = min(MAX_BACKOFF, MIN_BACKOFF * 2 ** (self.failures - 1))
+                self.retry_at = time.time() + max(retry_after or 0, random.uniform(backoff / 2, backoff))
+                return
+            if outcome is False:
+                self.rejected += len(batch)
+                try:
+                    append_spool(self.spool_path + ".rejected", batch)
+                except OSError as error:
+                    self.last_error = "spool: %s" % error
+            else:
+                self.uploaded += len(batch)
+            self.failures = 0
+            self.retry_at = 0.0
+            with self.lock:
+                del self.pending[:len(batch)]
+                try:
+                    write_spool(self.spool_path, self.pending)
+                except OSError as error:
+                    self.last_error = "spool: %s" % error
+        self.forced = False
+
+    # Sends a batch. Returns (True if it was taken, False if it was rejected,
+    # None to try again later; seconds the server asked to wait or None).
+    def _post(self, batch):
+        body = gzip.compress(json.dumps({"cabinet": self.cabinet, "results": batch}).encode())
+        request = urllib.request.Request(self.url, body, {"Content-Type": "application/json",
+                                                          "Content-Encoding": "gzip"}, method="POST")
+        self.requests += 1
+        self.bytes_sent += len(body)
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                response.read()
+            self.last_error = None
+            return True, None
+        except urllib.error.HTTPError as error:
+            self.last_error = "HTTP %d" % error.code
+            if 400 <= error.code < 500 and error.code not in RETRY_STATUSES:
+                return False, None
+            self.failed_requests += 1
+            return None, get_retry_after(error.headers)
+        except (OSError, ValueError) as error:
+            # URLError, timeouts, refused connections, bad URLs
+            self.failed_requests += 1
+            self.last_error = str(getattr(error, "reason", error))
+            return None, None
+
+# A finished game's result as uploaded
+def make_result(score, level, lines, start_level, game_type, frames, replay_hash=None, sprint_time=None):
+    return {"id": uuid.uuid4().hex, "finished": time.time(), "score": score, "level": level, "lines": lines,
+            "start_level": start_level, "game_type": game_type, "frames": frames, "replay_hash": replay_hash,
+            "sprint_time": sprint_time}
+
+# Seconds from a Retry-After header (only the delta form), or None
+def get_retry_after(headers):
+    try:
+        return max(0.0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+############### SPOOL FILES ###############
+
+# Reads the results in a spool file, skipping a half-written last line
+def load_spool(file_path):
+    results = []
+    try:
+        with open(file_path, "rb") as file:
+            for line in file:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return results
+
+def append_spool(file_path, results):
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "ab") as file:
+        file.write(b"".join(json.dumps(result).encode() + b"\n" for result in results))
+        file.flush()
+        os.fsync(file.fileno())
+
+# Replaces the spool with the results still waiting (by renaming a new file
+# over it, so a power cut leaves the old spool or the new one)
+def write_spool(file_path, results):
+    temporary = file_path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(b"".join(json.dumps(result).encode() + b"\n" for result in results))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, file_path)
+
+############### STAND-IN SERVER ###############
+
+# Takes uploads like the leaderboard would, ignoring results it has already
+# seen, and appends new ones to out (a file) if given
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        server.requests += 1
+        if random.random() < server.fail_rate:
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.end_headers()
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            upload = json.loads(body)
+            results = upload["results"]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.send_error(400)
+            return
+        with server.lock:
+            new = [result for result in results if result.get("id") not in server.seen]
+            server.seen.update(result.get("id") for result in new)
+            if server.out and new:
+                append_spool(server.out, new)
+        print("%s: %d results (%d new, %d bytes)" % (upload.get("cabinet"), len(results), len(new), len(body)))
+        reply = json.dumps({"accepted": len(new)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(port=DEFAULT_PORT, fail_rate=0.0, out=None, host="127.0.0.1"):
+    server = http.server.ThreadingHTTPServer((host, port), StandInHandler)
+    server.fail_rate = fail_rate
+    server.out = out
+    server.seen = set(result.get("id") for result in load_spool(out)) if out else set()
+    server.lock = threading.Lock()
+    server.requests = 0
+    return server
+
+############### COMMAND LINE ###############
+
+USAGE = """usage: python leaderboard.py serve [--port N] [--fail F] [--out FILE]
+       python leaderboard.py sync <url> [spool]
+       python leaderboard.py status [spool]"""
+
+def main(args):
+    if args[:1] == ["serve"]:
+        options = {"--port": DEFAULT_PORT, "--fail": 0.0, "--out": None}
+        rest = args[1:]
+        if len(rest) % 2 or any(name not in options for name in rest[::2]):
+            print(USAGE)
+            return 1
+        for name, value in zip(rest[::2], rest[1::2]):
+            options[name] = value
+        server = make_server(int(options["--port"]), float(options["--fail"]), options["--out"])
+        print("Leaderboard stand-in on http://127.0.0.1:%d/" % server.server_address[1])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args[:1] == ["sync"] and len(args) in (2, 3):
+        spool_path = args[2] if len(args) == 3 else DEFAULT_SPOOL
+        client = LeaderboardClient(args[1], spool_path)
+        client.close(sync=True)
+        print(client.summary())
+        return 0 if not client.pending else 1
+
+    if args[:1] == ["status"] and len(args) in (1, 2):
+        results = load_spool(args[1] if len(args) == 2 else DEFAULT_SPOOL)
+        print("%d results waiting%s" % (len(results), ", oldest from %s" % time.ctime(results[0].get("finished", 0))
+                                        if results else ""))
+        return 0
+
+    print(USAGE)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,197 @@
+# Live game state in shared memory, for overlays, analytics and bots
+#
+# The game publishes its state at the end of every frame into a
+# multiprocessing.shared_memory block with a fixed layout, which any
+# process on the same machine can read without sockets or parsing:
+#
+#   0    4s   magic (MAGIC)
+#   4    B    layout version (LAYOUT_VERSION), then 3 bytes of padding
+#   8    Q    sequence number (odd while the game is writing, 0 until it
+#             first has)
+#   16   STATE_FORMAT  game state (scene), frame, piece count, piece, next
+#                      piece, rotation, center x, center y, level, lines, score
+#   39   200 bytes     the board (locked squares only), row by row from the
+#                      top: 20 rows of 10 bytes, each a block value (0 empty)
+#
+# The sequence number works as a seqlock: the writer makes it odd before it
+# writes and even again after. A reader copies the block between two reads
+# of the number and keeps the copy only if both reads were the same even
+# number, so it never sees a board half way through a change.
+#
+# Writing costs a few microseconds: the board is only packed again when it
+# has changed (the game passes the board features' version number, see
+# features.py). CPython has no memory barriers, but stores aren't reordered
+# with each other on x86. On other CPUs a reader can in principle see a new
+# sequence number before the data it covers.
+#
+#   python livestate.py watch [--name NAME] [--board]
+
+import struct
+import sys
+import time
+from itertools import chain
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b"CTLS"
+LAYOUT_VERSION = 1
+DEFAULT_NAME = "clonetris"
+
+HEADER_FORMAT = "<4sBxxx"
+SEQUENCE_FORMAT = "<Q"
+SEQUENCE_OFFSET = struct.calcsize(HEADER_FORMAT)
+STATE_FORMAT = "<BIIBBBbbBII"
+STATE_OFFSET = SEQUENCE_OFFSET + struct.calcsize(SEQUENCE_FORMAT)
+BOARD_OFFSET = STATE_OFFSET + struct.calcsize(STATE_FORMAT)
+BOARD_SIZE = 200
+SIZE = BOARD_OFFSET + BOARD_SIZE
+
+# Tries a reader makes before giving up on a block that keeps changing
+READ_RETRIES = 100
+
+# The state as a reader got it (board is 200 bytes, row by row)
+class LiveState:
+    __slots__ = ("sequence", "scene", "frame", "piece_count", "current_piece", "next_piece", "rotation",
+                 "center_x", "center_y", "level", "lines", "score", "board")
+
+    def __init__(self, sequence, data):
+        self.sequence = sequence
+        (self.scene, self.frame, self.piece_count, self.current_piece, self.next_piece, self.rotation,
+         self.center_x, self.center_y, self.level, self.lines, self.score) = struct.unpack_from(STATE_FORMAT, data)
+        self.board = data[BOARD_OFFSET - STATE_OFFSET:]
+
+    # Block value at (x, y), y = 0 being the top row
+    def square(self, x, y):
+        return self.board[y * 10 + x]
+
+############### WRITING ###############
+
+# Creates the block (taking over one left behind by a game that didn't
+# close, if it's the right size) and publishes into it
+class LiveStateWriter:
+    def __init__(self, name=DEFAULT_NAME):
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=SIZE)
+        except FileExistsError:
+            self.memory = shared_memory.SharedMemory(name)
+            if self.memory.size < SIZE:
+                self.memory.close()
+                raise ValueError("shared memory %r is too small for the live state" % name)
+        self.buffer = self.memory.buf
+        self.sequence = 0
+        self.board_version = None
+        self.buffer[:SIZE] = bytes(SIZE)
+        struct.pack_into(HEADER_FORMAT, self.buffer, 0, MAGIC, LAYOUT_VERSION)
+
+    # Publishes one frame's state. block_matrix is the 10x20 [column][row]
+    # board, only packed again when board_version differs from last time
+    # (None = always).
+    def publish(self, scene, frame, piece_count, piece, next_piece, rotation, center, level, lines, score,
+                block_matrix, board_version=None):
+        buffer = self.buffer
+        self.sequence += 1
+        struct.pack_into(SEQUENCE_FORMAT, buffer, SEQUENCE_OFFSET, self.sequence)
+        struct.pack_into(STATE_FORMAT, buffer, STATE_OFFSET, scene, frame, piece_count, piece, next_piece,
+                         rotation, center[0], center[1], level, lines, score)
+        if board_version is None or board_version != self.board_version:
+            buffer[BOARD_OFFSET:SIZE] = bytes(chain.from_iterable(zip(*block_matrix)))
+            self.board_version = board_version
+        self.sequence += 1
+        struct.pack_into(SEQUENCE_FORMAT, buffer, SEQUENCE_OFFSET, self.sequence)
+
+    # Removes the block (readers that have it open keep their copy)
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+        self.memory.unlink()
+
+############### READING ###############
+
+class LiveStateReader:
+    def __init__(self, name=DEFAULT_NAME):
+        self.memory = _attach(name)
+        self.buffer = self.memory.buf
+        magic, version = struct.unpack_from(HEADER_FORMAT, self.buffer)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self.close()
+            raise ValueError("shared memory %r doesn't hold a live state (layout %d)" % (name, LAYOUT_VERSION))
+
+    # The sequence number, which changes every time the game publishes (a
+    # cheap way to tell whether there's anything new)
+    def sequence(self):
+        return struct.unpack_from(SEQUENCE_FORMAT, self.buffer, SEQUENCE_OFFSET)[0]
+
+    # A consistent copy of the state, or None if the game kept writing
+    # through every try
+    def read(self, retries=READ_RETRIES):
+        buffer = self.buffer
+        for attempt in range(retries):
+            before = struct.unpack_from(SEQUENCE_FORMAT, buffer, SEQUENCE_OFFSET)[0]
+            if before & 1:
+                continue
+            data = bytes(buffer[STATE_OFFSET:SIZE])
+            if struct.unpack_from(SEQUENCE_FORMAT, buffer, SEQUENCE_OFFSET)[0] == before:
+                return LiveState(before, data)
+        return None
+
+    def close(self):
+        self.buffer = None
+        self.memory.close()
+
+# Opens an existing block without handing it to the resource tracker, which
+# would remove it when the reader exits (Python before 3.13 has no track
+# argument, and the tracker is shared within a process, so readers there
+# must run in another process than the writer)
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+############### WATCHING ###############
+
+# The board as text, one line per row
+def board_lines(state):
+    return ["".join(".#"[state.square(x, y) != 0] for x in range(10)) for y in range(20)]
+
+# Prints the state every time it changes (an example reader)
+def watch(name=DEFAULT_NAME, show_board=False, interval=1 / 60):
+    reader = LiveStateReader(name)
+    try:
+        last = None
+        while True:
+            sequence = reader.sequence()
+            if sequence != last:
+                state = reader.read()
+                if state:
+                    last = state.sequence
+                    print("scene %d  frame %d  piece %d (%d, rotation %d at %d,%d)  next %d  level %d  lines %d  score %d" % (
+                        state.scene, state.frame, state.piece_count, state.current_piece, state.rotation,
+                        state.center_x, state.center_y, state.next_piece, state.level, state.lines, state.score))
+                    if show_board:
+                        print("\n".join(board_lines(state)))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+def main(args):
+    options = {"--name": DEFAULT_NAME}
+    show_board = "--board" in args
+    rest = [arg for arg in args[1:] if arg != "--board"]
+    if args[:1] != ["watch"] or len(rest) % 2 or any(name not in options for name in rest[::2]):
+        print("usage: python livestate.py watch [--name NAME] [--board]")
+        return 1
+    for name, value in zip(rest[::2], rest[1::2]):
+        options[name] = value
+    try:
+        watch(options["--name"], show_board)
+    except (FileNotFoundError, ValueError) as error:
+        print("Couldn't read the live state: %s" % error)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
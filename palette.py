@@ -0,0 +1,127 @@
+# Level colors for the blocks
+#
+# Like the NES, the block colors change every level (the ten palettes repeat
+# every ten levels). All seven blocks are packed side by side into one atlas
+# surface, and the recolored atlas for a palette is built the first time a
+# level using it is drawn and kept in a small LRU cache, so drawing never
+# recolors anything and only ever blits from one surface.
+#
+# Each block texture has three colors: the fill, a darker border and a
+# small highlight. Recoloring swaps those for shades of the level's colors:
+#   T, O, I  white fill with a border in the level's first color
+#   J, S     the level's first color
+#   L, Z     the level's second color
+
+from collections import OrderedDict
+import pygame
+
+# Two colors per level (from the NES palette), repeating every ten levels
+LEVEL_COLORS = [
+    ((60, 188, 252), (0, 88, 248)),
+    ((184, 248, 24), (0, 168, 0)),
+    ((248, 120, 248), (216, 0, 204)),
+    ((88, 216, 84), (0, 88, 248)),
+    ((88, 248, 152), (228, 0, 88)),
+    ((104, 136, 252), (88, 248, 152)),
+    ((124, 124, 124), (248, 56, 0)),
+    ((168, 0, 32), (104, 68, 252)),
+    ((248, 56, 0), (0, 88, 248)),
+    ((252, 160, 68), (248, 56, 0)),
+]
+
+WHITE = (252, 252, 252)
+
+# Block style for each piece (I, J, L, O, S, T, Z): 0 = white fill,
+# 1 = first color, 2 = second color
+PIECE_STYLES = [0, 1, 2, 0, 1, 0, 2]
+
+# Recolored atlases kept at once
+ATLAS_CACHE_SIZE = 4
+
+def _shade(color, factor):
+    return tuple(int(channel * factor) for channel in color)
+
+def _tint(color):
+    return tuple((channel + 255) // 2 for channel in color)
+
+# (fill, border, highlight) for a piece's block on a level
+def block_colors(piece, level):
+    first, second = LEVEL_COLORS[level % 10]
+    style = PIECE_STYLES[piece]
+    if style == 0:
+        return WHITE, first, WHITE
+    color = first if style == 1 else second
+    return color, _shade(color, 0.9), _tint(color)
+
+# Every color of a block texture paired with what it is (0 fill, 1 border,
+# 2 highlight). The three most common colors are the fill, border and
+# highlight in that order, any others count as whichever is closest.
+def _texture_colors(tile):
+    counts = {}
+    for x in range(tile.get_width()):
+        for y in range(tile.get_height()):
+            color = tuple(tile.get_at((x, y)))[:3]
+            counts[color] = counts.get(color, 0) + 1
+    colors = sorted(counts, key=counts.get, reverse=True)
+    main = colors[:3]
+    roles = []
+    for color in colors:
+        distances = [sum((a - b) ** 2 for a, b in zip(color, other)) for other in main]
+        roles.append((color, distances.index(min(distances))))
+    return roles
+
+# Colors that aren't in a list (near black, so nothing shows if one is missed)
+def _unused_colors(colors, count):
+    unused = []
+    blue = 1
+    while len(unused) < count:
+        if (0, 0, blue) not in colors:
+            unused.append((0, 0, blue))
+        blue += 1
+    return unused
+
+class BlockAtlas:
+    # blocks are the seven block textures, all size x size. With recolor
+    # False every level gets the original colors.
+    def __init__(self, blocks, size, recolor=True):
+        self.size = size
+        self.recolor = recolor
+        self.rects = [pygame.Rect(i * size, 0, size, size) for i in range(len(blocks))]
+        self.base = pygame.Surface((size * len(blocks), size)).convert()
+        for i in range(len(blocks)):
+            self.base.blit(blocks[i], self.rects[i])
+        self.texture_colors = [_texture_colors(block) for block in blocks]
+        self.cache = OrderedDict()
+
+    # The atlas for a level (built on first use)
+    def get(self, level):
+        if not self.recolor:
+            return self.base
+        key = level % 10
+        atlas = self.cache.get(key)
+        if atlas is None:
+            atlas = self._build(key)
+            self.cache[key] = atlas
+            if len(self.cache) > ATLAS_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return atlas
+
+    def _build(self, level):
+        atlas = self.base.copy()
+        pixels = pygame.PixelArray(atlas)
+        for piece in range(len(self.rects)):
+            rect = self.rects[piece]
+            tile = pixels[rect.left:rect.right, :]
+            # Through placeholder colors first, in case a new color is the
+            # same as one of the old ones that hasn't been replaced yet
+            roles = self.texture_colors[piece]
+            placeholders = _unused_colors([color for color, role in roles], 3)
+            for old, role in roles:
+                tile.replace(old, placeholders[role])
+            for placeholder, new in zip(placeholders, block_colors(piece, level)):
+                tile.replace(placeholder, new)
+            del tile
+        del pixels
+        return atlas
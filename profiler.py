@@ -0,0 +1,122 @@
+# On-demand profiling of a running game
+#
+# A session runs cProfile and also swaps a set of the game's module level
+# functions (and methods of objects it names, like the rules' Game) for
+# timing wrappers, so every call of them becomes a span on a timeline. When the session stops the cProfile stats are dumped to a .prof
+# file (readable with pstats or snakeviz) and the timeline to a Chrome
+# trace-event .json file (open it in chrome://tracing or ui.perfetto.dev).
+#
+# Nothing is wrapped while no session is running, so leaving the profiler in
+# a release build costs nothing until someone starts a capture.
+
+import cProfile
+import io
+import json
+import marshal
+import os
+from collections import deque
+from fnmatch import fnmatchcase
+from time import perf_counter_ns, strftime
+
+# Spans kept per session (the oldest are dropped after this, so a long
+# capture keeps its most recent minutes)
+MAX_EVENTS = 500000
+
+class Profiler:
+    # namespace is the dict the functions live in (the game's globals()) and
+    # patterns are fnmatch patterns for the names of the functions to time.
+    # methods are (object, method name) pairs timed the same way (the
+    # wrapper is set on the object, so only that object's calls are timed).
+    def __init__(self, namespace, patterns, methods=()):
+        self.namespace = namespace
+        self.patterns = patterns
+        self.methods = methods
+        self.active = False
+        self.originals = {}
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.profile = None
+        self.start_time = 0
+
+    def _wrap(self, name, function):
+        events = self.events
+
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                events.append((name, start, perf_counter_ns()))
+
+        timed.__name__ = function.__name__
+        timed.__wrapped__ = function
+        return timed
+
+    def start(self):
+        if self.active:
+            return
+        self.events.clear()
+        for name, value in list(self.namespace.items()):
+            if callable(value) and getattr(value, "__module__", None) == self.namespace.get("__name__") \
+                    and any(fnmatchcase(name, pattern) for pattern in self.patterns):
+                self.originals[name] = value
+                self.namespace[name] = self._wrap(name, value)
+        for target, name in self.methods:
+            setattr(target, name, self._wrap(name, getattr(target, name)))
+        self.start_time = perf_counter_ns()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.active = True
+
+    # Ends the session and writes <directory>/<time>.prof and
+    # <directory>/<time>.trace.json. Returns the two paths. save(path, data)
+    # writes the files (directly by default, the game passes its disk writer).
+    def stop(self, directory, save=None):
+        if not self.active:
+            return None
+        self.profile.disable()
+        self.namespace.update(self.originals)
+        self.originals = {}
+        # (the objects' own methods show through again)
+        for target, name in self.methods:
+            delattr(target, name)
+        self.active = False
+
+        save = save or _save_file
+        base = os.path.join(directory, strftime("%Y-%m-%d_%H-%M-%S"))
+        # Same contents as Profile.dump_stats()
+        self.profile.create_stats()
+        save(base + ".prof", marshal.dumps(self.profile.stats))
+        self.profile = None
+        trace = io.StringIO()
+        write_trace(trace, self.events, self.start_time)
+        save(base + ".trace.json", trace.getvalue().encode())
+        self.events.clear()
+        return base + ".prof", base + ".trace.json"
+
+    def toggle(self, directory, save=None):
+        if self.active:
+            return self.stop(directory, save)
+        self.start()
+        return None
+
+def _save_file(file_path, data):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as file:
+        file.write(data)
+
+# Writes spans as Chrome trace-event JSON ("X" complete events, times in
+# microseconds from the start of the session)
+def write_trace(file, events, start_time):
+    pid = os.getpid()
+    trace = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "clonetris"}},
+             {"name": "thread_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": "game loop"}}]
+    frame = 0
+    for name, start, end in events:
+        event = {"name": name, "ph": "X", "pid": pid, "tid": 0,
+                 "ts": (start - start_time) / 1000, "dur": (end - start) / 1000}
+        # update() runs once a frame, so its spans are numbered as frames
+        if name == "update":
+            event["args"] = {"frame": frame}
+            frame += 1
+        trace.append(event)
+    json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
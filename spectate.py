@@ -0,0 +1,340 @@
+# Compact spectator stream for broadcasting live games
+#
+# Instead of sending the whole board every frame, the game emits one small
+# event whenever something visible changes (piece spawned, moved, rotated,
+# dropped, locked, rows cleared, score changed), plus a full keyframe every
+# KEYFRAME_INTERVAL pieces so that viewers can join in the middle of a game.
+#
+# Stream layout: HEADER followed by a sequence of ops (1 byte opcode + payload)
+#   WAIT      varint frames      frames that passed since the previous op
+#   KEYFRAME  100 byte board, piece, next, rotation, x + 16, y + 16,
+#             varint score, varint lines, varint level
+#   SPAWN     1 byte (piece << 4 | next)   new piece at the spawn position
+#   LEFT / RIGHT / DROP / ROTATE_LEFT / ROTATE_RIGHT   (no payload)
+#   LOCK      1 byte count, then 1 byte (y * 10 + x) for each square the
+#             piece locked on (where it was drawn, which an auto-shift in
+#             the same frame can have moved it away from)
+#   CLEAR     3 byte little-endian mask of the rows that were cleared
+#   STATS     varint score, varint lines, varint level
+#   END       game over
+
+import os
+from clonetris.binfmt import write_varint, read_varint, pack_board, unpack_board
+
+HEADER = b"CTSS\x02"
+
+OP_WAIT = 0
+OP_KEYFRAME = 1
+OP_SPAWN = 2
+OP_LEFT = 3
+OP_RIGHT = 4
+OP_DROP = 5
+OP_ROTATE_LEFT = 6
+OP_ROTATE_RIGHT = 7
+OP_LOCK = 8
+OP_CLEAR = 9
+OP_STATS = 10
+OP_END = 11
+
+# Pieces between keyframes (bounds how far back a late joiner has to start)
+KEYFRAME_INTERVAL = 16
+
+# When more than this many bytes are waiting to be decoded the viewer has
+# fallen behind (or just joined) and the decoder stops honouring WAIT ops
+CATCH_UP_BYTES = 512
+
+############### ENCODING ###############
+
+# Builds the op stream for one game and keeps everything since the last
+# keyframe around so that new viewers can be brought up to date
+class StreamEncoder:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.since_keyframe = bytearray(HEADER)
+        self.pending_frames = 0
+        self.pieces_since_keyframe = 0
+        self.keyframe_start = None
+
+    # Counts one game frame (turned into a WAIT op before the next event)
+    def tick(self):
+        self.pending_frames += 1
+
+    def _begin(self, op):
+        if self.pending_frames:
+            self.buffer.append(OP_WAIT)
+            write_varint(self.buffer, self.pending_frames)
+            self.pending_frames = 0
+        self.buffer.append(op)
+
+    # Events without a payload (LEFT, RIGHT, DROP, ROTATE_*, END)
+    def op(self, op):
+        self._begin(op)
+
+    # cells are the (x, y) squares the piece locked on
+    def lock(self, cells):
+        self._begin(OP_LOCK)
+        self.buffer.append(len(cells))
+        for x, y in cells:
+            self.buffer.append(y * 10 + x)
+
+    def spawn(self, piece, next_piece):
+        self._begin(OP_SPAWN)
+        self.buffer.append((piece << 4) | next_piece)
+        self.pieces_since_keyframe += 1
+
+    def clear(self, rows):
+        mask = 0
+        for row in rows:
+            mask |= 1 << row
+        self._begin(OP_CLEAR)
+        self.buffer += mask.to_bytes(3, "little")
+
+    def stats(self, score, lines, level):
+        self._begin(OP_STATS)
+        write_varint(self.buffer, score)
+        write_varint(self.buffer, lines)
+        write_varint(self.buffer, level)
+
+    def keyframe(self, matrix, piece, next_piece, rotation, center, score, lines, level):
+        self._begin(OP_KEYFRAME)
+        self.keyframe_start = len(self.buffer) - 1
+        self.buffer += pack_board(matrix)
+        self.buffer += bytes((piece, next_piece, rotation, center[0] + 16, center[1] + 16))
+        write_varint(self.buffer, score)
+        write_varint(self.buffer, lines)
+        write_varint(self.buffer, level)
+        self.pieces_since_keyframe = 0
+
+    # True once enough pieces have spawned that the next spawn should be a keyframe
+    def wants_keyframe(self):
+        return self.pieces_since_keyframe >= KEYFRAME_INTERVAL
+
+    # Returns everything encoded since the last call
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+
+        # Late joiners start from the newest keyframe
+        if self.keyframe_start is not None:
+            self.since_keyframe = bytearray(HEADER) + data[self.keyframe_start:]
+            self.keyframe_start = None
+        else:
+            self.since_keyframe += data
+        return data
+
+# Sends one encoded stream to any number of sinks (anything with write()).
+# The stream is only encoded once no matter how many viewers there are.
+class StreamBroadcaster:
+    def __init__(self):
+        self.encoder = StreamEncoder()
+        self.sinks = []
+
+    # New sinks get the header plus everything since the last keyframe
+    def add_sink(self, sink):
+        try:
+            sink.write(bytes(self.encoder.since_keyframe))
+            sink.flush()
+        except OSError:
+            return
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    # Called once per frame: counts the frame and sends out any new ops
+    def end_frame(self):
+        self.encoder.tick()
+        if not self.encoder.buffer:
+            return
+        data = self.encoder.take()
+        for sink in self.sinks[:]:
+            try:
+                sink.write(data)
+                sink.flush()
+            except OSError:
+                self.sinks.remove(sink) # viewer went away
+
+    def close(self):
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except OSError:
+                pass
+        self.sinks = []
+
+############### DECODING ###############
+
+# Rebuilds the board from a stream. The decoder writes straight into the
+# matrix it was given, so passing the game's block_matrix lets draw_game()
+# render the spectated game without any copying.
+class StreamDecoder:
+    def __init__(self, matrix=None):
+        if matrix is None:
+            matrix = [[0 for y in range(20)] for x in range(10)]
+        self.block_matrix = matrix
+        self.current_piece = 0
+        self.next_piece = 0
+        self.rotation = 3
+        self.center = [5, 0]
+        self.score = 0
+        self.lines = 0
+        self.level = 0
+        self.game_over = False
+        self.synced = False
+        self.buffer = bytearray()
+        self.pos = 0
+        self.wait_frames = 0
+        self.frame = 0
+        self.op_frame = 0
+        self.due_frame = 0
+        self.has_header = False
+
+    def feed(self, data):
+        if data:
+            self.buffer += data
+
+    # Bytes received but not decoded yet
+    def pending_bytes(self):
+        return len(self.buffer) - self.pos
+
+    # Applies the ops for one displayed frame. Returns True if anything changed.
+    # A WAIT only holds back the ops after it until that many frames have
+    # passed since the op before it, so a live viewer (who receives the WAIT
+    # late, together with the op that follows it) doesn't fall further behind.
+    def advance(self):
+        self.frame += 1
+        catching_up = self.pending_bytes() > CATCH_UP_BYTES
+        if self.due_frame > self.frame and not catching_up:
+            return False
+
+        changed = False
+        while True:
+            start = self.pos
+            try:
+                op = self._apply_next()
+            except IndexError:
+                # Op isn't complete yet, try again once more data arrives
+                self.pos = start
+                break
+            changed = True
+            if op == OP_WAIT:
+                self.due_frame = self.op_frame + self.wait_frames
+                if self.due_frame > self.frame and not catching_up:
+                    break
+            else:
+                self.op_frame = self.frame
+            catching_up = self.pending_bytes() > CATCH_UP_BYTES
+
+        # Drops bytes that have already been decoded
+        if self.pos > 4096:
+            del self.buffer[:self.pos]
+            self.pos = 0
+        return changed
+
+    def _apply_next(self):
+        data = self.buffer
+        if not self.has_header:
+            if len(data) - self.pos < len(HEADER):
+                raise IndexError
+            if data[self.pos:self.pos + len(HEADER)] != HEADER:
+                raise ValueError("not a clonetris spectator stream")
+            self.pos += len(HEADER)
+            self.has_header = True
+            return None
+
+        pos = self.pos
+        op = data[pos]
+        pos += 1
+
+        if op == OP_WAIT:
+            self.wait_frames, pos = read_varint(data, pos)
+        elif op == OP_KEYFRAME:
+            if len(data) - pos < 105:
+                raise IndexError
+            board_pos = pos
+            piece, next_piece, rotation, x, y = data[pos + 100:pos + 105]
+            pos += 105
+            score, pos = read_varint(data, pos)
+            lines, pos = read_varint(data, pos)
+            level, pos = read_varint(data, pos)
+            unpack_board(data, self.block_matrix, board_pos)
+            self.current_piece = piece
+            self.next_piece = next_piece
+            self.rotation = rotation
+            self.center = [x - 16, y - 16]
+            self.score = score
+            self.lines = lines
+            self.level = level
+            self.game_over = False
+            self.synced = True
+        elif op == OP_STATS:
+            score, pos = read_varint(data, pos)
+            lines, pos = read_varint(data, pos)
+            level, pos = read_varint(data, pos)
+            self.score, self.lines, self.level = score, lines, level
+        elif op == OP_CLEAR:
+            if len(data) - pos < 3:
+                raise IndexError
+            mask = int.from_bytes(data[pos:pos + 3], "little")
+            pos += 3
+            if self.synced:
+                self._clear_rows(mask)
+        elif op == OP_SPAWN:
+            packed = data[pos]
+            pos += 1
+            self.current_piece = packed >> 4
+            self.next_piece = packed & 0x0F
+            self.rotation = 3
+            self.center = [5, 0]
+        elif op == OP_LEFT:
+            self.center[0] -= 1
+        elif op == OP_RIGHT:
+            self.center[0] += 1
+        elif op == OP_DROP:
+            self.center[1] += 1
+        elif op == OP_ROTATE_LEFT:
+            self.rotation = (self.rotation + 1) % 4
+        elif op == OP_ROTATE_RIGHT:
+            self.rotation = (self.rotation - 1) % 4
+        elif op == OP_LOCK:
+            count = data[pos]
+            if len(data) - pos - 1 < count:
+                raise IndexError
+            squares = data[pos + 1:pos + 1 + count]
+            pos += 1 + count
+            if self.synced:
+                self._lock_piece(squares)
+        elif op == OP_END:
+            self.game_over = True
+        else:
+            raise ValueError("unknown spectator op %d" % op)
+
+        self.pos = pos
+        return op
+
+    # Puts the active piece's block on the squares it locked on (y * 10 + x)
+    def _lock_piece(self, squares):
+        for square in squares:
+            self.block_matrix[square % 10][square // 10] = self.current_piece + 1
+
+    # Removes the rows in the mask and moves everything above them down
+    def _clear_rows(self, mask):
+        for column in self.block_matrix:
+            kept = [column[y] for y in range(20) if not mask >> y & 1]
+            column[:] = [0] * (20 - len(kept)) + kept
+
+# Non-blocking reader for a stream written to a file or named pipe
+class StreamSource:
+    def __init__(self, file_path):
+        self.fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_NONBLOCK", 0))
+
+    # Returns whatever has been written since the last read (possibly nothing)
+    def read(self):
+        try:
+            return os.read(self.fd, 65536)
+        except BlockingIOError:
+            return b""
+
+    def close(self):
+        os.close(self.fd)
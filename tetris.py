@@ -5,9 +5,26 @@
 
 import pygame
 import random
+import hashlib
+import zipfile
+import signal
 from pygame.locals import *
 from time import *
-from os import path
+from os import path, environ
+import spectate
+import gridview
+import profiler
+import eventlog
+import palette
+import iothread
+import attract
+import allocs
+import gcsched
+import hint
+import leaderboard
+import livestate
+from clonetris.pieces import tetrominoes, piece_cells
+from clonetris import features, garbage, pacer, randomizer, replay, rules, snapshot, sprint
 
 ############# GENERAL FUNCTIONS ###############
 
@@ -21,78 +38,140 @@ def initialize_surface():
 # Runs once per Frame at 60fps
 def update():
     global game_state
+    global screen_drawn
+    
+    # The static screens (splash, menu, score) are only drawn again after
+    # input (looked for before it's taken off the queue), see IDLE MODE
+    had_input = pygame.event.peek()
     
     # Splash Screen
     if game_state == 0:
         process_inputs_splash()
-        draw_splash()
+        if static_screen_stale(had_input):
+            draw_splash()
+            screen_drawn = 0
+        if game_state == 0 and demo_archive:
+            count_splash_idle()
     
     # Main Menu
     if game_state == 1:
         process_inputs_menu()
-        draw_menu()
+        if static_screen_stale(had_input):
+            draw_menu()
+            screen_drawn = 1
     
     # Main Game
     if game_state == 2:
         process_inputs_game()
-        modify_piece_matrix()
-        auto_shift()
-        draw_game()
-        
-        # Delay at the start of the game
-        global start_delay
-    
-        if (start_delay <= 0):
-            piece_fall()
-        else:
-            start_delay -= 1
+        if is_rewinding:
+            rewind_frame()
+        elif piece_in_play: # (a hard drop can end the game)
+            # (a hint that just came in is drawn with the rest of the frame)
+            if hint_worker:
+                hint_worker.poll()
+            run_game_frame()
+            end_game_frame()
     
     # Score Screen
     if game_state == 3:
         process_inputs_score()
-        draw_score_screen()
-    
-    # Limits the game to 60fps
-    clock.tick(60)
-
-# Returns the fall speed for a given level
-def get_level_speed(level):
-    global fall_speeds
+        if static_screen_stale(had_input):
+            draw_score_screen()
+            screen_drawn = 3
+    
+    # Spectating a broadcast game
+    if game_state == 4:
+        process_inputs_spectate()
+        update_spectator()
+        draw_game()
     
-    if level >= 29:
-        return level_speeds[29]
-    else:
-        return level_speeds[level]
-
-# Returns the amount of start lines for a given level
-def get_start_lines():
-    global start_lines
-    global level
-     
-    if level >= 29:
-        return start_lines[29]
+    # Watching many broadcast games at once
+    if game_state == 6:
+        process_inputs_spectate()
+        if game_state == 6:
+            wall.update()
+            wall.draw()
+            pygame.display.update()
+    
+    # Watching a replay
+    if game_state == 5:
+        process_inputs_replay()
+        if game_state == 5:
+            if replay_paused:
+                draw_game()
+            else:
+                step_replay()
+    
+    # Attract mode demo
+    if game_state == 7:
+        process_inputs_demo()
+        if game_state == 7:
+            step_demo()
+    
+    if show_pacer_overlay:
+        draw_pacer_overlay()
+    if allocation_tracker.active:
+        draw_allocation_overlay()
+        allocation_tracker.end_frame(game_state)
+    
+    if live_state:
+        publish_live_state()
+    
+    # Limits the game to the NES frame rate (static screens wait for input
+    # instead once they're on the display)
+    if game_state not in IDLE_STATES:
+        screen_drawn = None
+    if screen_drawn == game_state and is_idle():
+        wait_idle()
     else:
-        return start_lines[level]
+        frame_pacer.tick()
+    if pacer_log_interval and pygame.time.get_ticks() >= next_pacer_log:
+        log_frame_pacing()
 
 # Plays a specific sound
 def play_sound(sound):
     global sound_dictionary
     
-    if sfx_enabled:
+    # (demos play silently)
+    if sfx_enabled and not headless and game_state != 7:
         pygame.mixer.Sound.play(sound_dictionary[sound])
 
 # plays specific music
 def play_music(music):
-    if music_enabled:
+    if music_enabled and not headless:
         pygame.mixer.music.stop()
         
         if music != "stop":
             pygame.mixer.music.load(music)
             pygame.mixer.music.play(-1)
+
+# Pauses the game for a number of milliseconds (skipped while
+# fast-forwarding through a replay)
+def wait(ms):
+    if not headless:
+        pygame.time.delay(ms)
+
+# Pauses the game for a number of frames (the lock and line clear delays).
+# The rules count them into delay_frames, so the game's time in frames is
+# exact however long the pause really took.
+def wait_frames(frames):
+    if not headless:
+        for frame in range(frames):
+            frame_pacer.tick()
             
-# Creates a text object
+# Creates a text object (text that was drawn recently comes out of
+# text_cache instead of being rendered again)
 def create_text_object(text, color):
-    renderedText = font.render(str(text), True, color)
+    global text_renders
+    
+    key = (str(text), color, font)
+    renderedText = text_cache.get(key)
+    if renderedText is None:
+        if len(text_cache) >= TEXT_CACHE_SIZE:
+            del text_cache[next(iter(text_cache))] # drops the oldest
+        renderedText = font.render(key[0], True, color)
+        text_cache[key] = renderedText
+        text_renders += 1
     return renderedText, renderedText.get_rect()
 
 # Displays a text object center-aligned
@@ -101,30 +180,32 @@ def display_text_centered(text, color, pos):
     textRect.center = pos
     windowSurface.blit(textSurface, textRect)
     
+# Switches the text font (each size is only loaded once, see gridview.py)
 def set_font_size(size):
     global font
-    font = pygame.font.Font("textures/8_bit_fortress.ttf", size)
+    font = gridview.get_font(size)
     
 def update_high_score():
-    global score
     global high_score
     global is_new_high_score
     
-    if score > high_score:
-        high_score = score
+    if game.score > high_score:
+        high_score = game.score
         is_new_high_score = True
         play_sound("tetris")
         save_high_score()
         return True
     return False
 
-# Saves the high schore to a file
+# Saves the high schore to a file (in the background, see iothread.py).
+# It's only saved once a game is over, after game_end() synced the rest,
+# so it's synced right away too.
 def save_high_score():
     global high_score
 
     dir = path.dirname(__file__) # defines a file directory
-    with open(path.join(dir, "saved/highscore.txt"), "w") as file: # opens file for writing
-        file.write(str(high_score)) # writes the high score to the file
+    disk_writer.write_file(path.join(dir, "saved/highscore.txt"), str(high_score).encode())
+    disk_writer.flush()
     
 def load_high_score():
     global high_score
@@ -147,6 +228,7 @@ def draw_splash():
     pygame.display.update()
 
 def process_inputs_splash():
+    global running
     global game_state
     
     # Checks for all specific events
@@ -155,6 +237,10 @@ def process_inputs_splash():
         # Quits if this event happens
         if event.type == QUIT:
             running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
             
         ### INPUTS FOR KEYBOARD ###
         if event.type == pygame.KEYDOWN:
@@ -200,11 +286,24 @@ def draw_menu():
     set_font_size(64)
     display_text_centered(high_score, (255, 255, 255), (576, 600))
     
+    # Game type (B changes the game type, H changes the garbage height)
+    if game_type == "B":
+        set_font_size(32)
+        display_text_centered("B-TYPE  HEIGHT %d" % garbage_height, (255, 255, 255), (576, 720))
+    elif game_type == "SPRINT":
+        set_font_size(32)
+        record = sprint_records.get(get_menu_level())
+        if record:
+            display_text_centered("40 LINES  BEST " + sprint.format_time(record.time()), (255, 255, 255), (576, 720))
+        else:
+            display_text_centered("40 LINES", (255, 255, 255), (576, 720))
+    
     # Updates the display
     pygame.display.update()
 
 # Processes inputs for the main menu
 def process_inputs_menu():
+    global running
     global isPushingUp
     global isPushingDown
     global isPushingLeft
@@ -216,6 +315,10 @@ def process_inputs_menu():
         # Quits if this event happens
         if event.type == QUIT:
             running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
             
         ### INPUTS FOR KEYBOARD ###
         if event.type == pygame.KEYDOWN:
@@ -229,6 +332,10 @@ def process_inputs_menu():
                 navigate_menu(1, 0) # move right
             if event.key == pygame.K_RETURN:
                 select_ui() # select ui element
+            if event.key == pygame.K_b:
+                toggle_game_type()
+            if event.key == pygame.K_h:
+                change_garbage_height()
         
         ### INPUTS FOR CONTROLLER ###
         if event.type == pygame.JOYHATMOTION:
@@ -255,10 +362,15 @@ def process_inputs_menu():
                 isPushingLeft = False
                 isPushingRight = False
         
-        # A button to select UI
+        # A button to select UI, B button changes the game type, X button
+        # changes the garbage height
         if event.type == pygame.JOYBUTTONDOWN:
             if event.button == 0:
                 select_ui()
+            if event.button == 1:
+                toggle_game_type()
+            if event.button == 2:
+                change_garbage_height()
 
 # Determines menu position
 # h - horizontal, v - vertical
@@ -314,7 +426,7 @@ def select_ui():
     
     # Start game (levels 0-4 + added levels)
     if menu_position >= 0 and menu_position <= 4:
-        start_game(menu_position + added_levels)
+        start_game(get_menu_level())
         play_sound("level_up")
     # Add levels
     elif menu_position == 5:
@@ -330,9 +442,17 @@ def select_ui():
         play_sound("piece_rotate")
     # Start game (levels 5-9 + added levels)
     else:
-        start_game(menu_position - 1 + added_levels)
+        start_game(get_menu_level())
         play_sound("level_up")
 
+# Start level of the selected menu position (None if it isn't a level)
+def get_menu_level():
+    if menu_position >= 0 and menu_position <= 4:
+        return menu_position + added_levels
+    if menu_position >= 6 and menu_position <= 10:
+        return menu_position - 1 + added_levels
+    return None
+
 # Toggles through different amounts of added levels
 def add_levels():
     global added_levels
@@ -342,68 +462,85 @@ def add_levels():
     else:
         added_levels += 10
 
-# Resets all game variables to defaults and starts game
-def start_game(start_level):
-    global game_state
-    global level
-    global lines_to_next_level
+# Switches between A-Type, B-Type and sprint games
+def toggle_game_type():
+    global game_type
     
-    reset_all_game_variables()
-    
-    # sets starting level and lines
-    level = start_level
-    lines_to_next_level = get_start_lines()
+    if game_type in rules.GAME_TYPES:
+        game_type = rules.GAME_TYPES[(rules.GAME_TYPES.index(game_type) + 1) % len(rules.GAME_TYPES)]
+    else:
+        game_type = "A"
+    play_sound("piece_rotate")
+
+# Cycles through the B-Type garbage heights
+def change_garbage_height():
+    global garbage_height
     
-    # starts the game scene
-    game_state = 2
-    play_music("audio/music.wav")
+    if game_type == "B":
+        garbage_height = (garbage_height + 1) % len(garbage.GARBAGE_HEIGHTS)
+        play_sound("piece_rotate")
 
-# Resets all game variables to their defaults
-def reset_all_game_variables():
-    global level
-    global score
-    global lines
-    global lines_to_next_level
-    global current_rotation
-    global current_piece
-    global next_piece
-    global das
-    global fall_timer
-    global center
-    global start_delay
+# Resets all game variables to defaults and starts game
+def start_game(start_level):
+    global game_state
+    global sprint_result
+    global game_start_level
     global is_new_high_score
+    global piece_in_play
     global isPushingUp
     global isPushingDown
     global isPushingLeft
     global isPushingRight
     
-    # Default values
-    level = 0
-    score = 0
-    lines = 0
-    lines_to_next_level = 0
-    current_rotation = 3
-    current_piece = get_next_piece()
-    next_piece = get_next_piece()
-    clear_block_matrix()
-    clear_piece_matrix()
-    das = 0
-    fall_timer = 0
-    center = [5, 0]
-    start_delay = 90
+    # sets starting level and lines, and B-Type games start with garbage
+    # (from the same seed as the pieces)
+    game.start(start_level, get_game_seed(), game_type, garbage_height)
+    game_start_level = start_level
+    board_features.load(game.block_matrix)
+    piece_in_play = True
     is_new_high_score = False
+    sprint_result = None
+    
+    # (the menu's held directions start over too)
     isPushingUp = False
     isPushingDown = False
     isPushingLeft = False
     isPushingRight = False
+    
+    # starts the game scene (collecting garbage only in its pauses)
+    game_state = 2
+    gc_scheduler.start_play(game.level)
+    request_hint()
+    play_music("audio/music.wav")
+    start_recording(start_level)
+    start_event_log(start_level)
+    if rewind_buffer:
+        rewind_buffer.clear()
+    broadcast_keyframe()
 
 ############ MAIN GAME FUNCTIONS ###############
 
+# Runs the game logic for one frame (after the inputs have been applied).
+# The rules draw it on the way, see GameEvents.frame().
+def run_game_frame():
+    game.run_frame()
+
+# Records a keyframe every few pieces once a game frame is done, and
+# sends this frame's changes to anyone watching
+def end_game_frame():
+    if rewind_buffer:
+        rewind_buffer.push(take_snapshot())
+    
+    if replay_writer and game.piece_count >= next_keyframe_piece:
+        record_keyframe()
+    
+    if broadcaster:
+        broadcaster.end_frame()
+
 # Responsible for drawing the graphics of the game screen
-def draw_game():    
-    global score
-    global lines
-    global level
+def draw_game():
+    if headless:
+        return
     
     # Background
     windowSurface.fill((0, 0, 0))
@@ -411,9 +548,15 @@ def draw_game():
     
     # Draws Score, Lines, and Level Text to the Screen
     set_font_size(32)
-    display_text_centered(score, (255, 255, 255), (228, 180))
-    display_text_centered(lines, (255, 255, 255), (228, 436))
-    display_text_centered(level, (255, 255, 255), (932, 436))
+    if game.is_sprint:
+        draw_sprint_time()
+    else:
+        display_text_centered(game.score, (255, 255, 255), (228, 180))
+    if game.is_b_type:
+        display_text_centered(max(0, garbage.B_TYPE_LINES - game.lines), (255, 255, 255), (228, 436)) # lines left
+    else:
+        display_text_centered(game.lines, (255, 255, 255), (228, 436))
+    display_text_centered(game.level, (255, 255, 255), (932, 436))
     
     # Grid and next piece
     drawGrid()
@@ -424,14 +567,7 @@ def draw_game():
 
 # Processes inputs for the game
 def process_inputs_game():
-    global fall_timer
-    global isPushingDown
-    global isPushingRight
-    global isPushingLeft
-    global start_delay
-    global center
-    global das
-    global level
+    global running
     
     # Checks for all specific events
     for event in pygame.event.get():
@@ -440,332 +576,196 @@ def process_inputs_game():
         if event.type == QUIT:
             running = False
         
-        ### INPUTS FOR KEYBOARD ###
-        if event.type == pygame.KEYDOWN:        
-            # Right movement
-            if (event.key == pygame.K_RIGHT or event.key == pygame.K_d):
-                isPushingRight = True
-                isPushingLeft = False
-                
-                # to stop the piece from moving right and down at the same time
-                isPushingDown = False
-                
-                # This check is here to simulate the ability
-                # for a direction key to not reset das
-                # during a line-clear or entry delay
-                if center[1] != 0 or fall_timer != get_level_speed(level):
-                    das = -10
-                    move_right()
-            # Left movement
-            if (event.key == pygame.K_LEFT or event.key == pygame.K_a):
-                isPushingLeft = True
-                isPushingRight = False
-                
-                # to stop the piece from moving left and down at the same time
-                isPushingDown = False
-                
-                if center[1] != 0 or fall_timer != get_level_speed(level):
-                    das = -10
-                    move_left()
-                
-            isPushingDown = False
-            # Down    This is here to prevent the piece from moving down and to the side at the same time since this behaviour is impossible in the original game
-            if (event.key == pygame.K_DOWN or event.key == pygame.K_s) and not (isPushingLeft or isPushingRight): # <<<V
-                isPushingDown = True
-                if level < 29:
-                    fall_timer = 2
-                start_delay = 0 # skips start delay if down pressed
-            
-            # Up (used as a rotation key)
-            if event.key == pygame.K_UP or event.key == pygame.K_w:
-                rotate_right()
-            
-            # Rotation
-            if event.key == pygame.K_x or event.key == pygame.K_SLASH:
-                rotate_right()
-            if event.key == pygame.K_z or event.key == pygame.K_PERIOD:
-                rotate_left()
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
         
-        # Resets fall speed to default
-        if event.type == pygame.KEYUP:
-            if (event.key == pygame.K_DOWN or event.key == pygame.K_s) and isPushingDown == True:
-                isPushingDown = False
-                fall_timer = get_level_speed(level)
-                
-            # Resets left and right movement when released
-            if (event.key == pygame.K_RIGHT or event.key == pygame.K_d):
-                isPushingRight = False
-            if (event.key == pygame.K_LEFT or event.key == pygame.K_a):
-                isPushingLeft = False
-                
-        ### INPUTS FOR CONTROLLER ###
-        if event.type == pygame.JOYHATMOTION:
-            # Right movement
-            if event.value[0] == 1 and isPushingRight == False:
-                isPushingRight = True
-                
-                # to stop the piece from moving right and down at the same time
-                isPushingDown = False
-  
-                if center[1] != 0 or fall_timer != get_level_speed(level):
-                    das = -10
-                    move_right()
-            # Left movement
-            if event.value[0] == -1 and isPushingLeft == False:
-                isPushingLeft = True
-                
-                # to stop the piece from moving left and down at the same time
-                isPushingDown = False
-                
-                if center[1] != 0 or fall_timer != get_level_speed(level):
-                    das = -10
-                    move_left()
-            
-            # Down movement  Prevents diagonal inputs from doing two actions at once V
-            if event.value[1] == -1 and event.value[0] == 0 and isPushingDown == False:
-                isPushingDown = True
-                if level < 29:
-                    fall_timer = 2
-                start_delay = 0
-            if event.value[1] == 0 and isPushingDown == True:
-                isPushingDown = False
-                fall_timer = get_level_speed(level)
-                
-            # reset left and right movement if the joyhat is in the
-            # neutral position
-            if event.value[0] == 0:
-                isPushingLeft = False
-                isPushingRight = False
-          
-        # Rotation
-        if event.type == pygame.JOYBUTTONDOWN:
-            if event.button == 1: # B button
-                rotate_right()
-            if event.button == 0: # A button
-                rotate_left()
-
-# Draws the block matrix contents on screen
+        # Rewinding (only in practice mode)
+        if rewind_buffer:
+            if (event.type == pygame.KEYDOWN or event.type == pygame.KEYUP) and event.key == pygame.K_BACKSPACE:
+                set_rewinding(event.type == pygame.KEYDOWN)
+                continue
+            if (event.type == pygame.JOYBUTTONDOWN or event.type == pygame.JOYBUTTONUP) and event.button == 4:
+                set_rewinding(event.type == pygame.JOYBUTTONDOWN)
+                continue
+        
+        # Turns the event into an input code (see replay.py) so that the
+        # same inputs can be recorded and played back later
+        code = get_input_code(event)
+        if code is not None:
+            if replay_writer:
+                replay_writer.input(game.game_frame, code)
+            apply_game_input(code)
+
+# Returns the input code for an event (or None if the game ignores it)
+def get_input_code(event):
+    
+    ### INPUTS FOR KEYBOARD ###
+    if event.type == pygame.KEYDOWN:
+        if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
+            return replay.KEY_RIGHT
+        if event.key == pygame.K_LEFT or event.key == pygame.K_a:
+            return replay.KEY_LEFT
+        if event.key == pygame.K_DOWN or event.key == pygame.K_s:
+            return replay.KEY_DOWN
+        if event.key in (pygame.K_UP, pygame.K_w, pygame.K_x, pygame.K_SLASH):
+            return replay.KEY_ROTATE_RIGHT
+        if event.key == pygame.K_z or event.key == pygame.K_PERIOD:
+            return replay.KEY_ROTATE_LEFT
+        if event.key == pygame.K_SPACE and hard_drop_enabled:
+            return replay.KEY_HARD_DROP
+        return replay.KEY_OTHER
+    
+    if event.type == pygame.KEYUP:
+        if event.key == pygame.K_DOWN or event.key == pygame.K_s:
+            return replay.KEY_RELEASE_DOWN
+        if event.key == pygame.K_RIGHT or event.key == pygame.K_d:
+            return replay.KEY_RELEASE_RIGHT
+        if event.key == pygame.K_LEFT or event.key == pygame.K_a:
+            return replay.KEY_RELEASE_LEFT
+    
+    ### INPUTS FOR CONTROLLER ###
+    if event.type == pygame.JOYHATMOTION:
+        return replay.hat_code(event.value)
+    
+    if event.type == pygame.JOYBUTTONDOWN:
+        if event.button == 1: # B button
+            return replay.BUTTON_ROTATE_RIGHT
+        if event.button == 0: # A button
+            return replay.BUTTON_ROTATE_LEFT
+        if event.button == 3 and hard_drop_enabled: # Y button
+            return replay.KEY_HARD_DROP
+    
+    return None
+
+# Applies an input code to the game (recorded games play hard drops back
+# even if they're turned off, but there are none while rewinding)
+def apply_game_input(code):
+    if code == replay.KEY_HARD_DROP and is_rewinding:
+        return
+    game.apply_input(code)
+
+# Draws the board and the piece on screen
 def drawGrid():
-    global block_matrix
-    global piece_matrix
-    
-    # Loops through each block in both the block and piece matrices and draws the specified
-    # block at each location
-    for x in range(len(block_matrix)):
-        for y in range(len(block_matrix[x])):
-            if block_matrix[x][y] != 0:
-                windowSurface.blit(blocks[block_matrix[x][y] - 1], (416 + (32 * x), 112 + (32 * y)))
-            if piece_matrix[x][y] != 0:
-                windowSurface.blit(blocks[piece_matrix[x][y] - 1], (416 + (32 * x), 112 + (32 * y)))
-
-# Deals with positioning the piece in the piece matrix
-def modify_piece_matrix():
-    global tetrominoes
-    global piece_matrix
-    global current_piece
-    global center
-    global current_rotation
-    
-    # Modifies the values of the piece matrix to add the piece into it around the center point
-    for i in range(6):
-        for j in range(6):
-            if (center[0] + i - 3) >= 0 and (center[1] + j - 3) >= 0 and (center[0] + i - 3) < 10 and (center[1] + j - 3) < 20:
-                piece_matrix[center[0] + i - 3][center[1] + j - 3] = tetrominoes[current_piece][current_rotation][i][j]
-    
-# Determines if the current piece's position is within the allowable playspace
-def check_valid_position():
-    global center
-    global tetrominoes
-    global block_matrix
-    global current_piece
-    global current_rotation
-    
-    for i in range(6):
-        for j in range(6):
-            if tetrominoes[current_piece][current_rotation][i][j] != 0:
-                # Checks if any part of the piece is outside the grid (except for the top which is intended
-                # to allow for play at the top of the screen)
-                if (center[0] + i - 3) < 0 or (center[0] + i - 3) >= 10 or (center[1] + j - 3) >= 20:
-                    return False
-                # Checks if any part of the piece is colliding with the block grid
-                if not (center[1] + j - 3) < 0:
-                    if block_matrix[center[0] + i - 3][center[1] + j - 3] != 0:
-                        return False
-    return True
-
-# Controls how fast a piece falls depending on the level and if
-# the down key is pressed
-def piece_fall():
-    global fall_timer
-    global isPushingDown
-    global push_down_pts
-    global level_speeds
-    global level
-      
-    if fall_timer > 1:
-        fall_timer -= 1
-    else:
-        if isPushingDown:
-            if get_level_speed(level) != 1:
-                fall_timer = 2
-            push_down_pts += 1
-            push_down_pts = push_down_pts % 16 # to emulate a bug in the original game
-        else:
-            fall_timer = get_level_speed(level)
-            push_down_pts = 0
-            
-        drop_piece()
+    # Collects a blit for each block of the board and the drawn piece and
+    # draws them all at once from this level's block atlas
+    atlas = block_atlas.get(game.level)
+    grid_blits = []
+    gridview.atlas_grid_blits(game.block_matrix, atlas, block_atlas.rects, 416, 112, 32, grid_blits)
+    if ghost_tile and piece_in_play and game_state in (2, 5, 7):
+        add_ghost_blits(grid_blits)
+    gridview.atlas_cell_blits(game.drawn, atlas, block_atlas.rects, 416, 112, 32, grid_blits)
+    windowSurface.blits(grid_blits, False)
+    if hint_worker and hint_worker.squares and game_state == 2:
+        draw_hint()
+
+# Returns the seed for a new game: CLONETRIS_SEED gives every game the same
+# pieces (e.g. for competitive rooms), otherwise every game is different
+def get_game_seed():
+    if environ.get("CLONETRIS_SEED"):
+        return int(environ["CLONETRIS_SEED"], 0)
+    return random.getrandbits(16)
 
-# Drops the piece by 1 unit
-def drop_piece():
-    global center
-    global isPushingDown
-
-    center[1] += 1
-    
-    # If it collides with other blocks or the bottom,
-    # Lock the piece to the grid
-    if not check_valid_position():
-        center[1] -= 1
-        isPushingDown = False
-        lock_piece()
-
-# Auto-shifts the piece left or right if a direction
-# key is held for long enough (long delay at first,
-# short delay afterward
-def auto_shift():
-    global das
-    global isPushingLeft
-    global isPushingRight
+# Displays the next piece in the next box
+def display_next_piece():
+    atlas = block_atlas.get(game.level)
+    for x in range(6):
+        for y in range(6):
+            if (tetrominoes[game.next_piece][3][x][y]) != 0:
+                windowSurface.blit(atlas, (816 + (32 * x), 80 + (32 * y)), block_atlas.rects[tetrominoes[game.next_piece][3][x][y] - 1])
+
+# What the game does as the rules play (see rules.GameEvents): sounds,
+# the lock and line clear delays, spectator streams, event logs and hints
+class GameEvents(rules.GameEvents):
+    # Draws the frame (before the piece falls)
+    def frame(self):
+        draw_game()
     
-    if isPushingLeft:
-        das += 1
-        if das >= 6:
-            das = 0
-            move_left()
-    if isPushingRight:
-        das += 1
-        if das >= 6:
-            das = 0
-            move_right()
-
-# Moves piece left
-def move_left():
-    global das
-    
-    center[0] -= 1
-    if not check_valid_position():
-        center[0] += 1
-        das = 6 # allows for piece tucking and "wall charges"
-    else:
+    def moved(self, direction):
         play_sound("piece_move")
-
-# Moves piece right
-def move_right():
-    global das
+        broadcast(spectate.OP_RIGHT if direction > 0 else spectate.OP_LEFT)
     
-    center[0] += 1
-    if not check_valid_position():
-        center[0] -= 1
-        das = 6 # allows for piece tucking and "wall charges"
-    else:
-        play_sound("piece_move")
-
-# Rotates current piece left
-def rotate_left():
-    global current_rotation
+    def rotated(self, direction):
+        play_sound("piece_rotate")
+        broadcast(spectate.OP_ROTATE_RIGHT if direction > 0 else spectate.OP_ROTATE_LEFT)
     
-    if (current_rotation < 3):
-        current_rotation += 1
-        if not check_valid_position():
-            current_rotation -= 1
-        else:
-            play_sound("piece_rotate")
-    else:
-        current_rotation = 0
-        if not check_valid_position():
-            current_rotation = 3
-        else:
-            play_sound("piece_rotate") 
-     
-# Rotates current piece right
-def rotate_right():
-    global current_rotation
-    
-    if (current_rotation > 0):
-        current_rotation -= 1
-        if not check_valid_position():
-            current_rotation += 1
-        else:
-            play_sound("piece_rotate")
-    else:
-        current_rotation = 3
-        if not check_valid_position():
-            current_rotation = 0
-        else:
-            play_sound("piece_rotate")
-
-# Returns a random number corrosponding to a specific piece
-def get_next_piece():
-    return random.randint(0, 6)
-
-# Displays the next piece in the next box
-def display_next_piece():
-    global next_piece
+    def dropped(self, rows):
+        for i in range(rows):
+            broadcast(spectate.OP_DROP)
+    
+    # (the piece locks where it was drawn, and an auto-shift in the same
+    # frame can have moved its center a column since, so the position
+    # logged is the one the locked squares were drawn around)
+    def locked(self, cells):
+        global piece_in_play
         
-    for x in range(6):
-        for y in range(6):
-            if (tetrominoes[next_piece][3][x][y]) != 0:
-                windowSurface.blit(blocks[tetrominoes[next_piece][3][x][y] - 1], (816 + (32 * x), 80 + (32 * y)))
-
-# Locks the piece to the grid
-def lock_piece():
-    global block_matrix
-    global piece_matrix
-    global next_piece
-    global current_piece
-    global current_rotation
-    global center
-    
-    # Transfers the squares from the piece matrix
-    # To the block matrix
-    for x in range(len(block_matrix)):
-        for y in range(len(block_matrix[x])):
-            if piece_matrix[x][y] != 0:
-                block_matrix[x][y] = piece_matrix[x][y]
-    start_next_piece()
-
-# Prepares the next piece
-def start_next_piece():
-    global current_piece
-    global next_piece
-    global current_rotation
-    global center
-    
-    clear_piece_matrix()
-       
-    if not clear_lines():
+        piece_in_play = False
+        board_features.add_cells(cells)
+        if event_log:
+            x, y = game.center
+            squares = set(cells)
+            offsets = piece_cells[game.current_piece][game.current_rotation]
+            for shift in (0, -1, 1):
+                if all((x + shift + dx, y + dy) in squares for dx, dy in offsets if y + dy >= 0):
+                    x += shift
+                    break
+            event_log.lock(game.game_frame, game.current_piece, game.current_rotation, x, y)
+        if broadcaster:
+            broadcaster.encoder.lock(cells)
+    
+    def lock_delay(self):
         draw_game()
-        pygame.time.delay(217) # 13 frames equivalent delay
+        gc_scheduler.collect_pause()
+        wait_frames(rules.LOCK_DELAY)
         play_sound("piece_lock")
     
-    current_piece = next_piece
-    next_piece = get_next_piece()
-    center = [5, 0]
-    current_rotation = 3
-    calculate_pushdown_points()
-    control_music()
-    modify_piece_matrix()
-    draw_game()
+    # Plays the line clear sound and animation
+    def clearing(self, rows):
+        if len(rows) == 4:
+            play_sound("tetris")
+        else:
+            play_sound("line_clear")
+        line_clear_animation(rows)
+        if broadcaster:
+            broadcaster.encoder.clear(rows)
+    
+    def level_up(self):
+        gc_scheduler.set_level(game.level)
+        if event_log:
+            event_log.level_up(game.game_frame, game.level)
+        
+        # Audio
+        if rules.get_level_speed(game.level - 1) != rules.get_level_speed(game.level):
+            play_sound("speed_up")
+        else:
+            play_sound("level_up")
+    
+    def cleared(self, rows, points):
+        board_features.clear_rows(rows)
+        if event_log:
+            event_log.clear(game.game_frame, len(rows), points)
+    
+    def spawned(self, push_down_pts):
+        global piece_in_play
+        
+        if event_log:
+            event_log.spawn(game.game_frame, game.current_piece)
+            if push_down_pts > 0:
+                event_log.push_down(game.game_frame, push_down_pts)
+        piece_in_play = True
+        broadcast_piece()
+        control_music()
+        request_hint()
+        draw_game()
     
-    # Checks for game over condition (if the block collides with
-    # any block at the top of the board)
-    if not check_valid_position():
+    # (a finished sprint's times are saved first)
+    def ended(self):
+        if game.is_sprint and game.lines >= sprint.SPRINT_LINES:
+            finish_sprint()
         game_end()
 
 # Determines when to play the fast music versus the normal music
 def control_music():
-    global block_matrix
     global is_fast_music
     
     has_changed_value = False
@@ -774,7 +774,7 @@ def control_music():
     if is_fast_music == False:
         for x in range(6):
             for y in range(6):
-                if block_matrix[x+2][y] != 0:
+                if game.block_matrix[x+2][y] != 0:
                     is_fast_music = True
                     has_changed_value = True
                     break
@@ -783,7 +783,7 @@ def control_music():
         has_changed_value = True
         for x in range(6):
             for y in range(6):
-                if block_matrix[x+2][y] != 0:
+                if game.block_matrix[x+2][y] != 0:
                     is_fast_music = True
                     has_changed_value = False
     
@@ -793,172 +793,87 @@ def control_music():
         else:
             play_music("audio/music.wav")
     
-# Sets all values in the piece matrix to 0
-def clear_piece_matrix():
-    global piece_matrix
-    
-    for x in range(len(piece_matrix)):
-        for y in range(len(piece_matrix[x])):
-            piece_matrix[x][y] = 0
-
 # Sets all values in the block matrix to 0
 def clear_block_matrix():
-    global block_matrix
-    
-    for x in range(len(block_matrix)):
-        for y in range(len(block_matrix[x])):
-            block_matrix[x][y] = 0
-
-# Clears any horizontal lines that are filled up and moves
-# any remaining lines down the grid
-def clear_lines():
-    global block_matrix
-    global lines
-    
-    # Matrix that contains a list of rows (compared to a list of columns)
-    converted_matrix = [[0 for i in range(10)] for j in range(20)]
-    
-    # Will contain the specific lines that need to be cleared
-    lines_to_clear = []
-    
-    # Converts the [columns][rows] block matrix to the
-    # [rows][columns] converted matrix (to make the line
-    # clearing algorithm easier
-    for x in range(len(block_matrix)):
-        for y in range(len(block_matrix[x])):
-            converted_matrix[y][x] = block_matrix[x][y]
-    
-    # Checks all rows to see if any of them are filled and places
-    # the indices of the filled rows in the lines_to_clear list
-    for i in range(len(converted_matrix)):
-        if 0 not in converted_matrix[i]:
-            lines_to_clear.append(i)  
-    
-    # Plays line clear sound
-    if len(lines_to_clear) == 4:
-        play_sound("tetris")
-    elif len(lines_to_clear) > 0:
-        play_sound("line_clear")
-         
-    # Plays a line clear animation
-    if (len(lines_to_clear) > 0):
-        line_clear_animation(lines_to_clear)
-    
-    # Moves all remaining rows above each cleared line down to fill
-    # the gap using a top-down approach (note that lower numbers
-    # Represent higher blocks in the grid)
-    for i in lines_to_clear:
-        for j in range(i, 0, -1):        
-            converted_matrix[j] = converted_matrix[j-1]
-                
-    # Clears top rows if there were any pieces in the top row
-    for i in range(len(lines_to_clear)):
-        converted_matrix[i] = [0 for x in range(10)]
-    
-    # Converts the converted matrix back to the regular
-    # block matrix format
-    for x in range(len(converted_matrix)):
-        for y in range(len(converted_matrix[x])):
-            block_matrix[y][x] = converted_matrix[x][y]
-    
-    # Updates lines, level, and score accordingly
-    lines += len(lines_to_clear)
-    calculate_level(len(lines_to_clear))
-    calculate_line_score(len(lines_to_clear))
-    
-    return len(lines_to_clear) > 0
+    for column in game.block_matrix:
+        column[:] = [0] * 20
+    board_features.reset()
 
-# Line-clear animation
+# Line-clear animation (the rows are full until the rules remove them)
 def line_clear_animation(lines_to_clear):
-    global block_matrix
+    block_matrix = game.block_matrix
     
-    pygame.time.delay(167) # 10 frames equivalent
+    gc_scheduler.collect_pause()
+    wait_frames(10)
     
     for i in lines_to_clear:
         block_matrix[4][i] = 0
         block_matrix[5][i] = 0
       
     draw_game()
-    pygame.time.delay(67) # 4 frames equivalent
+    wait_frames(4)
         
     for i in lines_to_clear:
         block_matrix[3][i] = 0
         block_matrix[6][i] = 0
        
     draw_game()
-    pygame.time.delay(67) # 4 frames equivalent
+    wait_frames(4)
         
     for i in lines_to_clear:
         block_matrix[2][i] = 0
         block_matrix[7][i] = 0
     
     draw_game()
-    pygame.time.delay(67) # 4 frames equivalent
+    wait_frames(4)
         
     for i in lines_to_clear:
         block_matrix[1][i] = 0
         block_matrix[8][i] = 0
     
     draw_game()
-    pygame.time.delay(67) # 4 frames equivalent
+    wait_frames(4)
         
     for i in lines_to_clear:
         block_matrix[0][i] = 0
         block_matrix[9][i] = 0
         
     draw_game()
-    pygame.time.delay(100) # 6 frames equivalent
-    
-
-# Adds push-down points to the current score
-def calculate_pushdown_points():
-    global score
-    global push_down_pts
-    
-    score += push_down_pts
-    push_down_pts = 0
-
-# Adds line-clear points to score (higher levels
-# and high-line clear counts add more to the score
-def calculate_line_score(lines_cleared):
-    global score
-    global level
-    
-    if lines_cleared == 1:
-        score += 40 * (level + 1)
-    if lines_cleared == 2:
-        score += 120 * (level + 1)
-    if lines_cleared == 3:
-        score += 300 * (level + 1)
-    if lines_cleared == 4:
-        score += 1200 * (level + 1)
-
-# Updates the level based on the number of lines
-# cleared
-def calculate_level(lines_cleared):
-    global level
-    global level_speeds
-    global lines_to_next_level
-    
-    lines_to_next_level -= lines_cleared
-    
-    if lines_to_next_level <= 0:
-        level += 1
-        lines_to_next_level += 10
-        
-        # Audio
-        if get_level_speed(level-1) != get_level_speed(level):
-            play_sound("speed_up")
-        else:
-            play_sound("level_up")
-        
+    wait_frames(6)
+
 # Returns to the menu when the player reaches the top of the screen
 def game_end():
+    global piece_in_play
+    
+    piece_in_play = False
+    
+    # The end of a replay goes straight back to the menu, and the end of
+    # a demo back to the splash screen
+    if game_state == 5:
+        stop_replay()
+        return
+    if game_state == 7:
+        stop_demo(False)
+        return
+    
+    gc_scheduler.stop_play()
+    if hint_worker:
+        hint_worker.clear()
+    replay_hash = finish_recording()
+    finish_event_log()
+    submit_result(replay_hash)
+    # Syncs the game's saves now instead of waiting for the next batch
+    disk_writer.flush()
+    broadcast(spectate.OP_END)
+    if broadcaster:
+        broadcaster.end_frame()
     play_music("stop")
     play_sound("game_over")
     
-    # Waits 5 seconds until it gets to the menu
-    pygame.time.delay(5000)
+    # Waits 5 seconds until it gets to the menu (collecting the garbage
+    # the game left first)
+    gc_scheduler.collect_idle()
+    wait(5000)
     setup_score_screen()
 
 ############# SCORE SCREEN FUNCTIONS ##############
@@ -970,9 +885,11 @@ def setup_score_screen():
     play_music("audio/music_end.wav")
     
     clear_block_matrix()
-    clear_piece_matrix()
+    game.drawn.clear()
     
-    update_high_score()
+    # Sprints are about time, their scores aren't high scores
+    if not game.is_sprint:
+        update_high_score()
     
 def draw_score_screen():
     global is_new_high_score
@@ -981,20 +898,28 @@ def draw_score_screen():
     windowSurface.fill((0, 0, 0))
     windowSurface.blit(score_background, (0, 0))
     
-    # Draws Score and Level Text to the Screen
+    # Draws Score and Level Text to the Screen (a finished sprint's time
+    # instead of the score)
     set_font_size(64)
-    display_text_centered(score, (255, 255, 255), (312, 340))
-    display_text_centered(level, (255, 255, 255), (840, 340))
+    if sprint_result:
+        display_text_centered(sprint.format_time(game.line_frames[-1]), (255, 255, 255), (312, 340))
+    else:
+        display_text_centered(game.score, (255, 255, 255), (312, 340))
+    display_text_centered(game.level, (255, 255, 255), (840, 340))
     
     # High score text
     if (is_new_high_score):
         display_text_centered("NEW HIGH SCORE!", (255, 255, 255), (576, 560))
     
+    if sprint_result:
+        draw_sprint_splits()
+    
     # Updates the display
     pygame.display.update()
     
 
 def process_inputs_score():
+    global running
     global game_state
     
      # Checks for all specific events
@@ -1003,6 +928,10 @@ def process_inputs_score():
         # Quits if this event happens
         if event.type == QUIT:
             running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
             
         ### INPUTS FOR KEYBOARD ###
         if event.type == pygame.KEYDOWN:
@@ -1016,6 +945,617 @@ def process_inputs_score():
             play_music("stop")
             play_sound("level_up")
 
+############ SPECTATOR FUNCTIONS ###############
+
+# Sends a board change to the spectator stream (if one is running)
+def broadcast(op):
+    if broadcaster:
+        broadcaster.encoder.op(op)
+
+# Sends the newly spawned piece along with the score, and a full keyframe
+# every few pieces so that viewers joining mid-game can start from there
+def broadcast_piece():
+    if broadcaster:
+        if broadcaster.encoder.wants_keyframe():
+            broadcast_keyframe()
+        else:
+            broadcaster.encoder.stats(game.score, game.lines, game.level)
+            broadcaster.encoder.spawn(game.current_piece, game.next_piece)
+
+# Sends the whole board, piece and score
+def broadcast_keyframe():
+    if broadcaster:
+        broadcaster.encoder.keyframe(game.block_matrix, game.current_piece, game.next_piece, game.current_rotation,
+                                     game.center, game.score, game.lines, game.level)
+
+# Decodes the next frame of the watched game and copies it into the game
+# so that draw_game() can render it (the decoder writes the board straight
+# into game.block_matrix)
+def update_spectator():
+    spectator.feed(spectator_source.read())
+    if not spectator.advance():
+        return
+    
+    game.current_piece = spectator.current_piece
+    game.next_piece = spectator.next_piece
+    game.current_rotation = spectator.rotation
+    game.center = list(spectator.center)
+    game.score = spectator.score
+    game.lines = spectator.lines
+    game.level = spectator.level
+    
+    game.drawn.clear()
+    if spectator.synced and not spectator.game_over:
+        game.draw_piece()
+
+def process_inputs_spectate():
+    global running
+    global game_state
+    
+    # Checks for all specific events
+    for event in pygame.event.get():
+        
+        # Quits if this event happens
+        if event.type == QUIT:
+            running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
+        
+        # Escape or any controller button stops watching
+        if (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE) or event.type == pygame.JOYBUTTONDOWN:
+            stop_spectating()
+            return
+
+# Closes the watched stream(s) and returns to the menu
+def stop_spectating():
+    global game_state
+    global spectator
+    global spectator_source
+    global wall
+    
+    if spectator_source:
+        spectator_source.close()
+    if wall:
+        wall.close()
+    spectator = None
+    spectator_source = None
+    wall = None
+    clear_block_matrix()
+    game.drawn.clear()
+    game_state = 1
+    play_sound("level_up")
+
+############# SNAPSHOT FUNCTIONS ###############
+
+# Returns the complete game state at the start of the current frame
+def take_snapshot():
+    state = game.take_snapshot()
+    state.flags |= (isPushingUp and snapshot.FLAG_UP) | (is_fast_music and snapshot.FLAG_FAST_MUSIC)
+    return state
+
+# Puts the game back into the state stored in a snapshot
+def restore_snapshot(state):
+    global isPushingUp
+    global is_fast_music
+    global piece_in_play
+    
+    # (the same pieces are dealt out as before)
+    game.restore(state)
+    gc_scheduler.set_level(game.level)
+    isPushingUp = bool(state.flags & snapshot.FLAG_UP)
+    is_fast_music = bool(state.flags & snapshot.FLAG_FAST_MUSIC)
+    board_features.load(game.block_matrix)
+    piece_in_play = True
+
+# Starts or stops rewinding (practice mode)
+def set_rewinding(rewinding):
+    global is_rewinding
+    
+    is_rewinding = rewinding
+    
+    # Spectators need the whole board again once the game continues, and
+    # the player a hint for where the piece is now
+    if not rewinding:
+        broadcast_keyframe()
+        request_hint()
+    elif hint_worker:
+        hint_worker.clear()
+
+# Steps the game one frame back in time
+def rewind_frame():
+    state = rewind_buffer.pop()
+    if state:
+        restore_snapshot(state)
+    draw_game()
+
+############## REPLAY FUNCTIONS ################
+
+# Starts recording the game if CLONETRIS_RECORD_DIR is set (practice games
+# aren't recorded since rewinding can't be replayed)
+def start_recording(start_level):
+    global replay_writer
+    global next_keyframe_piece
+    
+    if environ.get("CLONETRIS_RECORD_DIR") and not rewind_buffer:
+        replay_writer = replay.ReplayWriter(start_level, randomizer.get_randomizer_id(game.piece_randomizer.name),
+                                            game.piece_randomizer.seed)
+        next_keyframe_piece = 0
+        record_keyframe()
+
+# Adds a keyframe of the current game state to the recording
+def record_keyframe():
+    global next_keyframe_piece
+    
+    replay_writer.keyframe(take_snapshot())
+    next_keyframe_piece = game.piece_count + replay.KEYFRAME_INTERVAL
+
+# Saves the recording once the game is over. Returns the replay's hash
+# (None if the game wasn't recorded).
+def finish_recording():
+    global replay_writer
+    
+    if replay_writer:
+        data = replay_writer.close(game.game_frame + 1)
+        replay_writer = None
+        
+        record_dir = environ["CLONETRIS_RECORD_DIR"]
+        disk_writer.write_file(path.join(record_dir, strftime("%Y-%m-%d_%H-%M-%S") + ".ctr"), data)
+        return hashlib.sha256(data).hexdigest()
+    return None
+
+# Opens a replay file and starts playing it from the beginning
+def start_replay(file_path):
+    global game_state
+    global replay_reader
+    global replay_paused
+    
+    replay_reader = replay.ReplayReader(file_path)
+    game.piece_randomizer = randomizer.RANDOMIZERS[replay_reader.randomizer](replay_reader.seed)
+    replay_paused = False
+    seek_replay_frame(0)
+    game_state = 5
+    play_music("audio/music.wav")
+
+# Stops the replay and returns to the menu
+def stop_replay():
+    global game_state
+    global replay_reader
+    global replay_inputs
+    
+    replay_inputs = None
+    replay_reader.close()
+    replay_reader = None
+    game.piece_randomizer = randomizer.make_randomizer(environ.get("CLONETRIS_RANDOMIZER", "nes"))
+    clear_block_matrix()
+    game.drawn.clear()
+    game_state = 1
+    play_music("stop")
+    play_sound("level_up")
+
+# Restores a keyframe and continues reading the inputs recorded after it
+def jump_to_keyframe(offset):
+    global replay_inputs
+    global replay_next_input
+    
+    restore_snapshot(replay_reader.read_keyframe(offset))
+    replay_inputs = replay_reader.inputs_from(offset)
+    replay_next_input = next(replay_inputs, None)
+
+# Plays one frame of the replay
+def step_replay():
+    global replay_next_input
+    
+    # Applies the inputs recorded during this frame (a hard drop can end
+    # the game, and the replay or demo with it)
+    while replay_next_input and replay_next_input[0] == game.game_frame:
+        apply_game_input(replay_next_input[1])
+        if not piece_in_play:
+            return
+        replay_next_input = next(replay_inputs, None)
+    
+    run_game_frame()
+
+# Jumps to the start of a frame by restoring the nearest keyframe before it
+# and simulating the remaining frames without drawing anything
+def seek_replay_frame(frame):
+    global headless
+    
+    frame = max(0, min(frame, replay_reader.total_frames - 1))
+    jump_to_keyframe(replay_reader.keyframe_for_frame(frame))
+    
+    headless = True
+    while game.game_frame < frame:
+        step_replay()
+    headless = False
+
+# Jumps to the moment a piece spawned (or the end of the game)
+def seek_replay_piece(piece):
+    global headless
+    
+    piece = max(0, piece)
+    jump_to_keyframe(replay_reader.keyframe_for_piece(piece))
+    
+    headless = True
+    while game.piece_count < piece and game.game_frame < replay_reader.total_frames - 1:
+        step_replay()
+    headless = False
+
+def process_inputs_replay():
+    global running
+    global replay_paused
+    
+    # Checks for all specific events
+    for event in pygame.event.get():
+        
+        # Quits if this event happens
+        if event.type == QUIT:
+            running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
+        
+        ### INPUTS FOR KEYBOARD ###
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                stop_replay()
+                return
+            if event.key == pygame.K_SPACE:
+                replay_paused = not replay_paused
+            # Previous/next piece
+            if event.key == pygame.K_LEFT:
+                seek_replay_piece(game.piece_count - 1)
+            if event.key == pygame.K_RIGHT:
+                seek_replay_piece(game.piece_count + 1)
+            # 10 seconds back/forward
+            if event.key == pygame.K_PAGEUP:
+                seek_replay_frame(game.game_frame - 600)
+            if event.key == pygame.K_PAGEDOWN:
+                seek_replay_frame(game.game_frame + 600)
+        
+        ### INPUTS FOR CONTROLLER ###
+        if event.type == pygame.JOYBUTTONDOWN:
+            stop_replay()
+            return
+
+############### DEBUG FUNCTIONS ################
+
+# Handles the debug keys, returns True if the key was one of them
+def handle_debug_key(key):
+    global show_pacer_overlay
+    
+    if key == pygame.K_F9:
+        request_profiler_toggle()
+        return True
+    if key == pygame.K_F10:
+        show_pacer_overlay = not show_pacer_overlay
+        return True
+    if key == pygame.K_F11:
+        toggle_allocation_tracker()
+        return True
+    return False
+
+# Draws the frame timing stats in the top left corner (the text is only
+# rendered again every half second)
+def draw_pacer_overlay():
+    global pacer_overlay_text
+    
+    if pacer_overlay_text is None or frame_pacer.frames % 30 == 0:
+        pacer_overlay_text = gridview.get_font(12).render(frame_pacer.summary(), True, (255, 255, 255), (0, 0, 0))
+    rect = windowSurface.blit(pacer_overlay_text, (4, 4))
+    pygame.display.update(rect)
+
+# Prints the frame timing stats every CLONETRIS_PACER_LOG seconds
+def log_frame_pacing():
+    global next_pacer_log
+    
+    print("Frame pacing: " + frame_pacer.summary())
+    print("Disk writes: " + disk_writer.summary())
+    print("Garbage collection: " + gc_scheduler.summary())
+    if leaderboard_client:
+        print("Leaderboard: " + leaderboard_client.summary())
+    if hint_worker:
+        print("Hints: " + hint_worker.summary())
+    next_pacer_log = pygame.time.get_ticks() + pacer_log_interval * 1000
+
+############# ALLOCATION FUNCTIONS #############
+
+# Starts following allocations, or stops and prints the report
+def toggle_allocation_tracker():
+    global allocation_overlay_lines
+    
+    allocation_overlay_lines = []
+    report = allocation_tracker.toggle()
+    if report:
+        print("Allocations:\n" + report)
+
+# Running totals of the allocations tracemalloc can't see (fonts are only
+# loaded once, text is rendered when it isn't cached)
+def get_allocation_counters():
+    return {"fonts": len(gridview.font_cache), "texts": text_renders}
+
+# Draws the last frame's allocations and the call sites that grew the most
+# under the frame timing stats (rendered again every half second)
+def draw_allocation_overlay():
+    global allocation_overlay_lines
+    
+    if not allocation_overlay_lines or allocation_tracker.frames % 30 == 0:
+        small_font = gridview.get_font(12)
+        allocation_overlay_lines = [small_font.render(line, True, (255, 255, 255), (0, 0, 0))
+                                    for line in [allocation_tracker.summary()] + allocation_tracker.site_lines(3)]
+    y = 24
+    for line in allocation_overlay_lines:
+        pygame.display.update(windowSurface.blit(line, (4, y)))
+        y += 16
+
+############# PROFILING FUNCTIONS ##############
+
+# Asks for the profiling session to start/stop at the end of the frame (so
+# a session always covers whole frames)
+def request_profiler_toggle():
+    global profiler_toggle_requested
+    
+    profiler_toggle_requested = True
+
+# Called from the SIGUSR1 handler (for cabinets without a keyboard)
+def handle_profiler_signal(signum, frame):
+    request_profiler_toggle()
+
+# Starts a profiling session or stops the running one and saves it
+def toggle_profiler():
+    global profiler_toggle_requested
+    
+    profiler_toggle_requested = False
+    files = game_profiler.toggle(get_profile_dir(), disk_writer.write_file)
+    if files:
+        print("Saved profile to %s and %s" % files)
+
+def get_profile_dir():
+    return environ.get("CLONETRIS_PROFILE_DIR") or path.join(path.dirname(path.abspath(__file__)), "profiles")
+
+############# EVENT LOG FUNCTIONS ##############
+
+# Starts logging the game's events if CLONETRIS_EVENT_DIR is set (practice
+# games aren't logged since rewinding would double count them)
+def start_event_log(start_level):
+    global event_log
+    
+    event_log = None
+    if environ.get("CLONETRIS_EVENT_DIR") and not rewind_buffer:
+        event_log = eventlog.EventLogWriter(start_level, randomizer.get_randomizer_id(game.piece_randomizer.name),
+                                            game.piece_randomizer.seed)
+        event_log.spawn(game.game_frame, game.current_piece)
+
+# Saves the event log once the game is over
+def finish_event_log():
+    global event_log
+    
+    if event_log:
+        event_log.game_over(game.game_frame, game.score, game.lines, game.level)
+        data = event_log.close()
+        event_log = None
+        
+        event_dir = environ["CLONETRIS_EVENT_DIR"]
+        file_name = "%s_%d%s" % (strftime("%Y-%m-%d_%H-%M-%S"), game.piece_randomizer.seed, eventlog.FILE_EXTENSION)
+        disk_writer.write_file(path.join(event_dir, file_name), data)
+
+################ HINT FUNCTIONS ################
+
+# Asks the hint worker for the best placement of the piece that just spawned
+# (the answer comes in on a later frame, see hint.py)
+def request_hint():
+    if hint_worker and game_state == 2:
+        hint_worker.request(game.block_matrix, game.current_piece, game.next_piece, rules.get_level_speed(game.level),
+                            game.das, game.fall_timer)
+
+# Outlines the squares the hint would put the piece on
+def draw_hint():
+    for x, y in hint_worker.squares:
+        pygame.draw.rect(windowSurface, HINT_COLOR, (416 + x * 32, 112 + y * 32, 32, 32), 3)
+
+################ GHOST FUNCTIONS ###############
+
+# Row the current piece lands on if dropped from where it is, only worked
+# out again when the piece has moved or turned or the board has changed
+def get_landing_row():
+    global landing_key
+    global landing_row
+    
+    key = (game.current_piece, game.current_rotation, game.center[0], game.center[1], board_features.version)
+    if key != landing_key:
+        landing_key = key
+        landing_row = board_features.drop_row(game.current_piece, game.current_rotation, game.center[0], game.center[1])
+    return landing_row
+
+# Adds a blit of the ghost tile for each square the current piece would
+# land on (none if it's already there)
+def add_ghost_blits(grid_blits):
+    row = get_landing_row()
+    if row <= game.center[1]:
+        return
+    for dx, dy in piece_cells[game.current_piece][game.current_rotation]:
+        if row + dy >= 0:
+            grid_blits.append((ghost_tile, (416 + (game.center[0] + dx) * 32, 112 + (row + dy) * 32)))
+
+############# LIVE STATE FUNCTIONS #############
+
+# Publishes this frame's state for other processes (see livestate.py). The
+# board is only packed again when the board features say it changed, except
+# while spectating, where the stream fills in the board by itself.
+def publish_live_state():
+    board_version = None if game_state in (4, 6) else board_features.version
+    live_state.publish(game_state, game.game_frame, game.piece_count, game.current_piece, game.next_piece,
+                       game.current_rotation, game.center, game.level, game.lines, game.score, game.block_matrix,
+                       board_version)
+
+############# LEADERBOARD FUNCTIONS ############
+
+# Hands the finished game's result to the leaderboard client (which
+# uploads it in the background, see leaderboard.py). Practice games don't
+# count, since rewinding makes any score possible.
+def submit_result(replay_hash):
+    if leaderboard_client and not rewind_buffer:
+        line_frames = game.line_frames
+        sprint_time = line_frames[-1] if game.is_sprint and len(line_frames) >= sprint.SPRINT_LINES else None
+        leaderboard_client.submit(leaderboard.make_result(game.score, game.level, game.lines, game_start_level, game_type,
+                                                          game.game_frame, replay_hash, sprint_time))
+
+############### SPRINT FUNCTIONS ###############
+
+# Frames since the sprint started (the end of the start delay), counting
+# the frames the lock and line clear delays stand for
+def get_sprint_frame():
+    return max(0, game.game_frame + game.delay_frames - rules.START_DELAY)
+
+# Saves a finished sprint's times (not for practice games, since rewinding
+# would make any time possible)
+def finish_sprint():
+    global sprint_result
+    
+    if game_state == 2 and not rewind_buffer:
+        sprint_result = sprint_records.add_run(game.level, game.line_frames)
+        disk_writer.write_file(get_sprint_records_path(), sprint_records.pack())
+
+def get_sprint_records_path():
+    return path.join(path.dirname(__file__), "saved/sprint.dat")
+
+# Draws the sprint time where the score goes, and below it how far ahead
+# (green) or behind (red) of the best run the last line was cleared
+def draw_sprint_time():
+    display_text_centered(sprint.format_time(get_sprint_frame()), (255, 255, 255), (228, 180))
+    
+    record = sprint_records.get(game.level)
+    cleared = len(game.line_frames)
+    if record and cleared and game.line_frames[-1] is not None:
+        delta = game.line_frames[-1] - record.line_frames[cleared - 1]
+        color = (0, 216, 0) if delta <= 0 else (216, 40, 0)
+        set_font_size(16)
+        display_text_centered(sprint.format_delta(delta), color, (228, 224))
+        set_font_size(32)
+
+# Draws the finished sprint's splits on the score screen (new best
+# splits in gold)
+def draw_sprint_splits():
+    is_best, best_splits = sprint_result
+    if is_best:
+        display_text_centered("NEW BEST TIME!", (255, 255, 255), (576, 560))
+    
+    set_font_size(24)
+    splits = sprint.split_times(game.line_frames)
+    for i in range(sprint.SPLIT_COUNT):
+        color = (252, 216, 0) if best_splits[i] else (255, 255, 255)
+        x = 576 + (i * 2 - sprint.SPLIT_COUNT + 1) * 120
+        display_text_centered("%d LINES" % ((i + 1) * sprint.SPLIT_LINES), color, (x, 660))
+        display_text_centered(sprint.format_time(splits[i]), color, (x, 700))
+
+################ IDLE FUNCTIONS ################
+
+# Whether the static screen being shown has to be drawn again: always
+# when not idle, otherwise only when it isn't on the display yet or there
+# was input that may have changed it
+def static_screen_stale(had_input):
+    return not is_idle() or had_input or screen_drawn != game_state
+
+# Whether the game can sit waiting for input instead of running frames (not
+# while an overlay that changes every frame is on)
+def is_idle():
+    return idle_enabled and not (show_pacer_overlay or allocation_tracker.active)
+
+# Sleeps until there's input, or for IDLE_TIMEOUT at most (less on the
+# splash screen when a demo is due sooner), in place of a frame. The frames
+# it stood in for count towards the demo.
+def wait_idle():
+    global splash_idle_frames
+    
+    timeout = IDLE_TIMEOUT
+    if game_state == 0 and demo_archive:
+        timeout = min(timeout, (attract_delay_frames - splash_idle_frames) * frame_pacer.period)
+    start = perf_counter()
+    event = pygame.event.wait(max(1, int(timeout * 1000)))
+    # (the screen's input function takes them off the queue again, in the
+    # order they came in)
+    if event.type != NOEVENT:
+        for event in [event] + pygame.event.get():
+            pygame.event.post(event)
+    if game_state == 0:
+        splash_idle_frames += int((perf_counter() - start) / frame_pacer.period)
+    frame_pacer.restart()
+
+############# ATTRACT MODE FUNCTIONS ##############
+
+# Counts the frames the splash screen has been up and starts a demo once
+# it's been up for CLONETRIS_ATTRACT_DELAY seconds
+def count_splash_idle():
+    global splash_idle_frames
+    
+    splash_idle_frames += 1
+    if splash_idle_frames >= attract_delay_frames:
+        start_demo()
+
+# Starts playing the next demo through the replay functions
+def start_demo():
+    global game_state
+    global demo_stream
+    global replay_inputs
+    global replay_next_input
+    global splash_idle_frames
+    
+    splash_idle_frames = 0
+    demo_stream = demo_archive.open_next()
+    if demo_stream is None:
+        return
+    game.piece_randomizer = randomizer.RANDOMIZERS[demo_stream.randomizer](demo_stream.seed)
+    restore_snapshot(demo_stream.keyframe)
+    replay_inputs = demo_stream.inputs()
+    replay_next_input = next(replay_inputs, None)
+    game_state = 7
+
+# Stops the demo and goes back to the splash screen, or to the menu if
+# someone pressed something
+def stop_demo(to_menu):
+    global game_state
+    global demo_stream
+    global replay_inputs
+    
+    replay_inputs = None
+    demo_stream.close()
+    demo_stream = None
+    game.piece_randomizer = randomizer.make_randomizer(environ.get("CLONETRIS_RANDOMIZER", "nes"))
+    clear_block_matrix()
+    game.drawn.clear()
+    if to_menu:
+        game_state = 1
+        play_sound("level_up")
+    else:
+        game_state = 0
+
+# Plays one frame of the demo (demos stop after DEMO_SECONDS)
+def step_demo():
+    if game.game_frame >= min(demo_stream.total_frames, DEMO_SECONDS * 60):
+        stop_demo(False)
+    else:
+        step_replay()
+
+# Any key or button stops the demo, like on the splash screen
+def process_inputs_demo():
+    global running
+    
+    # Checks for all specific events
+    for event in pygame.event.get():
+        
+        # Quits if this event happens
+        if event.type == QUIT:
+            running = False
+        
+        # Debug keys (F9 profiler, F10 frame timing overlay, F11 allocations)
+        if event.type == pygame.KEYDOWN and handle_debug_key(event.key):
+            continue
+        
+        if (event.type == pygame.KEYDOWN or event.type == pygame.JOYBUTTONDOWN) and game_state == 7:
+            stop_demo(True)
+
 ################# INIT PYGAME #####################
 
 # Starts Pygame
@@ -1033,9 +1573,21 @@ for i in range(pygame.joystick.get_count()):
 WINDOWWIDTH = 1152
 WINDOWHEIGHT = 864
 
-# Initializes a surface and the pygame clock
+# Initializes a surface and the frame pacer
 windowSurface = initialize_surface()
-clock = pygame.time.Clock()
+
+# Paces frames at the NES frame rate (CLONETRIS_FPS overrides it), sleeping
+# until CLONETRIS_PACER_SPIN_MS before the end of each frame and spinning
+# for the rest (lower uses less CPU, higher gives steadier frames)
+frame_pacer = pacer.FramePacer(float(environ.get("CLONETRIS_FPS", pacer.NES_FRAME_RATE)),
+                               float(environ.get("CLONETRIS_PACER_SPIN_MS", pacer.DEFAULT_SPIN * 1000)) / 1000)
+
+# F10 shows the frame timing stats and CLONETRIS_PACER_LOG=<seconds> prints
+# them every few seconds
+show_pacer_overlay = False
+pacer_overlay_text = None
+pacer_log_interval = float(environ.get("CLONETRIS_PACER_LOG", 0))
+next_pacer_log = 0
 
 ################## TEXTURES #######################
 
@@ -1091,8 +1643,16 @@ z_block = pygame.transform.scale(z_block, (32, 32))
 # Piece array
 blocks = [i_block, j_block, l_block, o_block, s_block, t_block, z_block]
 
-# Text
-font = pygame.font.Font("textures/8_bit_fortress.ttf", 32)
+# All the blocks in one surface, recolored for each level like the NES
+# (CLONETRIS_CLASSIC_COLORS=1 keeps every piece its own color instead)
+block_atlas = palette.BlockAtlas(blocks, 32, not environ.get("CLONETRIS_CLASSIC_COLORS"))
+
+# Text, and the text rendered most recently (create_text_object()) with a
+# count of the times text had to be rendered
+TEXT_CACHE_SIZE = 128
+font = gridview.get_font(32)
+text_cache = {}
+text_renders = 0
 
 ################## AUDIO/MUSIC ####################
 
@@ -1127,7 +1687,8 @@ running = True
 # Is a new high score
 is_new_high_score = False
 
-# Game State (0 = splash, 1 = menu, 2 = game, 3 = score)
+# Game State (0 = splash, 1 = menu, 2 = game, 3 = score, 4 = spectate, 5 = replay,
+# 6 = spectate many games, 7 = attract mode demo)
 game_state = 0
 
 # Menu Position
@@ -1136,12 +1697,25 @@ menu_position = 0
 # Music is fast or not
 is_fast_music = False
 
+# Skips drawing, sound and delays (used to fast-forward replays)
+headless = False
+
 # Audio settings
 music_enabled = True
 sfx_enabled = True
 
+################### DISK WRITES ###################
+
+# Everything the game saves is written by a background thread so that a
+# slow SD card never holds up a frame. CLONETRIS_FSYNC sets when writes are
+# synced to the card (never, batch or always) and CLONETRIS_IO_QUEUE how
+# many writes can wait before the game has to wait for the card.
+disk_writer = iothread.DiskWriter(environ.get("CLONETRIS_FSYNC", "batch"),
+                                  int(environ.get("CLONETRIS_IO_QUEUE", iothread.DEFAULT_QUEUE_SIZE)))
+
 ################# INPUT VARIABLES #################
 
+# The menu's held controller directions (the game's are the rules')
 isPushingUp = False
 isPushingDown = False
 isPushingLeft = False
@@ -1149,257 +1723,241 @@ isPushingRight = False
 
 ################## GAME VARIABLES #################
 
-# Look-up table for level fall speeds (0-29)
-level_speeds = [48, 43, 38, 33, 28, 23, 18, 13, 8, 6, 5, 5, 5, 4, 4, 4, 3, 3, 3,
-                2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 1]
-
-# Start lines until next level for each starting level (0-29)
-start_lines = [10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 100, 100, 100, 100, 100,
-               100, 110, 120, 130, 140, 150, 160, 170, 180, 190, 200, 200, 200,
-               200, 200]
+# The game being played, replayed or watched: the rules' state, which is
+# what gets drawn (see clonetris/rules.py). CLONETRIS_RANDOMIZER picks
+# the piece randomizer (see randomizer.py), reseeded for every game.
+game = rules.Game(environ.get("CLONETRIS_RANDOMIZER", "nes"), GameEvents())
 
-# Lines to next level
-lines_to_next_level = 0
-
-# Delayed Auto-Shift for left/right movement
-das = 0
-
-# Start delay (in frames)
-start_delay = 90
-
-# Block center (default value)
-center = [5, 0]
+# High score
+high_score = 0
+load_high_score()
 
-# Current piece
-current_piece = 0
+# Added levels
+added_levels = 0
 
-# Next piece
-next_piece = 0
+# Game type picked in the menu (one of rules.GAME_TYPES) and the B-Type
+# garbage height (0-5), CLONETRIS_GAME_TYPE and CLONETRIS_GARBAGE_HEIGHT set
+# the defaults
+game_type = environ.get("CLONETRIS_GAME_TYPE", "A").upper()
+garbage_height = int(environ.get("CLONETRIS_GARBAGE_HEIGHT", 0))
 
-# Current rotation
-current_rotation = 3
+# Stack features of the board (heights, holes, wells, ...) kept up to
+# date as pieces lock and lines clear, for bots and analytics
+board_features = features.BoardFeatures()
 
-# Score counter
-score = 0
-high_score = 0
-load_high_score()
+# Whether there's a piece falling (not between a lock and the next spawn,
+# or after the game ended)
+piece_in_play = False
 
-# Lines counter
-lines = 0
+################ SPECTATOR STREAMS ################
 
-# Level counter
-level = 0
+# CLONETRIS_BROADCAST=<file or pipe>[,<file or pipe>...] streams every game
+# played to the given paths, CLONETRIS_WATCH=<file or pipe> watches one and
+# CLONETRIS_WALL=<file or pipe>[,<file or pipe>...] shows many in a grid
+broadcaster = None
+spectator = None
+spectator_source = None
+wall = None
 
-# Push-down points
-push_down_pts = 0
+if environ.get("CLONETRIS_BROADCAST"):
+    broadcaster = spectate.StreamBroadcaster()
+    for stream_path in environ["CLONETRIS_BROADCAST"].split(","):
+        broadcaster.add_sink(open(stream_path, "wb"))
 
-# Added levels
-added_levels = 0
+if environ.get("CLONETRIS_WATCH"):
+    spectator_source = spectate.StreamSource(environ["CLONETRIS_WATCH"])
+    spectator = spectate.StreamDecoder(game.block_matrix)
+    game_state = 4
+
+if environ.get("CLONETRIS_WALL"):
+    wall = gridview.GridView(windowSurface, blocks,
+                             [gridview.BoardView(stream_path) for stream_path in environ["CLONETRIS_WALL"].split(",")])
+    game_state = 6
+
+################## PRACTICE MODE ##################
 
-# Lines to next level
-lines_to_next_level = 0
-
-# Fall timer
-fall_timer = 0
-
-# 10x20 block matrix (stores locked pieces)
-block_matrix = [[0 for x in range(20)] for y in range(10)]
-
-# 10x20 piece matrix (stores moving pieces)
-piece_matrix = [[0 for x in range(20)] for y in range(10)]
-
-################# TETROMINOES #################
-
-# I Piece
-i_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,0 ,0, 0],
-                [0, 1 ,1 ,1 ,1, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 1, 0, 0],
-                [0, 0 ,0 ,1 ,0, 0],
-                [0, 0 ,0 ,1 ,0, 0],
-                [0, 0, 0, 1, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,0 ,0, 0],
-                [0, 1 ,1 ,1 ,1, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 1, 0, 0],
-                [0, 0 ,0 ,1 ,0, 0],
-                [0, 0 ,0 ,1 ,0, 0],
-                [0, 0, 0, 1, 0, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# J Piece
-j_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 2, 2, 2, 0],
-                [0, 0, 2, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 2, 2, 0, 0],
-                [0, 0, 0, 2, 0, 0],
-                [0, 0, 0, 2, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 2, 0],
-                [0, 0, 2, 2, 2, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 2, 0, 0],
-                [0, 0, 0, 2, 0, 0],
-                [0, 0, 0, 2, 2, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# L Piece
-l_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,0 ,0, 0],
-                [0, 0 ,3 ,3 ,3, 0],
-                [0, 0, 0, 0, 3, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,3 ,0, 0],
-                [0, 0 ,0 ,3 ,0, 0],
-                [0, 0, 3, 3, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,3 ,0 ,0, 0],
-                [0, 0 ,3 ,3 ,3, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,3 ,3, 0],
-                [0, 0 ,0 ,3 ,0, 0],
-                [0, 0, 0, 3, 0, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# O Piece
-o_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0 ,4 ,4, 0],
-                [0, 0, 0 ,4 ,4, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0 ,0 ,4 ,4, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# S Piece
-s_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0 ,0 ,0, 0],
-                [0, 0, 0 ,5 ,5, 0],
-                [0, 0, 5, 5, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,5 ,0, 0],
-                [0, 0 ,0 ,5 ,5, 0],
-                [0, 0, 0, 0, 5, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,0 ,0, 0],
-                [0, 0 ,0 ,5 ,5, 0],
-                [0, 0, 5, 5, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,5 ,0, 0],
-                [0, 0 ,0 ,5 ,5, 0],
-                [0, 0, 0, 0, 5, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# T Piece
-t_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0 ,0 ,0, 0],
-                [0, 0, 6 ,6 ,6, 0],
-                [0, 0, 0, 6, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,6 ,0, 0],
-                [0, 0 ,6 ,6 ,0, 0],
-                [0, 0, 0, 6, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,6 ,0, 0],
-                [0, 0 ,6 ,6 ,6, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0 ,0 ,6 ,0, 0],
-                [0, 0 ,0 ,6 ,6, 0],
-                [0, 0, 0, 6, 0, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# Z Piece
-z_tetromino = [[[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0 ,0, 0],
-                [0, 0, 7, 7 ,0, 0],
-                [0, 0, 0, 7, 7, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0 ,0, 7, 0],
-                [0, 0, 0 ,7, 7, 0],
-                [0, 0, 0, 7, 0, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 7, 7, 0, 0],
-                [0, 0, 0, 7, 7, 0],
-                [0, 0, 0, 0, 0, 0]],
-               [[0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 0, 0],
-                [0, 0, 0, 0, 7, 0],
-                [0, 0, 0, 7, 7, 0],
-                [0, 0, 0, 7, 0, 0],
-                [0, 0, 0, 0, 0, 0]]]
-
-# Tetromino List (stored as a 6x6x4x7 matrix (6x6 blocks, 4 rotations, 7 pieces)
-tetrominoes = [i_tetromino, j_tetromino, l_tetromino, o_tetromino, s_tetromino, t_tetromino, z_tetromino]
+# CLONETRIS_PRACTICE=1 keeps a snapshot of every frame of the last
+# REWIND_SECONDS so that holding backspace (or controller button 4) rewinds
+REWIND_SECONDS = 30
+rewind_buffer = None
+is_rewinding = False
+
+if environ.get("CLONETRIS_PRACTICE"):
+    rewind_buffer = snapshot.SnapshotRing(REWIND_SECONDS * 60)
+
+#################### EVENT LOGS ###################
+
+# CLONETRIS_EVENT_DIR=<directory> saves an event log of every game played
+# into that directory (see eventlog.py for aggregating them)
+event_log = None
+
+##################### SPRINTS #####################
+
+# Best sprint times for each start level and the finished sprint's result
+# (the frame each line of the current sprint was cleared on is
+# game.line_frames)
+sprint_records = sprint.SprintRecords.load(get_sprint_records_path())
+sprint_result = None
+
+###################### HINTS ######################
+
+# CLONETRIS_HINTS=1 outlines the best place for each piece (for training),
+# found by a worker process in the background
+HINT_COLOR = (255, 255, 255)
+hint_worker = None
+
+if environ.get("CLONETRIS_HINTS"):
+    hint_worker = hint.HintWorker()
+
+################### GHOST PIECE ###################
+
+# CLONETRIS_GHOST=1 shows where the piece would land, and
+# CLONETRIS_HARD_DROP=1 drops it there at once with space (or the
+# controller's Y button)
+GHOST_COLOR = (255, 255, 255, 64)
+ghost_tile = None
+hard_drop_enabled = bool(environ.get("CLONETRIS_HARD_DROP"))
+
+# The landing row last worked out, and what it was worked out for
+landing_key = None
+landing_row = 0
+
+if environ.get("CLONETRIS_GHOST"):
+    ghost_tile = pygame.Surface((32, 32), pygame.SRCALPHA)
+    ghost_tile.fill(GHOST_COLOR)
+
+################### LIVE STATE ####################
+
+# CLONETRIS_LIVE_STATE=<name> (1 for the default name) publishes the game's
+# state to a shared memory block of that name every frame, for overlays and
+# bots to read (python livestate.py watch shows it)
+live_state = None
+
+if environ.get("CLONETRIS_LIVE_STATE"):
+    live_state_name = environ["CLONETRIS_LIVE_STATE"]
+    live_state = livestate.LiveStateWriter(livestate.DEFAULT_NAME if live_state_name == "1" else live_state_name)
+
+################### LEADERBOARD ###################
+
+# CLONETRIS_LEADERBOARD=<url> uploads every finished game to a leaderboard
+# (in batches, from a background thread, see leaderboard.py), as cabinet
+# CLONETRIS_CABINET (the host name by default). Results wait in
+# CLONETRIS_LEADERBOARD_SPOOL (saved/leaderboard.jsonl) until uploaded.
+game_start_level = 0
+leaderboard_client = None
+
+if environ.get("CLONETRIS_LEADERBOARD"):
+    leaderboard_client = leaderboard.LeaderboardClient(environ["CLONETRIS_LEADERBOARD"],
+                                                       environ.get("CLONETRIS_LEADERBOARD_SPOOL") or leaderboard.DEFAULT_SPOOL,
+                                                       environ.get("CLONETRIS_CABINET"))
+
+############### GARBAGE COLLECTION ################
+
+# Collections run in the game's pauses instead of in the middle of frames
+# (see gcsched.py), CLONETRIS_GC=auto leaves them to CPython. The game
+# collects and freezes everything it loaded just before the main loop.
+# (It's set up before the replays, which can start one right away.)
+gc_scheduler = gcsched.GCScheduler(environ.get("CLONETRIS_GC", "scheduled"))
+
+##################### REPLAYS #####################
+
+# CLONETRIS_RECORD_DIR=<directory> records every game played into that
+# directory, CLONETRIS_REPLAY=<file> plays a recorded game back
+replay_writer = None
+next_keyframe_piece = 0
+replay_reader = None
+replay_inputs = None
+replay_next_input = None
+replay_paused = False
+
+if environ.get("CLONETRIS_REPLAY"):
+    start_replay(environ["CLONETRIS_REPLAY"])
+
+################## ATTRACT MODE ###################
+
+# Demo games for the splash screen come from CLONETRIS_DEMOS (demos.zip
+# next to the game by default, see attract.py for making one). Without an
+# archive the splash screen just waits.
+DEMO_SECONDS = 60
+attract_delay_frames = int(float(environ.get("CLONETRIS_ATTRACT_DELAY", 20)) * 60)
+splash_idle_frames = 0
+demo_stream = None
+demo_archive = None
+
+demos_path = environ.get("CLONETRIS_DEMOS") or path.join(path.dirname(path.abspath(__file__)), "demos.zip")
+if path.exists(demos_path):
+    try:
+        demo_archive = attract.DemoArchive(demos_path)
+    except (OSError, zipfile.BadZipFile) as error:
+        print("Couldn't open the demos in %s: %s" % (demos_path, error))
+    if demo_archive is not None and len(demo_archive) == 0:
+        demo_archive = None
+
+#################### IDLE MODE ####################
+
+# The splash, menu and score screens only change on input, so instead of
+# drawing them 60 times a second the game draws them once and sleeps in
+# pygame.event.wait() until there's input (waking up every IDLE_TIMEOUT
+# seconds anyway, for the demo countdown and the frame timing log).
+# CLONETRIS_IDLE=0 keeps them running frames.
+IDLE_STATES = (0, 1, 3)
+IDLE_TIMEOUT = 0.5
+idle_enabled = environ.get("CLONETRIS_IDLE", "1") != "0"
+
+# The static screen on the display (None while any other scene runs)
+screen_drawn = None
+
+################### ALLOCATIONS ###################
+
+# F11 (or CLONETRIS_ALLOCS=1 from launch) follows the game's allocations
+# frame by frame with tracemalloc and shows them over the game; stopping
+# prints a report per scene (see allocs.py, which also has a budget check)
+allocation_tracker = allocs.AllocationTracker(get_allocation_counters)
+allocation_overlay_lines = []
+
+if environ.get("CLONETRIS_ALLOCS"):
+    allocation_tracker.start()
+
+#################### PROFILING ####################
+
+# F9 (or SIGUSR1) starts and stops a profiling session at any time, and
+# CLONETRIS_PROFILE=1 starts one as soon as the game launches. Sessions are
+# saved to CLONETRIS_PROFILE_DIR (profiles/ next to the game by default).
+# The timeline shows the game's main functions and the rules' clear_lines().
+game_profiler = profiler.Profiler(globals(), ["update", "process_inputs_*", "draw*", "run_game_frame",
+                                              "line_clear_animation"], [(game, "clear_lines")])
+profiler_toggle_requested = bool(environ.get("CLONETRIS_PROFILE"))
+
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, handle_profiler_signal)
 
 ################## MAIN GAME LOOP #################
 
-# Runs the game
-while running:
-    update()
-
-# Quits pygame once done
-pygame.quit()
\ No newline at end of file
+# Runs the game (importing this file instead, like fuzz.py does, sets
+# everything up without running it)
+if __name__ == "__main__":
+    gc_scheduler.freeze()
+    while running:
+        update()
+        if profiler_toggle_requested:
+            toggle_profiler()
+    
+    # Saves the profiling session if one is still running, prints the
+    # allocation report
+    if game_profiler.active:
+        toggle_profiler()
+    if allocation_tracker.active:
+        toggle_allocation_tracker()
+    
+    # Waits for everything to be saved (results that haven't been uploaded
+    # wait in the spool for next time)
+    disk_writer.close()
+    if leaderboard_client:
+        leaderboard_client.close(1.0)
+    if hint_worker:
+        hint_worker.close()
+    if live_state:
+        live_state.close()
+    
+    # Quits pygame once done
+    pygame.quit()